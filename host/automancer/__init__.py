@@ -1 +1,9 @@
 from pr1 import *
+
+
+def __getattr__(name: str):
+  # Kept for compatibility with units which use am.prelude, which is built on first access
+  if name == 'prelude':
+    return get_prelude()
+
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
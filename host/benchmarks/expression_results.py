@@ -0,0 +1,81 @@
+import ast
+import gc
+import time
+import tracemalloc
+
+import numpy as np
+
+from pr1.document import Document
+from pr1.fiber.eval import EvalContext
+from pr1.fiber.expr import EvaluablePythonExpr
+from pr1.reader import LocatedDict, LocatedList, LocatedValue, LocationArea
+from pr1.staticanalysis.context import StaticAnalysisContext
+from pr1.staticanalysis.expr import DeferredExprDef
+from pr1.staticanalysis.expression import evaluate_eval_expr
+from pr1.staticanalysis.support import get_prelude
+
+
+# Previous behavior, which located all children upfront
+def locate_eagerly(obj, area: LocationArea):
+  match obj:
+    case dict():
+      return LocatedDict({ locate_eagerly(key, area): locate_eagerly(value, area) for key, value in obj.items() }, area)
+    case list():
+      return LocatedList([locate_eagerly(item, area) for item in obj], area)
+    case _:
+      return LocatedValue.new(obj, area)
+
+
+def create_expr(source: str):
+  contents = Document.text(source).source
+  analysis, result = evaluate_eval_expr(ast.parse(source, mode='eval').body, ({}, {
+    'data': lambda node: DeferredExprDef('data', node=node, phase=0, symbol=0)
+  }), get_prelude(), StaticAnalysisContext(input_value=contents))
+
+  assert not analysis.errors
+  return EvaluablePythonExpr(contents, result.to_evaluated(), [0])
+
+
+def measure(name: str, data: object):
+  expr = create_expr("data")
+  context = EvalContext({ 0: { 'data': data } })
+
+  gc.collect()
+  tracemalloc.start()
+
+  start_time = time.perf_counter()
+  _, result = expr.evaluate(context)
+  evaluate_time = time.perf_counter() - start_time
+
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  start_time = time.perf_counter()
+  result.inner_value.dislocate() # type: ignore
+  dislocate_time = time.perf_counter() - start_time
+
+  gc.collect()
+  tracemalloc.start()
+
+  start_time = time.perf_counter()
+  locate_eagerly(data, expr.contents.area)
+  eager_time = time.perf_counter() - start_time
+
+  _, eager_peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  print(f"{name}")
+  print(f"  Evaluate: {evaluate_time * 1000:.2f} ms, {peak / 1e6:.1f} MB peak")
+  print(f"  Dislocate: {dislocate_time * 1000:.2f} ms")
+  print(f"  Eager location: {eager_time * 1000:.2f} ms, {eager_peak / 1e6:.1f} MB peak")
+
+
+def main():
+  measure("List of 100k numbers", list(range(100_000)))
+  measure("Nested config", { f"section{index}": { 'values': list(range(100)), 'name': f"Section {index}" } for index in range(1000) })
+  measure("NumPy array of 1M numbers", np.arange(1_000_000))
+  measure("10 MB of bytes", bytes(10_000_000))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,48 @@
+import io
+import time
+
+from pr1.error import DiagnosticDocumentReference
+from pr1.reader import LocatedError, Source, loads2
+
+
+def generate_source(line_count: int):
+  lines = list[str]()
+
+  for index in range(line_count // 4):
+    lines += [
+      f"step{index}:",
+      f"  duration: {index} sec",
+      f"  invalid line {index}",
+      f"  - misplaced item"
+    ]
+
+  return Source("\n".join(lines) + "\n")
+
+
+def main():
+  source = generate_source(10_000)
+
+  start_time = time.perf_counter()
+  analysis, _ = loads2(source)
+  parse_time = time.perf_counter() - start_time
+
+  start_time = time.perf_counter()
+  exported = analysis.export()
+  output = io.StringIO()
+
+  for diagnostic in analysis.errors + analysis.warnings:
+    for ref in diagnostic.references:
+      if isinstance(ref, DiagnosticDocumentReference) and ref.area:
+        output.write(ref.area.format())
+        LocatedError(diagnostic.message, ref.area.enclosing_range()).display(output)
+
+  export_time = time.perf_counter() - start_time
+
+  print(f"Lines: {source.line_count}")
+  print(f"Diagnostics: {len(exported['errors']) + len(exported['warnings'])}")
+  print(f"Parse: {parse_time * 1000:.1f} ms")
+  print(f"Diagnostic export: {export_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
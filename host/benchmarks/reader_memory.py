@@ -0,0 +1,52 @@
+import gc
+import tracemalloc
+
+from pr1.reader import LocatedValue, loads
+
+
+def generate_source(step_count: int):
+  lines = ["name: Generated protocol", "steps:"]
+
+  for index in range(step_count):
+    lines += [
+      f"  - name: Step {index}  # Comment {index}",
+      f"    duration: {index} sec",
+      f"    actions:",
+      f"      - valve: open",
+      f"      - pressure: {index} psi"
+    ]
+
+  return "\n".join(lines) + "\n"
+
+
+def count_located_values(value):
+  count = 1 if isinstance(value, LocatedValue) else 0
+
+  if isinstance(value, dict):
+    count += sum(count_located_values(key) + count_located_values(item) for key, item in value.items())
+  elif isinstance(value, list):
+    count += sum(count_located_values(item) for item in value)
+
+  return count
+
+
+def main():
+  source = generate_source(10_000)
+
+  gc.collect()
+  tracemalloc.start()
+
+  value, _, _ = loads(source)
+
+  gc.collect()
+  current, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  print(f"Lines: {source.count(chr(10))}")
+  print(f"Located values: {count_located_values(value)}")
+  print(f"Retained: {current / 1e6:.1f} MB")
+  print(f"Peak: {peak / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+  main()
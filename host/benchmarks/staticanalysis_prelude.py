@@ -0,0 +1,56 @@
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from pr1.staticanalysis.support import create_prelude
+
+
+IMPORT_SCRIPT = """
+import time
+
+start_time = time.perf_counter()
+import pr1
+import_time = time.perf_counter() - start_time
+
+from pr1.staticanalysis.support import get_prelude
+
+# The prelude must not be built while importing the host
+assert get_prelude.cache_info().currsize == 0
+
+start_time = time.perf_counter()
+get_prelude()
+prelude_time = time.perf_counter() - start_time
+
+print(import_time, prelude_time)
+"""
+
+
+def run_import(count: int):
+  import_times = list[float]()
+  prelude_times = list[float]()
+
+  for _ in range(count):
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], capture_output=True, check=True, cwd=Path(__file__).parent.parent, text=True).stdout
+    import_time, prelude_time = map(float, output.split())
+
+    import_times.append(import_time)
+    prelude_times.append(prelude_time)
+
+  return min(import_times), min(prelude_times)
+
+
+def main():
+  start_time = time.perf_counter()
+  create_prelude()
+  build_time = time.perf_counter() - start_time
+
+  import_time, prelude_time = run_import(5)
+
+  print(f"Prelude build: {build_time * 1000:.1f} ms")
+  print(f"Host import: {import_time * 1000:.1f} ms")
+  print(f"First prelude access after import: {prelude_time * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+  main()
@@ -1,4 +1,5 @@
 import functools
+import hashlib
 from dataclasses import dataclass
 from pathlib import PurePosixPath
 from typing import Any, NewType
@@ -16,6 +17,10 @@ class Document:
   id: DocumentId
   path: PurePosixPath
 
+  @functools.cached_property
+  def content_hash(self):
+    return hashlib.sha256(self.contents.encode()).hexdigest()
+
   @functools.cached_property
   def source(self):
     source = Source(self.contents)
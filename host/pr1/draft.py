@@ -1,17 +1,29 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
 from comserde import serializable
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 import functools
 from pathlib import PurePosixPath
+import threading
+import time
 from typing import Any, Optional, TYPE_CHECKING
 
+from . import logger
 from .document import Document
 
 if TYPE_CHECKING:
-  from .fiber.parser import FiberProtocol, GlobalContext
+  from .fiber.parser import FiberProtocol, GlobalContext, LayerCache
+  from .fiber.profile import CompilationProfile
   from .input import LanguageServiceAnalysis
   from .host import Host
 
 
+class DraftCompilationCancelledError(Exception):
+  pass
+
+
 @serializable
 @dataclass
 class Draft:
@@ -23,20 +35,46 @@ class Draft:
   def entry_document(self):
     return next(document for document in self.documents if document.id == self.entry_document_id)
 
-  def compile(self, *, host: 'Host'):
+  # Drafts with different ids but identical documents share the same key
+  def compilation_key(self, revision: int):
+    return (
+      self.entry_document_id,
+      revision,
+      tuple(sorted((document.id, str(document.path), document.content_hash) for document in self.documents))
+    )
+
+  def compile(
+    self,
+    *,
+    cancel_event: Optional[threading.Event] = None,
+    host: 'Host',
+    layer_cache: 'Optional[LayerCache]' = None,
+    profile: bool = False
+  ):
     from .fiber.parser import FiberParser
+    from .fiber.profile import CompilationProfile
 
     parser = FiberParser(
       draft=self,
+      cancel_event=cancel_event,
       host=host,
-      Parsers=host.manager.Parsers
+      layer_cache=layer_cache,
+      Parsers=host.manager.Parsers,
+      profile=(CompilationProfile() if profile else None)
     )
 
+    if parser.profile:
+      logger.debug(f"Profile of the compilation of draft '{self.id}'")
+      parser.profile.log(logger)
+
     return DraftCompilation(
       analysis=parser.analysis,
       document_paths={self.entry_document.path},
       draft_id=self.id,
-      protocol=parser.protocol
+      profile=parser.profile,
+      protocol=parser.protocol,
+      reused_adoption_count=(layer_cache.adoption_hits if layer_cache else 0),
+      reused_layer_count=(layer_cache.layer_hits if layer_cache else 0)
     )
 
   def export(self):
@@ -62,7 +100,10 @@ class DraftCompilation:
   analysis: 'LanguageServiceAnalysis'
   document_paths: set[PurePosixPath]
   draft_id: str
+  profile: 'Optional[CompilationProfile]' = None
   protocol: 'Optional[FiberProtocol]'
+  reused_adoption_count: int = 0
+  reused_layer_count: int = 0
 
   def export(self, context: 'GlobalContext'):
     return {
@@ -80,5 +121,259 @@ class DraftCompilation:
       },
       "missingDocumentPaths": [], # str(path).split("/") for path in self.document_paths],
       "protocol": self.protocol and self.protocol.export(context),
+      "reusedAdoptionCount": self.reused_adoption_count,
+      "reusedLayerCount": self.reused_layer_count,
       "valid": (not self.analysis.errors)
     }
+
+
+@dataclass(kw_only=True)
+class DraftCompilationExportSnapshot:
+  analysis: dict[str, list[Any]]
+  protocol: Any
+  revision: int
+
+class DraftCompilationExportHistory:
+  """
+  The compilation exports last sent to a client, used to only send differences on subsequent compilations.
+  """
+
+  def __init__(self, *, max_size: int = 16):
+    self.max_size = max_size
+
+    self._next_revision = 0
+    self._snapshots = OrderedDict[str, DraftCompilationExportSnapshot]()
+
+  def encode(self, draft_id: str, export: dict[str, Any], *, base_revision: Optional[int]):
+    from .util.diff import diff_items, diff_json
+
+    previous_snapshot = self._snapshots.pop(draft_id, None)
+
+    snapshot = DraftCompilationExportSnapshot(
+      analysis=dict(export["analysis"]),
+      protocol=export["protocol"],
+      revision=self._next_revision
+    )
+
+    self._next_revision += 1
+    self._snapshots[draft_id] = snapshot
+
+    while len(self._snapshots) > self.max_size:
+      self._snapshots.popitem(last=False)
+
+    # Resynchronize if the client does not have the last sent export
+    if (not previous_snapshot) or (base_revision != previous_snapshot.revision):
+      return {
+        **export,
+        "encoding": "full",
+        "revision": snapshot.revision
+      }
+
+    analysis = dict[str, Any]()
+
+    for key, items in export["analysis"].items():
+      removed, added, snapshot.analysis[key] = diff_items(previous_snapshot.analysis[key], items)
+
+      analysis[key] = {
+        "added": added,
+        "removed": removed
+      }
+
+    return {
+      **export,
+      "analysis": analysis,
+      "baseRevision": previous_snapshot.revision,
+      "encoding": "diff",
+      "protocol": diff_json(previous_snapshot.protocol, export["protocol"]),
+      "revision": snapshot.revision
+    }
+
+
+DraftCompilationKey = tuple[str, int, tuple[tuple[str, str, str], ...]]
+
+class DraftCompilationCache:
+  def __init__(self, *, max_size: int = 16):
+    self.hits = 0
+    self.max_size = max_size
+    self.misses = 0
+
+    self._compilations = OrderedDict[DraftCompilationKey, DraftCompilation]()
+    self._layer_caches = OrderedDict[str, 'LayerCache']()
+
+  def clear(self):
+    self._compilations.clear()
+    self._layer_caches.clear()
+
+  def compile(self, draft: Draft, *, cancel_event: Optional[threading.Event] = None, host: 'Host', profile: bool = False):
+    key = draft.compilation_key(host.manager.revision)
+
+    # A profiled compilation is never read from the cache as it would not reflect the work done
+    compilation = self._compilations.get(key) if not profile else None
+
+    if compilation:
+      self._compilations.move_to_end(key)
+      self.hits += 1
+
+      # The compilation might have been created for another draft with the same documents
+      if compilation.draft_id != draft.id:
+        compilation = replace(
+          compilation,
+          draft_id=draft.id,
+          protocol=(replace(compilation.protocol, draft=draft) if compilation.protocol else None)
+        )
+
+      return compilation
+
+    self.misses += 1
+
+    layer_cache = self._get_layer_cache(draft.id)
+    compilation = draft.compile(cancel_event=cancel_event, host=host, layer_cache=layer_cache, profile=profile)
+    self._compilations[key] = compilation
+
+    while len(self._compilations) > self.max_size:
+      self._compilations.popitem(last=False)
+
+    return compilation
+
+  def _get_layer_cache(self, draft_id: str, /):
+    from .fiber.parser import LayerCache
+
+    layer_cache = self._layer_caches.get(draft_id)
+
+    if layer_cache:
+      self._layer_caches.move_to_end(draft_id)
+    else:
+      layer_cache = LayerCache()
+      self._layer_caches[draft_id] = layer_cache
+
+      while len(self._layer_caches) > self.max_size:
+        self._layer_caches.popitem(last=False)
+
+    return layer_cache
+
+
+@dataclass(kw_only=True)
+class DraftCompilationResult:
+  compilation: DraftCompilation
+  compile_time: float
+  queue_time: float
+
+@dataclass(kw_only=True)
+class DraftCompilationTask:
+  cancel_event: threading.Event = field(default_factory=threading.Event)
+  future: 'asyncio.Future[DraftCompilationResult]'
+  queued_at: float
+  successor: 'Optional[DraftCompilationTask]' = None
+
+class DraftCompilationWorker:
+  """
+  Compiles drafts on a dedicated thread, one at a time, to avoid blocking the event loop.
+
+  A compilation of a draft supersedes the pending or ongoing compilation of the same draft, which is then cancelled and
+  resolved with the result of the newer compilation, or compiled again if the newer compilation is itself cancelled.
+
+  Compilations read the host's state from the worker thread, such as the plugin manager's units and parsers and the
+  device tree, which must therefore only be modified from the event loop while compilations are held with `hold()`.
+  """
+
+  def __init__(self, cache: DraftCompilationCache):
+    self.cache = cache
+
+    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="draft-compilation")
+    self._tasks = dict[str, DraftCompilationTask]()
+
+  @contextlib.asynccontextmanager
+  async def hold(self):
+    """
+    Waits for the ongoing compilation, if any, to finish and prevents other compilations from starting until the
+    context is exited.
+    """
+
+    loop = asyncio.get_running_loop()
+    held = loop.create_future()
+    release_event = threading.Event()
+
+    def hold():
+      loop.call_soon_threadsafe(lambda: held.done() or held.set_result(None))
+      release_event.wait()
+
+    hold_future = loop.run_in_executor(self._executor, hold)
+
+    try:
+      await held
+      yield
+    finally:
+      release_event.set()
+      await hold_future
+
+  async def compile(self, draft: Draft, *, host: 'Host', profile: bool = False, supersede: bool = True):
+    loop = asyncio.get_running_loop()
+    task = DraftCompilationTask(
+      future=loop.create_future(),
+      queued_at=time.perf_counter()
+    )
+
+    if supersede:
+      if (previous_task := self._tasks.get(draft.id)):
+        previous_task.cancel_event.set()
+        previous_task.successor = task
+
+      self._tasks[draft.id] = task
+
+    try:
+      while True:
+        if (successor := task.successor):
+          try:
+            result = await asyncio.shield(successor.future)
+            break
+          except asyncio.CancelledError:
+            current_task = asyncio.current_task()
+
+            if (not successor.future.cancelled()) or (current_task and current_task.cancelling()):
+              raise
+
+          # The successor was cancelled by its own caller, in which case the newest compilation of the draft is awaited
+          # instead, or the draft is compiled again if there is none
+          task.cancel_event = threading.Event()
+          task.successor = self._tasks.get(draft.id)
+
+          if not task.successor:
+            self._tasks[draft.id] = task
+
+          continue
+
+        try:
+          result = await loop.run_in_executor(self._executor, functools.partial(self._compile, draft, host=host, profile=profile, task=task))
+          break
+        except DraftCompilationCancelledError:
+          assert task.successor
+    except asyncio.CancelledError:
+      task.cancel_event.set()
+      task.future.cancel()
+      raise
+    except Exception as e:
+      task.future.set_exception(e)
+
+      # Mark the exception as retrieved as there might not be a predecessor awaiting it
+      task.future.exception()
+      raise
+    finally:
+      if self._tasks.get(draft.id) is task:
+        del self._tasks[draft.id]
+
+    task.future.set_result(result)
+    return result
+
+  def _compile(self, draft: Draft, *, host: 'Host', profile: bool, task: DraftCompilationTask):
+    started_at = time.perf_counter()
+
+    if task.cancel_event.is_set():
+      raise DraftCompilationCancelledError
+
+    compilation = self.cache.compile(draft, cancel_event=task.cancel_event, host=host, profile=profile)
+
+    return DraftCompilationResult(
+      compilation=compilation,
+      compile_time=(time.perf_counter() - started_at),
+      queue_time=(started_at - task.queued_at)
+    )
@@ -1,18 +1,25 @@
+import bisect
 import functools
 import itertools
+import json
+import os
 import pickle
+import tempfile
 import time
 from dataclasses import dataclass, field
 from pathlib import Path
 from pprint import pprint
-from typing import TYPE_CHECKING, Any, NewType, Optional, Self
+from typing import (TYPE_CHECKING, Any, Iterable, Iterator, NewType, Optional,
+                    Self, TypeVar)
 
 import comserde
 
+from . import logger
 from .fiber.parser import BaseProgramLocation, GlobalContext
 from .history import TreeAdditionChange, TreeRemovalChange, TreeUpdateChange
 from .master.analysis import MasterAnalysis
-from .report import ExperimentReportEvent, ExperimentReportHeader
+from .report import (ExperimentReportEvent, ExperimentReportFrameReader,
+                     ExperimentReportHeader, ExperimentReportPosition)
 from .util.misc import Exportable, HierarchyNode, IndexCounter
 
 if TYPE_CHECKING:
@@ -21,6 +28,8 @@ if TYPE_CHECKING:
 
 EventIndex = NewType('EventIndex', int)
 
+T = TypeVar('T')
+
 @dataclass
 class ReportStaticEntry:
   occurence_count: int = 0
@@ -36,93 +45,378 @@ class ReportStaticEntry:
       }
     }
 
+  def export_flat(self, path: list[int] = []) -> Iterator[tuple[list[int], Any]]:
+    # Entries are exported in pre-order, each with its path relative to this entry and without children
+    yield path, {
+      "occurenceCount": self.occurence_count,
+      "occurences": self.occurences
+    }
+
+    for child_id, child in self.children.items():
+      yield from child.export_flat([*path, child_id])
+
+
+@dataclass(frozen=True, kw_only=True)
+class ReportSnapshotEntry:
+  block_child_id: int
+  location: Optional[BaseProgramLocation]
+  parent_index: int
+
+@dataclass(frozen=True, kw_only=True)
+class ReportSnapshot:
+  entries: dict[int, ReportSnapshotEntry]
+  event_index: EventIndex
+  position: ExperimentReportPosition
+
+
+class ReportReplay:
+  """
+  The entry tree of a report, as obtained by replaying changes of its events.
+  """
+
+  def __init__(self, *, root_static_entry: Optional[ReportStaticEntry] = None):
+    self.entries = dict[int, ReportEntry]()
+    self.entry_counter = IndexCounter(start=1)
+    self.entries[0] = ReportEntry(
+      index=0,
+      location=None,
+      static_counterpart=root_static_entry
+    )
+
+  @property
+  def root_entry(self):
+    return self.entries.get(1)
+
+  def apply(self, event: ExperimentReportEvent, event_index: EventIndex):
+    entries = self.entries
+
+    for change in event.changes:
+      match change:
+        case TreeAdditionChange():
+          parent_entry = entries[change.parent_index]
+          parent_static_entry = parent_entry.static_counterpart
+
+          entry_index = self.entry_counter.new()
+          entry = ReportEntry(
+            index=entry_index,
+            location=change.location,
+            static_counterpart=(parent_static_entry.children.setdefault(change.block_child_id, ReportStaticEntry()) if parent_static_entry else None)
+          )
+
+          if (static_entry := entry.static_counterpart):
+            if (static_entry.occurence_count < 20) or event.analysis:
+              static_entry.occurences.append((event_index, None))
+
+            static_entry.occurence_count += 1
+
+          entries[entry_index] = entry
+          parent_entry.children[change.block_child_id] = entry
+          entry.parent = (parent_entry, change.block_child_id)
+        case TreeUpdateChange():
+          entries[change.index].location = change.location
+        case TreeRemovalChange():
+          entry = entries[change.index]
+
+          if (static_entry := entry.static_counterpart):
+            static_entry.occurences[-1] = (static_entry.occurences[-1][0], event_index)
+
+          del entries[change.index]
+
+          if entry.parent:
+            del entry.parent[0].children[entry.parent[1]]
+
+          self.entry_counter.delete(change.index)
+
+  def snapshot(self, event_index: EventIndex, position: ExperimentReportPosition):
+    # Locations are replaced rather than modified by changes, and can therefore be shared with the snapshot
+    return ReportSnapshot(
+      entries={
+        entry_index: ReportSnapshotEntry(
+          block_child_id=entry.parent[1],
+          location=entry.location,
+          parent_index=entry.parent[0].index
+        ) for entry_index, entry in self.entries.items() if entry.parent
+      },
+      event_index=event_index,
+      position=position
+    )
+
+  @classmethod
+  def restore(cls, snapshot: ReportSnapshot, /, *, root_static_entry: Optional[ReportStaticEntry] = None):
+    replay = cls(root_static_entry=root_static_entry)
+
+    for entry_index, snapshot_entry in snapshot.entries.items():
+      replay.entries[entry_index] = ReportEntry(index=entry_index, location=snapshot_entry.location)
+
+    for entry_index, snapshot_entry in snapshot.entries.items():
+      entry = replay.entries[entry_index]
+      parent_entry = replay.entries[snapshot_entry.parent_index]
+
+      parent_entry.children[snapshot_entry.block_child_id] = entry
+      entry.parent = (parent_entry, snapshot_entry.block_child_id)
+
+    replay.entry_counter._items = set(snapshot.entries.keys())
+
+    # Static counterparts are found by following the same path in the static entry tree
+    if root_static_entry:
+      def find_static_counterpart(entry: ReportEntry) -> ReportStaticEntry:
+        if (not entry.static_counterpart) and entry.parent:
+          parent_entry, block_child_id = entry.parent
+          entry.static_counterpart = find_static_counterpart(parent_entry).children.setdefault(block_child_id, ReportStaticEntry())
+
+        assert entry.static_counterpart
+        return entry.static_counterpart
+
+      for entry in replay.entries.values():
+        find_static_counterpart(entry)
+
+    return replay
+
+
+REPORT_SUMMARY_VERSION = 4
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+EVENT_EXPORT_BATCH_SIZE = 64
+ROOT_FRAGMENT_SIZE = 64 * 1024
+
+def chunk_exported_items(items: Iterable[T], /, *, max_size: int) -> Iterator[list[T]]:
+  # Sizes are estimated from the JSON encoding of each item, and a chunk always contains at least one item
+  chunk = list[T]()
+  chunk_size = 0
+
+  for item in items:
+    item_size = len(json.dumps(item, default=str))
+
+    if chunk and (chunk_size + item_size > max_size):
+      yield chunk
+
+      chunk = list[T]()
+      chunk_size = 0
+
+    chunk.append(item)
+    chunk_size += item_size
+
+  if chunk:
+    yield chunk
+
+@dataclass(kw_only=True)
+class ExperimentReportSummary:
+  end_snapshot: ReportSnapshot
+  end_time: float
+  master_analysis: MasterAnalysis
+  report_mtime_ns: int
+  report_size: int
+  root_static_entry: ReportStaticEntry
+  snapshots: list[ReportSnapshot]
+  version: int = REPORT_SUMMARY_VERSION
+
 
 class ExperimentReportReader:
-  def __init__(self, path: Path, /):
+  """
+  A reader of experiment reports.
+
+  The report is scanned once when the reader is created, recording a snapshot of the entry tree every
+  `snapshot_event_interval` events or `snapshot_size_interval` bytes, whichever comes first. Exporting an event then
+  only replays events following the closest preceding snapshot.
+
+  The result of the scan is saved in a summary file next to the report, which is used instead of scanning the report
+  again as long as the report's size and modification time are unchanged.
+
+  When following a report that is still being written, events appended to the report are read by calling `refresh()`,
+  starting from the end of the last complete event. No summary is saved and truncated blocks are left for later reads
+  rather than recovered.
+  """
+
+  def __init__(self, path: Path, /, *, follow: bool = False, snapshot_event_interval: int = 100, snapshot_size_interval: int = (1024 * 1024)):
+    self.follow = follow
+
     self._path = path
+    self._snapshot_event_interval = snapshot_event_interval
+    self._snapshot_size_interval = snapshot_size_interval
 
     with self._get_file() as file:
-      self.header: ExperimentReportHeader = comserde.load(file, ExperimentReportHeader)
-      self._header_size = file.tell()
+      frame_reader = ExperimentReportFrameReader(file)
+      header = frame_reader.read(ExperimentReportHeader)
+
+      if header is None:
+        raise Exception("Invalid report")
+
+      self.header = header
+
+      header_position = frame_reader.tell()
+      report_stat = os.fstat(file.fileno())
+
+    if (not follow) and (summary := self._load_summary(report_stat)):
+      self.end_time = summary.end_time
+      self.event_count = summary.end_snapshot.event_index
+      self.master_analysis = summary.master_analysis
+      self.root_static_entry = summary.root_static_entry
+
+      self._end_snapshot: Optional[ReportSnapshot] = summary.end_snapshot
+      self._position = summary.end_snapshot.position
+      self._read_size = report_stat.st_size
+      self._replay: Optional[ReportReplay] = None
+      self._snapshots = summary.snapshots
+    else:
+      self.end_time = self.header.start_time
+      self.event_count = 0
+      self.master_analysis = MasterAnalysis()
+      self.root_static_entry = ReportStaticEntry()
 
-    self.master_analysis = MasterAnalysis()
+      self._end_snapshot = None
+      self._position = header_position
+      self._read_size = 0
+      self._replay = ReportReplay(root_static_entry=self.root_static_entry)
+      self._snapshots = list[ReportSnapshot]()
 
-    for event_index, event, root_entry in self._iter_events():
-      self.end_time = event.time
+      self._read_events()
 
-      if event.analysis:
-        self.master_analysis += event.analysis
+      if not follow:
+        self._save_summary(report_stat)
 
-      # if root_entry:
-      #   print(root_entry.format_hierarchy())
-      #   print()
+  @property
+  def summary_path(self):
+    return self._path.with_suffix(".summary")
 
-  def _iter_events(self):
-    with self._get_file() as file:
-      file.seek(self._header_size)
+  def _load_summary(self, report_stat: os.stat_result):
+    try:
+      with self.summary_path.open("rb") as file:
+        summary = pickle.load(file)
+    except FileNotFoundError:
+      return None
+    except Exception:
+      logger.warning(f"Failed to load report summary at {self.summary_path}")
+      return None
+
+    if (
+      (not isinstance(summary, ExperimentReportSummary)) or
+      (summary.version != REPORT_SUMMARY_VERSION) or
+      (summary.report_mtime_ns != report_stat.st_mtime_ns) or
+      (summary.report_size != report_stat.st_size)
+    ):
+      return None
 
-      entries = dict[int, ReportEntry]()
-      entry_counter = IndexCounter(start=1)
+    return summary
 
-      self.root_static_entry = ReportStaticEntry()
+  def _save_summary(self, report_stat: os.stat_result):
+    assert self._replay
 
-      entries[0] = ReportEntry(
-        index=0,
-        location=None,
-        static_counterpart=self.root_static_entry
-      )
+    summary = ExperimentReportSummary(
+      end_snapshot=self._replay.snapshot(EventIndex(self.event_count), self._position),
+      end_time=self.end_time,
+      master_analysis=self.master_analysis,
+      report_mtime_ns=report_stat.st_mtime_ns,
+      report_size=report_stat.st_size,
+      root_static_entry=self.root_static_entry,
+      snapshots=self._snapshots
+    )
 
-      for raw_event_index in itertools.count():
-        event_index = EventIndex(raw_event_index)
+    temp_path: Optional[Path] = None
 
+    # The summary is only an optimization, hence errors such as unpicklable values are logged rather than raised
+    try:
+      with tempfile.NamedTemporaryFile("wb", delete=False, dir=self.summary_path.parent, prefix=".summary-") as file:
+        temp_path = Path(file.name)
+        pickle.dump(summary, file)
+
+      os.replace(temp_path, self.summary_path)
+    except Exception:
+      logger.exception(f"Failed to save report summary at {self.summary_path}")
+
+      if temp_path:
         try:
-          event: ExperimentReportEvent = comserde.load(file, ExperimentReportEvent)
-        except comserde.DeserializationError:
+          temp_path.unlink(missing_ok=True)
+        except OSError:
+          pass
+
+  def _read_events(self):
+    assert self._replay
+
+    with self._get_file() as file:
+      # The size is obtained first such that data appended while reading is read again by the next refresh
+      self._read_size = os.fstat(file.fileno()).st_size
+
+      frame_reader = ExperimentReportFrameReader(file, recover=(not self.follow))
+      frame_reader.seek(self._position)
+
+      last_snapshot_offset = self._snapshots[-1].position[0] if self._snapshots else -1
+
+      while True:
+        event_index = EventIndex(self.event_count)
+        offset, _ = self._position
+
+        if (not self._snapshots) or (event_index - self._snapshots[-1].event_index >= self._snapshot_event_interval) or (offset - last_snapshot_offset >= self._snapshot_size_interval):
+          self._snapshots.append(self._replay.snapshot(event_index, self._position))
+          last_snapshot_offset = offset
+
+        event = frame_reader.read(ExperimentReportEvent)
+
+        if event is None:
           break
 
-        for change in event.changes:
-          match change:
-            case TreeAdditionChange():
-              parent_entry = entries[change.parent_index]
+        self.event_count += 1
+        self._position = frame_reader.tell()
+        self._replay.apply(event, event_index)
 
-              entry_index = entry_counter.new()
-              entry = ReportEntry(
-                index=entry_index,
-                location=change.location,
-                static_counterpart=parent_entry.static_counterpart.children.setdefault(change.block_child_id, ReportStaticEntry())
-              )
+        self.end_time = event.time
 
-              if (entry.static_counterpart.occurence_count < 20) or event.analysis:
-                entry.static_counterpart.occurences.append((event_index, None))
+        if event.analysis:
+          self.master_analysis += event.analysis
 
-              entry.static_counterpart.occurence_count += 1
+  def refresh(self):
+    """
+    Reads events appended to the report since it was last read.
 
-              entries[entry_index] = entry
-              parent_entry.children[change.block_child_id] = entry
-              entry.parent = (parent_entry, change.block_child_id)
-            case TreeUpdateChange():
-              entries[change.index].location = change.location
-            case TreeRemovalChange():
-              entry = entries[change.index]
-              entry.static_counterpart.occurences[-1] = (entry.static_counterpart.occurences[-1][0], event_index)
+    Returns
+      The range of indices of new events.
+    """
 
-              del entries[change.index]
+    start_event_count = self.event_count
 
-              if entry.parent:
-                del entry.parent[0].children[entry.parent[1]]
+    if self._path.stat().st_size != self._read_size:
+      if not self._replay:
+        assert self._end_snapshot
+        self._replay = ReportReplay.restore(self._end_snapshot, root_static_entry=self.root_static_entry)
 
-              entry_counter.delete(change.index)
+      self._read_events()
 
-        yield event_index, event, entries.get(1)
+    return range(start_event_count, self.event_count)
 
   def _get_file(self):
     return self._path.open("rb")
 
   def export_events(self, context: GlobalContext, event_indices: set[EventIndex], /):
     result = dict[EventIndex, Any]()
+    snapshot_event_indices = [snapshot.event_index for snapshot in self._snapshots]
+
+    with self._get_file() as file:
+      frame_reader = ExperimentReportFrameReader(file)
+      next_event_index: Optional[EventIndex] = None
+      replay: Optional[ReportReplay] = None
+
+      for event_index in sorted(event_indices):
+        if not (0 <= event_index < self.event_count):
+          continue
+
+        snapshot = self._snapshots[bisect.bisect_right(snapshot_event_indices, event_index) - 1]
+
+        # Continue from the previous event unless a closer snapshot is available
+        if (replay is None) or (next_event_index is None) or (next_event_index < snapshot.event_index):
+          replay = ReportReplay.restore(snapshot)
+          next_event_index = snapshot.event_index
+          frame_reader.seek(snapshot.position)
+
+        while True:
+          event = frame_reader.read(ExperimentReportEvent)
+          assert event
+          replay.apply(event, next_event_index)
+          next_event_index = EventIndex(next_event_index + 1)
+
+          if next_event_index > event_index:
+            break
+
+        root_entry = replay.root_entry
 
-    for event_index, event, root_entry in self._iter_events():
-      if event_index in event_indices:
         result[event_index] = {
           "date": (event.time * 1000),
           "location": root_entry and root_entry.export(context)
@@ -138,6 +432,92 @@ class ExperimentReportReader:
       "rootStaticEntry": self.root_static_entry.children[0].export()
     }
 
+  def export_chunks(self, context: GlobalContext, /, *, max_chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Exports the report in chunks of about `max_chunk_size` bytes once encoded.
+
+    The first chunk contains the fixed-size information of `export()`. The draft's documents, the root block, the items
+    of the initial and master analyses and the static entry tree, all of which grow with the protocol or the run, are
+    sent in following chunks:
+
+    - "draftDocuments" chunks with the draft's documents;
+    - "root" chunks with fragments of the JSON encoding of the root block, to be concatenated;
+    - "analysisItems" chunks with items as `[analysis, kind, item]`, where `analysis` is "initial" or "master" and
+      `kind` is e.g. "errors";
+    - "staticEntries" chunks with a flat list of static entries in pre-order, each with its path relative to the root
+      static entry.
+    """
+
+    header = self.header
+    draft_export = header.draft.export()
+
+    yield {
+      "type": "info",
+      "info": {
+        "draft": {
+          "entryDocumentId": draft_export["entryDocumentId"],
+          "id": draft_export["id"]
+        },
+        "endDate": (self.end_time * 1000),
+        "eventCount": self.event_count,
+        "name": header.name,
+        "startDate": (header.start_time * 1000)
+      }
+    }
+
+    def export_items(message_type: str, key: str, items: list[Any]):
+      exported_count = 0
+
+      for chunk in chunk_exported_items(items, max_size=max_chunk_size):
+        exported_count += len(chunk)
+
+        yield {
+          "type": message_type,
+          key: chunk,
+          "progress": {
+            "done": exported_count,
+            "total": len(items)
+          }
+        }
+
+    yield from export_items("draftDocuments", "documents", draft_export["documents"])
+
+    encoded_root = json.dumps(header.root.export(context), default=str)
+    yield from export_items("root", "fragments", [encoded_root[index:(index + ROOT_FRAGMENT_SIZE)] for index in range(0, len(encoded_root), ROOT_FRAGMENT_SIZE)])
+
+    yield from export_items("analysisItems", "items", [
+      [analysis_name, kind, item]
+      for analysis_name, analysis_export in [("initial", header.analysis.export()), ("master", self.master_analysis.export())]
+      for kind, items in analysis_export.items()
+      for item in items
+    ])
+
+    if (root_static_entry := self.root_static_entry.children.get(0)):
+      yield from export_items("staticEntries", "entries", list(root_static_entry.export_flat()))
+
+  def export_events_chunks(self, context: GlobalContext, event_indices: set[EventIndex], /, *, max_chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Exports events in chunks of about `max_chunk_size` bytes once encoded, in increasing order of index.
+    """
+
+    sorted_event_indices = sorted(event_index for event_index in event_indices if 0 <= event_index < self.event_count)
+    exported_count = 0
+
+    for batch_start in range(0, len(sorted_event_indices), EVENT_EXPORT_BATCH_SIZE):
+      exported_events = self.export_events(context, set(sorted_event_indices[batch_start:(batch_start + EVENT_EXPORT_BATCH_SIZE)]))
+
+      for chunk in chunk_exported_items(sorted(exported_events.items()), max_size=max_chunk_size):
+        exported_count += len(chunk)
+
+        yield {
+          "type": "events",
+          "events": dict(chunk),
+          "progress": {
+            "done": exported_count,
+            "total": len(sorted_event_indices)
+          }
+        }
+
 
 @dataclass(kw_only=True)
 class ReportEntry(Exportable, HierarchyNode):
@@ -145,7 +525,7 @@ class ReportEntry(Exportable, HierarchyNode):
   index: int
   location: Optional[BaseProgramLocation] = None
   parent: Optional[tuple[Self, int]] = None
-  static_counterpart: ReportStaticEntry
+  static_counterpart: Optional[ReportStaticEntry] = None
 
   def __get_node_name__(self):
     return f"[{self.index}] " + (f"\x1b[37m{self.location!r}\x1b[0m" if self.location else "<no change>")
@@ -198,11 +578,18 @@ class Experiment:
 
   @property
   def report_reader(self):
+    # The report of a running experiment is followed rather than read again
     if not self._report_reader:
-      self._report_reader = ExperimentReportReader(self.report_path)
+      self.load_report(follow=(self.master is not None))
+    elif self._report_reader.follow:
+      self._report_reader.refresh()
 
+    assert self._report_reader
     return self._report_reader
 
+  def load_report(self, *, follow: bool = False):
+    self._report_reader = ExperimentReportReader(self.report_path, follow=follow)
+
   def prepare(self):
     self._report_reader = None
 
@@ -0,0 +1,218 @@
+import asyncio
+from asyncio import Event, Future, Task
+from dataclasses import dataclass, field
+from typing import Any, AsyncGenerator, Optional
+
+from .. import logger
+from ..staticanalysis.expr import BaseExprEval, BaseExprWatch, Dependency
+
+
+logger = logger.getChild("dependency")
+
+
+@dataclass(eq=False, kw_only=True)
+class DependencyGraphSubscription:
+  event: Event = field(default_factory=Event)
+
+@dataclass(eq=False, kw_only=True)
+class DependencyGraphExpression:
+  dependencies: set[Dependency]
+  error: Optional[Exception] = None
+  expr: BaseExprEval
+  initialization: Optional[Task[None]] = None
+  initialized: bool = False
+  subscriptions: set[DependencyGraphSubscription] = field(default_factory=set)
+  value: Any = None
+  watched: BaseExprWatch
+
+  def evaluate(self, changed_dependencies: set[Dependency]):
+    try:
+      self.value = self.watched.evaluate(changed_dependencies)
+    except Exception as e:
+      self.error = e
+    else:
+      self.error = None
+
+  def notify(self):
+    for subscription in self.subscriptions:
+      subscription.event.set()
+
+@dataclass(eq=False, kw_only=True)
+class DependencyGraphDependency:
+  expressions: set[DependencyGraphExpression] = field(default_factory=set)
+  ready: Future[None]
+  task: Optional[Task[None]] = None
+
+
+class DependencyGraph:
+  """
+  A graph of watched expressions shared by all programs of a master.
+
+  Each dependency is watched once, regardless of the number of expressions which use it. Changes are collected until
+  the next iteration of the event loop, after which each expression affected by a change is evaluated once and its
+  subscribers are notified. Components of an expression which do not depend on any changed dependency keep their
+  cached value.
+  """
+
+  def __init__(self):
+    self._changed_dependencies = set[Dependency]()
+    self._dependencies = dict[Dependency, DependencyGraphDependency]()
+    self._expressions = dict[int, DependencyGraphExpression]()
+    self._flush_handle: Optional[asyncio.Handle] = None
+
+  @property
+  def dependency_count(self):
+    return len(self._dependencies)
+
+  @property
+  def expression_count(self):
+    return len(self._expressions)
+
+  async def watch(self, expr: BaseExprEval, /) -> AsyncGenerator[Any, None]:
+    """
+    Watches the value of an expression.
+
+    The first value is yielded once all dependencies of the expression have been initialized. Later values are
+    yielded when any of these dependencies changes, skipping intermediate values if the consumer is slower than changes
+    occur. Exceptions raised by the expression or its dependencies are re-raised in the consumer.
+    """
+
+    expression = self._expressions.get(id(expr))
+    subscription = DependencyGraphSubscription()
+
+    if not expression:
+      watched = expr.to_watched()
+      expression = DependencyGraphExpression(
+        dependencies=set(watched.dependencies),
+        expr=expr,
+        watched=watched
+      )
+
+      self._expressions[id(expr)] = expression
+
+    expression.subscriptions.add(subscription)
+
+    # The initialization runs in a task owned by the graph such that cancelling a subscriber does not affect others
+    try:
+      while not expression.initialized:
+        if not expression.initialization:
+          expression.initialization = asyncio.create_task(self._initialize(expression))
+
+        initialization = expression.initialization
+
+        try:
+          await asyncio.shield(initialization)
+        except asyncio.CancelledError:
+          current_task = asyncio.current_task()
+
+          if (not initialization.cancelled()) or (current_task and current_task.cancelling()):
+            raise
+
+          # The initialization itself was cancelled, in which case it is restarted
+          if expression.initialization is initialization:
+            expression.initialization = None
+    except BaseException:
+      self._unsubscribe(expression, subscription)
+      raise
+
+    try:
+      while True:
+        if expression.error:
+          raise expression.error
+
+        yield expression.value
+
+        await subscription.event.wait()
+        subscription.event.clear()
+    finally:
+      self._unsubscribe(expression, subscription)
+
+  async def _initialize(self, expression: DependencyGraphExpression):
+    for dependency in expression.dependencies:
+      self._acquire(dependency, expression)
+
+    await asyncio.gather(*[asyncio.shield(self._dependencies[dependency].ready) for dependency in expression.dependencies])
+
+    expression.evaluate(expression.dependencies)
+    expression.initialized = True
+
+  def _acquire(self, dependency: Dependency, expression: DependencyGraphExpression):
+    if not (entry := self._dependencies.get(dependency)):
+      entry = DependencyGraphDependency(ready=asyncio.get_running_loop().create_future())
+      entry.task = asyncio.create_task(self._watch_dependency(dependency, entry))
+      self._dependencies[dependency] = entry
+
+    entry.expressions.add(expression)
+
+  def _unsubscribe(self, expression: DependencyGraphExpression, subscription: DependencyGraphSubscription):
+    expression.subscriptions.discard(subscription)
+
+    if expression.subscriptions or (self._expressions.get(id(expression.expr)) is not expression):
+      return
+
+    del self._expressions[id(expression.expr)]
+
+    if expression.initialization:
+      expression.initialization.cancel()
+
+    for dependency in expression.dependencies:
+      entry = self._dependencies.get(dependency)
+
+      if entry:
+        entry.expressions.discard(expression)
+
+        if not entry.expressions:
+          del self._dependencies[dependency]
+
+          if entry.task:
+            entry.task.cancel()
+
+  async def _watch_dependency(self, dependency: Dependency, entry: DependencyGraphDependency):
+    try:
+      it = aiter(dependency.watch())
+      await anext(it)
+
+      entry.ready.set_result(None)
+
+      async for _ in it:
+        self._changed_dependencies.add(dependency)
+
+        if not self._flush_handle:
+          self._flush_handle = asyncio.get_running_loop().call_soon(self._flush)
+    except Exception as e:
+      logger.debug(f"Failed to watch {dependency!r}")
+
+      # The dependency will be watched again by the next expression which uses it
+      if self._dependencies.get(dependency) is entry:
+        del self._dependencies[dependency]
+
+      if not entry.ready.done():
+        entry.ready.set_exception(e)
+        entry.ready.exception()
+      else:
+        for expression in entry.expressions:
+          expression.error = e
+          expression.notify()
+
+  def _flush(self):
+    self._flush_handle = None
+
+    changed_dependencies = self._changed_dependencies
+    self._changed_dependencies = set()
+
+    expressions = dict[int, DependencyGraphExpression]()
+
+    for dependency in changed_dependencies:
+      if (entry := self._dependencies.get(dependency)):
+        for expression in entry.expressions:
+          if expression.initialized:
+            expressions[id(expression)] = expression
+
+    for expression in expressions.values():
+      expression.evaluate(changed_dependencies)
+      expression.notify()
+
+
+__all__ = [
+  'DependencyGraph'
+]
@@ -1,11 +1,14 @@
 from dataclasses import KW_ONLY, dataclass, field
 from pathlib import Path
-from typing import Any, NewType, Optional
+from typing import TYPE_CHECKING, Any, NewType, Optional
 
 from ..error import Diagnostic, DiagnosticDocumentReference
 from ..reader import LocatedString, LocatedValue, LocationArea
 from ..staticanalysis.expr import BaseExprDefFactory
 
+if TYPE_CHECKING:
+  from .dependency import DependencyGraph
+
 
 @dataclass
 class EvalEnvValue:
@@ -38,6 +41,8 @@ class EvalContext:
   stack: Optional[EvalStack]
   _: KW_ONLY
   cwd_path: Optional[Path] = None
+  dependency_graph: 'Optional[DependencyGraph]' = None
+  evaluation_timeout: Optional[float] = None
 
 @dataclass
 class EvalOptions:
@@ -1,13 +1,20 @@
 import ast
+import asyncio
 import builtins
+import contextvars
+import copy
 import functools
 import re
+import threading
 import traceback
 from abc import ABC, abstractmethod
-from dataclasses import KW_ONLY, dataclass
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import KW_ONLY, dataclass, replace
 from enum import Enum
 from types import EllipsisType, NoneType
-from typing import Any, Callable, Generic, Literal, TypeVar, cast, overload
+from typing import (Any, Callable, Generic, Hashable, Literal, Optional, TypeVar,
+                    cast, overload)
 
 from quantops import Quantity
 
@@ -20,12 +27,14 @@ from ..reader import (LocatedString, LocatedValue, LocationArea,
                       PossiblyLocatedValue)
 from ..staticanalysis.context import StaticAnalysisContext
 from ..staticanalysis.expr import (BaseExprDefFactory, BaseExprEval,
-                                   ConstantExprEval, Dependency, EvaluationError,
+                                   CompositeExprEval, ConstantExprEval,
+                                   Dependency, EvaluationError,
                                    InvalidExpressionError)
 from ..staticanalysis.expression import evaluate_eval_expr
-from ..staticanalysis.support import prelude
+from ..staticanalysis.support import get_prelude
 from ..util.misc import Exportable, log_exception
 from .eval import EvalContext, EvalEnvs, EvalOptions, EvalSymbol, EvalVariables
+from .profile import measure, record_cache_access
 
 expr_regexp = re.compile(r"^([$@%])?{{((?:\\.|[^\\}]|}(?!}))*)}}$")
 escape_regexp = re.compile(r"\\(.)")
@@ -95,6 +104,10 @@ class EvalError(Diagnostic):
   def __init__(self, area: LocationArea, /, message: str):
     super().__init__(f"Evaluation error: {message}", references=[DiagnosticDocumentReference.from_area(area)])
 
+class EvalTimeoutError(Diagnostic):
+  def __init__(self, area: Optional[LocationArea], /, timeout: float):
+    super().__init__(f"Evaluation error: expression did not evaluate within {timeout:g} s", references=([DiagnosticDocumentReference.from_area(area)] if area else []))
+
 class PythonSyntaxError(Diagnostic):
   def __init__(self, message: str, target: LocatedValue, /):
     super().__init__(
@@ -194,7 +207,7 @@ class Evaluable(Exportable, ABC, Generic[T]):
 
   async def evaluate_final_async(self, context: EvalContext):
     analysis = LanguageServiceAnalysis()
-    raw_result = analysis.add(self.evaluate(context))
+    raw_result = analysis.add(await evaluate_offloadable(self, context))
 
     if isinstance(raw_result, EllipsisType):
       return analysis, Ellipsis
@@ -248,6 +261,214 @@ class Evaluable(Exportable, ABC, Generic[T]):
         raise ValueError
 
 
+# Expensive expressions evaluated on the event loop are deferred to a worker thread
+
+class ExpensiveExpressionError(Exception):
+  def __init__(self, contents: LocatedString, /):
+    self.contents = contents
+
+@dataclass(kw_only=True)
+class ExpressionEvaluation:
+  contents: Optional[LocatedString] = None
+
+current_evaluation = ContextVar[Optional[ExpressionEvaluation]]('current_evaluation', default=None)
+offload_expensive_expressions = ContextVar('offload_expensive_expressions', default=False)
+
+# Threads of evaluations which timed out and are still running
+MAX_ORPHANED_EXPRESSION_THREADS = 4
+orphaned_expression_threads = set[threading.Thread]()
+
+def copy_stack_value(value: Any, /) -> Any:
+  # Builtin containers are copied while other objects, such as functions, modules and quantities, are shared
+  match value:
+    case dict():
+      return { key: copy_stack_value(item) for key, item in value.items() }
+    case list():
+      return [copy_stack_value(item) for item in value]
+    case set():
+      return { copy_stack_value(item) for item in value }
+    case tuple():
+      return tuple(copy_stack_value(item) for item in value)
+    case bytearray():
+      return bytearray(value)
+    case _:
+      return value
+
+async def evaluate_offloadable(evaluable: 'Evaluable[T]', context: EvalContext) -> 'tuple[DiagnosticAnalysis, Evaluable[T] | EllipsisType]':
+  # Cheap expressions are evaluated synchronously, the evaluation only being restarted in a worker thread once an
+  # expensive one is encountered. Expressions before it are cheap and therefore free of side effects.
+  if (context.evaluation_timeout is None) or (context.stack is None):
+    return evaluable.evaluate(context)
+
+  token = offload_expensive_expressions.set(True)
+
+  try:
+    return evaluable.evaluate(context)
+  except ExpensiveExpressionError as e:
+    expensive_contents = e.contents
+  finally:
+    offload_expensive_expressions.reset(token)
+
+  for orphaned_thread in list(orphaned_expression_threads):
+    if not orphaned_thread.is_alive():
+      orphaned_expression_threads.remove(orphaned_thread)
+
+  # Orphaned threads compete with the event loop for the GIL, hence no more are started once too many are running
+  if len(orphaned_expression_threads) >= MAX_ORPHANED_EXPRESSION_THREADS:
+    logger.error(f"Not evaluating expression as {len(orphaned_expression_threads)} expressions which timed out are still running")
+    return DiagnosticAnalysis(errors=[EvalTimeoutError(expensive_contents.area, context.evaluation_timeout)]), Ellipsis
+
+  evaluation = ExpressionEvaluation()
+
+  # The stack is copied so that the worker neither observes nor causes changes to values used on the event loop, such
+  # as variables written by bindings
+  worker_context = EvalContext(
+    copy_stack_value(context.stack),
+    cwd_path=context.cwd_path,
+    dependency_graph=context.dependency_graph
+  )
+
+  loop = asyncio.get_running_loop()
+  started_future = loop.create_future()
+  result_future = loop.create_future()
+
+  def settle(future: asyncio.Future[Any], callback: Callable[[], None]):
+    if not future.done():
+      callback()
+
+  def notify(future: asyncio.Future[Any], callback: Callable[[], None]):
+    try:
+      loop.call_soon_threadsafe(settle, future, callback)
+    except RuntimeError:
+      # The event loop was closed while the expression was evaluated
+      pass
+
+  def run():
+    current_evaluation.set(evaluation)
+    notify(started_future, lambda: started_future.set_result(None))
+
+    try:
+      result = evaluable.evaluate(worker_context)
+    except BaseException as e:
+      notify(result_future, lambda: result_future.set_exception(e))
+    else:
+      notify(result_future, lambda: result_future.set_result(result))
+
+  # Each evaluation uses its own thread as a thread which timed out cannot be interrupted and must not be reused
+  thread = threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True, name="expression")
+  thread.start()
+
+  # The time budget starts once the evaluation is running
+  await started_future
+
+  try:
+    return await asyncio.wait_for(result_future, context.evaluation_timeout)
+  except TimeoutError:
+    # The thread keeps running in the background and its result is discarded
+    orphaned_expression_threads.add(thread)
+    logger.error(f"Expression evaluation timed out after {context.evaluation_timeout:g} s, {len(orphaned_expression_threads)} expressions which timed out are still running")
+    return DiagnosticAnalysis(errors=[EvalTimeoutError((evaluation.contents.area if evaluation.contents else None), context.evaluation_timeout)]), Ellipsis
+
+
+def relocate_area(area: LocationArea, old_contents: LocatedString, new_contents: LocatedString):
+  # Converts the area to indices into the old contents and then back to source offsets using the new contents
+  if (area.source is not old_contents.area.source) or (not area.ranges):
+    return None
+
+  start_offset = area.ranges[0].start
+  end_offset = area.ranges[-1].end
+
+  start_index: Optional[int] = None
+  end_index: Optional[int] = None
+  index = 0
+
+  for contents_range in old_contents.area.ranges:
+    if (start_index is None) and (contents_range.start <= start_offset <= contents_range.end):
+      start_index = index + (start_offset - contents_range.start)
+
+    if (end_index is None) and (contents_range.start <= end_offset <= contents_range.end):
+      end_index = index + (end_offset - contents_range.start)
+
+    index += contents_range.end - contents_range.start
+
+  if (start_index is None) or (end_index is None):
+    return None
+
+  return new_contents.area % (start_index, end_index)
+
+def relocate_diagnostic(diagnostic: Diagnostic, old_contents: LocatedString, new_contents: LocatedString):
+  references = list[Any]()
+
+  for reference in diagnostic.references:
+    if isinstance(reference, DiagnosticDocumentReference) and reference.area and (area := relocate_area(reference.area, old_contents, new_contents)) and area.source:
+      reference = replace(reference, area=area, document_id=area.source.origin)
+
+    references.append(reference)
+
+  relocated_diagnostic = copy.copy(diagnostic)
+  relocated_diagnostic.references = references
+
+  return relocated_diagnostic
+
+
+@dataclass(kw_only=True)
+class PythonExprAnalysisCacheEntry:
+  analysis: DiagnosticAnalysis
+  contents: LocatedString
+  expr: BaseExprEval
+  factories: list[BaseExprDefFactory]
+
+class PythonExprAnalysisCache:
+  """
+  A bounded cache of static analysis results of Python expressions.
+
+  Entries are keyed by the source of the expression and by the symbols and expression definition factories of the
+  environments it is analyzed in. Diagnostics of cached entries are relocated to the contents of the expression being
+  analyzed.
+  """
+
+  def __init__(self, *, max_size: int = 4096):
+    self.hits = 0
+    self.misses = 0
+    self.max_size = max_size
+
+    self._entries = OrderedDict[Hashable, PythonExprAnalysisCacheEntry]()
+
+  def clear(self):
+    self._entries.clear()
+
+  def create_key(self, contents: LocatedString, envs: EvalEnvs):
+    return (contents.value, tuple((env.symbol, tuple((name, id(value.ExprDefFactory)) for name, value in env.values.items())) for env in envs))
+
+  def get(self, key: Hashable, contents: LocatedString):
+    entry = self._entries.get(key)
+    record_cache_access('expression_analysis', entry is not None)
+
+    if entry is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    self._entries.move_to_end(key)
+
+    if (contents.area.source is entry.contents.area.source) and ([(range.start, range.end) for range in contents.area.ranges] == [(range.start, range.end) for range in entry.contents.area.ranges]):
+      analysis = entry.analysis.__class__(errors=entry.analysis.errors.copy(), warnings=entry.analysis.warnings.copy())
+    else:
+      analysis = entry.analysis.__class__(
+        errors=[relocate_diagnostic(error, entry.contents, contents) for error in entry.analysis.errors],
+        warnings=[relocate_diagnostic(warning, entry.contents, contents) for warning in entry.analysis.warnings]
+      )
+
+    return analysis, entry.expr
+
+  def set(self, key: Hashable, entry: PythonExprAnalysisCacheEntry):
+    self._entries[key] = entry
+    self._entries.move_to_end(key)
+
+    while len(self._entries) > self.max_size:
+      self._entries.popitem(last=False)
+
+
 @dataclass
 class PythonExprObject:
   contents: LocatedString
@@ -255,9 +476,20 @@ class PythonExprObject:
   _: KW_ONLY
   envs: EvalEnvs
 
+  analysis_cache = PythonExprAnalysisCache()
+
   def analyze(self):
     from ..langservice import LanguageServiceAnalysis
 
+    symbols = [env.symbol for env in self.envs]
+
+    # Relocating diagnostics requires the contents to map one-to-one to the source
+    cache_key = self.analysis_cache.create_key(self.contents, self.envs) if self.contents.absolute else None
+
+    if (cache_key is not None) and (cached := self.analysis_cache.get(cache_key, self.contents)):
+      analysis, expr = cached
+      return analysis, EvaluablePythonExpr(self.contents, expr, symbols)
+
     variables = dict[str, BaseExprDefFactory]()
 
     for env in self.envs:
@@ -265,15 +497,26 @@ class PythonExprObject:
         variables[name] = value.ExprDefFactory
 
     try:
-      analysis, result = evaluate_eval_expr(self.tree.body, ({}, variables), prelude, StaticAnalysisContext(
-        input_value=self.contents
-      ))
+      with measure(None, 'analyze'):
+        analysis, result = evaluate_eval_expr(self.tree.body, ({}, variables), get_prelude(), StaticAnalysisContext(
+          input_value=self.contents
+        ))
     except Exception:
       log_exception(logger)
       traceback.print_exc()
       return LanguageServiceAnalysis(errors=[Diagnostic("Static analysis failure")]), Ellipsis
 
-    return analysis, EvaluablePythonExpr(self.contents, result.to_evaluated(), [env.symbol for env in self.envs])
+    expr = result.to_evaluated()
+
+    if cache_key is not None:
+      self.analysis_cache.set(cache_key, PythonExprAnalysisCacheEntry(
+        analysis=analysis.__class__(errors=analysis.errors.copy(), warnings=analysis.warnings.copy()),
+        contents=self.contents,
+        expr=expr,
+        factories=list(variables.values())
+      ))
+
+    return analysis, EvaluablePythonExpr(self.contents, expr, symbols)
 
   @classmethod
   def parse(cls, raw_str: LocatedString, /):
@@ -314,8 +557,13 @@ class EvaluablePythonExpr(Evaluable):
       else:
         return DiagnosticAnalysis(), EvaluableConstantValue(LocatedValue.new(result, area=self.contents.area, deep=True), symbolic=True)
     else:
+      if offload_expensive_expressions.get() and isinstance(self.expr, CompositeExprEval) and self.expr.expr.expensive:
+        raise ExpensiveExpressionError(self.contents)
+
+      if (evaluation := current_evaluation.get()):
+        evaluation.contents = self.contents
+
       try:
-        # Idea: check that the expression doesn't take to long to evaluate (e.g. not more than 100 ms) by running it in a separate thread and killing it if it takes too long
         result = self.expr.evaluate(context.stack)
       except EvaluationError as e:
         return DiagnosticAnalysis(errors=[EvalError(self.contents.area, f"{e} ({e.__class__.__name__})")]), Ellipsis
@@ -366,5 +614,6 @@ __all__ = [
   'Evaluable',
   'EvaluableConstantValue',
   'EvaluablePythonExpr',
+  'PythonExprAnalysisCache',
   'PythonExprObject'
 ]
@@ -1,4 +1,5 @@
 from asyncio import Task
+from collections import deque
 from random import random
 import time
 from uuid import uuid4
@@ -8,11 +9,10 @@ from dataclasses import dataclass, field
 from os import PathLike
 from pathlib import Path
 from traceback import StackSummary
-from typing import IO, TYPE_CHECKING, Any, Optional, Self, TypeVar
+from typing import TYPE_CHECKING, Any, Literal, Optional, Self, TypeVar
 import asyncio
-import traceback
 
-from ..report import ExperimentReportEvent
+from ..report import ExperimentReportEvent, ExperimentReportWriter
 from ..eta import DurationTerm, Term
 from ..analysis import BaseAnalysis, DiagnosticAnalysis
 from ..draft import DraftCompilation
@@ -25,6 +25,7 @@ from ..util.types import SimpleCallbackFunction
 from ..util.misc import Exportable, HierarchyNode, IndexCounter
 from ..master.analysis import MasterAnalysis, RuntimeAnalysis
 from .process import ProgramExecEvent
+from .dependency import DependencyGraph
 from .eval import EvalContext, EvalStack
 from .parser import BaseBlock, BaseProgramLocation, BaseProgramPoint, BaseProgram, GlobalContext, HeadProgram
 from ..experiment import Experiment
@@ -34,14 +35,20 @@ if TYPE_CHECKING:
   from ..host import Host
 
 
+# In the reference mode, updates walk the entire handle tree rather than only dirty handles and their ancestors
+MasterUpdateMode = Literal['incremental', 'reference']
+
 @provide_logger(logger)
 class Master:
-  def __init__(self, compilation: DraftCompilation, /, experiment: Experiment, *, host: 'Host'):
+  def __init__(self, compilation: DraftCompilation, /, experiment: Experiment, *, host: 'Host', update_mode: MasterUpdateMode = 'incremental'):
     assert compilation.protocol
 
+    self.coalesced_update_count = 0
+    self.dependency_graph = DependencyGraph()
     self.id = str(uuid4())
     self.experiment = experiment
     self.host = host
+    self.min_update_interval = host.min_update_interval
     self.protocol = compilation.protocol
     self.start_time: float
 
@@ -52,18 +59,26 @@ class Master:
     # TODO: Add additional analysis items (e.g. unavailable device)
     self._initial_analysis = DiagnosticAnalysis.downcast(compilation.analysis)
     self._master_analysis = MasterAnalysis()
+    self.update_mode = update_mode
 
+    self._dirty_handles = set['ProgramHandle']()
+    self._urgent_update = False
     self._entry_counter = IndexCounter(start=1)
     self._events = list[ProgramExecEvent]()
-    self._file: IO[bytes]
     self._location: Any
     self._logger: Logger
     self._next_analysis_item_id = 0
     self._owner: ProgramOwner
     self._pool: Pool
+    self._report_closing = False
+    self._report_events = deque[tuple[ExperimentReportEvent, bool]]()
+    self._report_events_event = asyncio.Event()
+    self._report_writer: ExperimentReportWriter
     self._root_entry: Optional[ProgramHandleEntry] = None
     self._task: Optional[Task[None]] = None
     self._update_callback: Optional[SimpleCallbackFunction] = None
+    self._update_deferred = False
+    self._last_update_time: Optional[float] = None
     self._update_handle: Optional[asyncio.Handle] = None
     self._update_lock_depth = 0
     self._update_traces = list[StackSummary]()
@@ -111,7 +126,12 @@ class Master:
     self._handle._program = self.protocol.root.create_program(self._handle)
     self._owner = ProgramOwner(self._handle, self._handle._program)
 
-    with self.experiment.report_path.open("wb") as self._file:
+    async with ExperimentReportWriter(
+      self.experiment.report_path,
+      compression=self.host.report_compression,
+      durability=self.host.report_durability,
+      max_queue_size=self.host.report_queue_size
+    ) as self._report_writer:
       assert (self.protocol.name is not None)
 
       report_header = ExperimentReportHeader(
@@ -122,29 +142,45 @@ class Master:
         start_time=self.start_time
       )
 
-      comserde.dump(report_header, self._file)
+      # The header is written immediately for the report to be readable while the experiment is running
+      await self._report_writer.write_async(report_header, sync=True)
       self._logger.debug(f"Saving data in {self.experiment.report_path}")
 
-      async with Pool.open() as self._pool:
-        for runner in self.runners.values():
-          self._pool.start_soon(runner.start())
+      report_task = asyncio.create_task(self._write_report_events())
+
+      try:
+        async with Pool.open() as self._pool:
+          for runner in self.runners.values():
+            self._pool.start_soon(runner.start())
+
+          try:
+            self.update_soon()
+            await self._owner.run(None, runtime_stack)
+            self.update_now()
+          finally:
+            if self._update_handle:
+              self._update_handle.cancel()
+              self._update_handle = None
 
-        try:
-          self.update_soon()
-          await self._owner.run(None, runtime_stack)
-          self.update_now()
-        finally:
-          if self._update_handle:
-            self._update_handle.cancel()
-            self._update_handle = None
+          self._pool.close()
+      finally:
+        # Remaining events are written before the writer is closed
+        self._report_closing = True
+        self._report_events_event.set()
 
-        self._pool.close()
+        await report_task
 
-    del self._file
+    del self._report_writer
 
     self.experiment.has_report = True
     self.experiment.save()
 
+    # Loading the report saves its summary, such that the experiment opens without scanning the report later on
+    try:
+      await asyncio.to_thread(self.experiment.load_report)
+    except Exception:
+      self._logger.exception("Failed to load report")
+
   def receive(self, exec_path: list[int], message: Any):
     self._logger.debug(f"Received {message!r}")
 
@@ -164,6 +200,7 @@ class Master:
     #   return None
 
     return {
+      "coalescedUpdateCount": self.coalesced_update_count,
       "id": self.id,
       "initialAnalysis": self._initial_analysis.export(),
       "location": self._location,
@@ -175,15 +212,31 @@ class Master:
 
 
   def update(self):
-    if False:
-      for index, trace in enumerate(self._update_traces):
-        print(f"Trace {index}")
-
-        for line in trace.format():
-          print(line, end=str())
+    # Traces are only captured if enabled on the host
+    for index, trace in enumerate(self._update_traces):
+      self._logger.debug(f"Update trace {index}\n" + str().join(trace.format()).rstrip())
 
     self._update_traces.clear()
 
+    dirty_handles = self._dirty_handles
+
+    self._dirty_handles = set()
+    self._last_update_time = asyncio.get_event_loop().time()
+    self._urgent_update = False
+
+    # Handles which are neither dirty nor an ancestor of a dirty handle have nothing to update
+    if self.update_mode == 'incremental':
+      visited_handles = set[ProgramHandle]()
+
+      for dirty_handle in dirty_handles:
+        current_handle = dirty_handle
+
+        while isinstance(current_handle, ProgramHandle) and (current_handle not in visited_handles):
+          visited_handles.add(current_handle)
+          current_handle = current_handle._parent
+    else:
+      visited_handles = None
+
     analysis = MasterAnalysis()
     changes = list[TreeChange]()
     user_significant = False
@@ -230,7 +283,8 @@ class Master:
       analysis.add_runtime(handle._analysis, entry_path, 0)
 
       for child_id, child_handle in list(handle._children.items()):
-        update_handle(child_handle, current_entry, child_id, [*entry_path, child_id])
+        if (visited_handles is None) or (child_handle in visited_handles):
+          update_handle(child_handle, current_entry, child_id, [*entry_path, child_id])
 
       # Recalculate the term of this handle
       # This must be done after updating children as their term needs to be correct.
@@ -274,7 +328,21 @@ class Master:
       time=time.time()
     )
 
-    comserde.dump(event, self._file)
+    error = bool(analysis.errors)
+
+    # Once the queue of events waiting to be written is full, new events are merged into the last one
+    if self._report_queue_full:
+      pending_event, pending_error = self._report_events[-1]
+      assert pending_event.analysis
+
+      self._report_events[-1] = (ExperimentReportEvent(
+        analysis=(pending_event.analysis + analysis),
+        changes=(pending_event.changes + changes),
+        time=event.time
+      ), pending_error or error)
+    else:
+      self._report_events.append((event, error))
+      self._report_events_event.set()
 
     # from pprint import pprint
     # pprint(changes)
@@ -305,14 +373,58 @@ class Master:
     if self._update_lock_depth > 0:
       return
 
-    self._update_traces.append(StackSummary(traceback.extract_stack()[:-2]))
+    # Non-urgent updates are deferred until the queue of events waiting to be written has room for theirs
+    if self._report_queue_full and (not self._urgent_update):
+      self._update_deferred = True
+      return
+
+    if (trace := self.host.provenance_capture.extract_stack(skip=1)):
+      self._update_traces.append(trace)
+
+    loop = asyncio.get_event_loop()
 
-    if not self._update_handle:
-      def func():
-        self._update_handle = None
-        self.update()
+    # Updates which only change locations are delayed to respect the maximum update rate, while structural changes,
+    # terms and errors are flushed as soon as possible.
+    if (self.min_update_interval is not None) and (self._last_update_time is not None) and (not self._urgent_update):
+      delay = max(0.0, self._last_update_time + self.min_update_interval - loop.time())
+    else:
+      delay = 0.0
+
+    if self._update_handle:
+      # Reschedule a delayed update if this one is urgent
+      if (delay > 0.0) or not isinstance(self._update_handle, asyncio.TimerHandle):
+        self.coalesced_update_count += 1
+        return
+
+      self._update_handle.cancel()
+      self.coalesced_update_count += 1
 
-      self._update_handle = asyncio.get_event_loop().call_soon(func)
+    def func():
+      self._update_handle = None
+      self.update()
+
+    self._update_handle = loop.call_later(delay, func) if delay > 0.0 else loop.call_soon(func)
+
+  @property
+  def _report_queue_full(self):
+    return len(self._report_events) >= self.host.report_queue_size
+
+  async def _write_report_events(self):
+    while True:
+      while not self._report_events:
+        if self._report_closing:
+          return
+
+        self._report_events_event.clear()
+        await self._report_events_event.wait()
+
+      event, error = self._report_events.popleft()
+
+      if self._update_deferred and (not self._report_queue_full):
+        self._update_deferred = False
+        self.update_soon()
+
+      await self._report_writer.write_async(event, error=error)
 
 
 @dataclass(kw_only=True)
@@ -362,6 +474,7 @@ class ProgramHandle:
   def __init__(self, parent: 'Master | ProgramHandle', id: int):
     self._children = dict[int, ProgramHandle]()
     self._id = id
+    self._master: Master = parent.master if isinstance(parent, ProgramHandle) else parent
     self._parent = parent
     self._program: BaseProgram
 
@@ -377,9 +490,15 @@ class ProgramHandle:
 
     self.context: EvalContext
 
+    self._mark_dirty(urgent=True)
+
   @property
   def master(self) -> Master:
-    return self._parent.master if isinstance(self._parent, ProgramHandle) else self._parent
+    return self._master
+
+  def _mark_dirty(self, *, urgent: bool = False):
+    self._master._dirty_handles.add(self)
+    self._master._urgent_update = self._master._urgent_update or urgent
 
   def ancestor(self, *, type: type[T]) -> Optional[T]:
     handle = self
@@ -482,6 +601,7 @@ class ProgramHandle:
 
   def send_analysis(self, analysis: BaseAnalysis, /):
     self._analysis += analysis
+    self._mark_dirty(urgent=(isinstance(analysis, DiagnosticAnalysis) and bool(analysis.errors)))
     self.master.update_soon()
 
   def send_term(self):
@@ -491,6 +611,8 @@ class ProgramHandle:
     while isinstance(current_handle := current_handle._parent, ProgramHandle):
       current_handle._updated_term = True
 
+    # Terms must be updated before the handle is consumed, as programs expect their children's terms to be known
+    self._mark_dirty(urgent=True)
     self.master.update_soon()
 
   def _calculate_term(self):
@@ -506,6 +628,7 @@ class ProgramHandle:
     self._location = location
     self._updated_location = True
 
+    self._mark_dirty()
     self.master.update_soon()
 
   def release_lock(self, *, sure: bool = False):
@@ -530,7 +653,7 @@ class ProgramOwner:
     self._program.jump(point)
 
   async def run(self, point: Optional[BaseProgramPoint], stack: EvalStack):
-    self._handle.context = EvalContext(stack, cwd_path=self._handle.master.experiment.path)
+    self._handle.context = EvalContext(stack, cwd_path=self._handle.master.experiment.path, dependency_graph=self._handle.master.dependency_graph, evaluation_timeout=self._handle.master.host.expression_timeout)
 
     await self._program.run(point, stack)
 
@@ -538,6 +661,10 @@ class ProgramOwner:
       assert child_handle._consumed
 
     self._handle._consumed = True
+    self._handle._mark_dirty(urgent=True)
+
+    # Reschedules an update which might have been delayed as non-urgent
+    self._handle.master.update_soon()
 
     del self._handle.context
 
@@ -1,29 +1,37 @@
 from abc import ABC, abstractmethod
-from dataclasses import KW_ONLY, dataclass, field
+from array import array
+import copy
+from dataclasses import KW_ONLY, dataclass, field, is_dataclass, replace
+import functools
 import getpass
 import math
-from types import EllipsisType
-from typing import (TYPE_CHECKING, Any, ClassVar, Generic, Literal, Optional,
-                    Sequence, TypeVar, final)
+import threading
+import time
+from types import BuiltinFunctionType, EllipsisType, FunctionType, ModuleType, NoneType
+from typing import (TYPE_CHECKING, AbstractSet, Any, ClassVar, Generic, Hashable, Literal,
+                    Optional, Sequence, TypeVar, final)
+from weakref import WeakKeyDictionary
 
 from ..eta import DurationTerm, Term
 from ..staticanalysis.expr import DeferredExprDef
-from ..staticanalysis.support import prelude
+from ..staticanalysis.support import get_prelude
 from ..staticanalysis.expression import instantiate_type_instance
 from .. import input as lang
 from .. import reader
-from ..draft import Draft
+from ..draft import Draft, DraftCompilationCancelledError
 from ..error import Diagnostic, DiagnosticDocumentReference, Trace
 from ..langservice import LanguageServiceAnalysis, LanguageServiceToken
-from ..reader import LocatedString, LocatedValue, LocationArea
+from ..reader import LocatedString, LocatedValue, LocationArea, LocationRange, Source
 from ..ureg import ureg
 from ..util.decorators import debug
 from ..util.misc import Exportable, ExportableABC, HierarchyNode
 from .eval import EvalContext, EvalEnv, EvalEnvs, EvalEnvValue, EvalStack, EvalSymbol, EvalVariables
 from .expr import Evaluable
+from .profile import CompilationProfile, current_profile, measure, measure_transformer
 
 if TYPE_CHECKING:
   from ..host import Host
+  from ..plugin.manager import PluginManager
   from ..units.base import BaseRunner
   from .master2 import Mark, ProgramHandle
   from .process import BaseProcess
@@ -379,6 +387,7 @@ class Layer:
   _: KW_ONLY
   envs: EvalEnvs
   extra_info: Optional[Attrs | EllipsisType] = None
+  cache: 'Optional[LayerCache]' = field(default=None, compare=False, repr=False)
 
   def adopt(self, adoption_stack: EvalStack, trace: Trace):
     analysis = LanguageServiceAnalysis()
@@ -387,7 +396,8 @@ class Layer:
     adopted_transforms = list[tuple[BasePassiveTransformer, Any]]()
 
     for transformer, transform in self.passive_transforms:
-      transform_result = analysis.add(transformer.adopt(transform.data, current_adoption_stack, trace)) #, trace=trace)
+      with measure_transformer(transformer, 'adopt'):
+        transform_result = analysis.add(transformer.adopt(transform.data, current_adoption_stack, trace)) #, trace=trace)
 
       if isinstance(transform_result, EllipsisType) or not transform_result:
         continue
@@ -400,10 +410,20 @@ class Layer:
   def adopt_lead(self, adoption_stack: EvalStack, trace: Trace):
     assert self.lead_transform
 
+    if self.cache:
+      return self.cache.adopt_lead(self, adoption_stack, trace)
+
+    return self._adopt_lead(adoption_stack, trace)
+
+  def _adopt_lead(self, adoption_stack: EvalStack, trace: Trace):
+    assert self.lead_transform
+
     analysis, (adopted_transforms, current_adoption_stack) = self.adopt(adoption_stack, trace)
 
     lead_transformer, lead_transform = self.lead_transform
-    block = analysis.add(lead_transformer.adopt(lead_transform.data, current_adoption_stack, trace)) #, trace=trace)
+
+    with measure_transformer(lead_transformer, 'adopt'):
+      block = analysis.add(lead_transformer.adopt(lead_transform.data, current_adoption_stack, trace)) #, trace=trace)
 
     if isinstance(block, EllipsisType):
       return analysis, Ellipsis
@@ -418,7 +438,8 @@ class Layer:
 
     for transformer, transform_data in adopted_transforms[::-1]:
       if not isinstance(transform_data, EllipsisType):
-        execute_result = analysis.add(transformer.execute(transform_data, current_block))
+        with measure_transformer(transformer, 'execute'):
+          execute_result = analysis.add(transformer.execute(transform_data, current_block))
 
         if not isinstance(execute_result, EllipsisType):
           current_block = execute_result
@@ -426,6 +447,284 @@ class Layer:
     return analysis, current_block
 
 
+# Layer cache
+
+def fingerprint_value(value: Any, /) -> Hashable:
+  match value:
+    case bool() | float() | int() | str() | None if type(value) in (bool, float, int, str, NoneType):
+      return (type(value), value)
+    case dict() if type(value) is dict:
+      return (dict, tuple((fingerprint_value(item_key), fingerprint_value(item_value)) for item_key, item_value in value.items()))
+    case list() | tuple() if type(value) in (list, tuple):
+      return (type(value), tuple(fingerprint_value(item) for item in value))
+    case _:
+      # Other values are compared by identity, which is only valid as long as they are kept alive.
+      return (object, id(value))
+
+def fingerprint_trace(trace: Trace, /) -> Hashable:
+  return tuple((ref.document_id, ref.id, ref.area and tuple((range.start, range.end) for range in ref.area.ranges)) for ref in trace)
+
+def fingerprint_attribute(attribute: lang.Attribute, /) -> Hashable:
+  # Types are created anew by parsers and are therefore compared by their class
+  return tuple((key, (type, type(value)) if key == '_type' else fingerprint_value(value)) for key, value in vars(attribute).items())
+
+def get_layer_range(attrs: LocatedValue, /):
+  # Fold and completion ranges can extend beyond the value itself, such as over trailing empty lines
+  layer_range = attrs.full_area.enclosing_range()
+  ranges = [layer_range, *([attrs.fold_range] if isinstance(attrs, (reader.ReliableLocatedDict, reader.ReliableLocatedList)) else list()), *getattr(attrs, 'completion_ranges', list())]
+
+  return LocationRange(layer_range.source, min(range.start for range in ranges), max(range.end for range in ranges))
+
+
+LayerCacheKey = tuple[Hashable, ...]
+
+@dataclass(kw_only=True)
+class LayerCacheEntry:
+  analysis: LanguageServiceAnalysis
+  layer: 'Layer | EllipsisType'
+  range: LocationRange
+  symbols: frozenset[EvalSymbol]
+
+@dataclass(kw_only=True)
+class LayerAdoptionCacheEntry:
+  adoption_stack: EvalStack
+  analysis: LanguageServiceAnalysis
+  block: BaseBlock | EllipsisType
+  layer: Layer
+
+class LayerCache:
+  """
+  A cache of prepared and adopted layers, shared by successive compilations of a draft.
+
+  Entries are only kept for one compilation after their last use. Identical subtrees share a key and each of them
+  claims one of its entries, preferably the one prepared at the same position. The symbols allocated while preparing a
+  layer are kept by its entry and reserved such that a compilation which reuses the layer does not allocate them again.
+  """
+
+  def __init__(self):
+    self.adoption_hits = 0
+    self.layer_hits = 0
+    self.reserved_symbols = frozenset[EvalSymbol]()
+
+    self._adoptions = dict[LayerCacheKey, LayerAdoptionCacheEntry]()
+    self._layers = dict[LayerCacheKey, list[LayerCacheEntry]]()
+    self._previous_adoptions = dict[LayerCacheKey, LayerAdoptionCacheEntry]()
+    self._previous_layers = dict[LayerCacheKey, list[LayerCacheEntry]]()
+
+  def begin(self):
+    self.adoption_hits = 0
+    self.layer_hits = 0
+
+    self._previous_adoptions = self._adoptions
+    self._previous_layers = self._layers
+    self._adoptions = dict()
+    self._layers = dict()
+
+    self.reserved_symbols = frozenset[EvalSymbol]().union(*(entry.symbols for entries in self._previous_layers.values() for entry in entries))
+
+  def abort(self):
+    # Keep entries of the previous compilation which were not used before the current one was aborted
+    self._adoptions = self._previous_adoptions | self._adoptions
+
+    for key, entries in self._previous_layers.items():
+      self._layers.setdefault(key, list()).extend(entries)
+
+  def end(self):
+    self._previous_adoptions = dict()
+    self._previous_layers = dict()
+
+  def clear(self):
+    self._adoptions.clear()
+    self._layers.clear()
+    self.end()
+
+  def get_layer(self, key: LayerCacheKey, /, *, start: int, used_symbols: AbstractSet[EvalSymbol]):
+    """
+    Claims an entry for a subtree starting at the given offset. The caller must then store the entry, possibly
+    relocated, using `set_layer()`.
+    """
+
+    entry: Optional[LayerCacheEntry] = None
+
+    if (previous_entries := self._previous_layers.get(key)):
+      entry = next((entry for entry in previous_entries if entry.range.start == start), previous_entries[0])
+      previous_entries.remove(entry)
+    elif (entries := self._layers.get(key)):
+      # Entries already claimed by the current compilation can be shared if they do not have any symbol
+      entry = entries[-1]
+
+    # The entry cannot be reused if one of its symbols was already allocated by the current compilation
+    if (not entry) or (not entry.symbols.isdisjoint(used_symbols)):
+      return None
+
+    self.layer_hits += 1
+    return entry
+
+  def set_layer(self, key: LayerCacheKey, entry: LayerCacheEntry, /):
+    self._layers.setdefault(key, list()).append(entry)
+
+  def adopt_lead(self, layer: Layer, adoption_stack: EvalStack, trace: Trace):
+    key = (id(layer), fingerprint_value(adoption_stack), fingerprint_trace(trace))
+    entry = self._adoptions.get(key) or self._previous_adoptions.pop(key, None)
+
+    if entry:
+      self.adoption_hits += 1
+    else:
+      analysis, block = layer._adopt_lead(adoption_stack, trace)
+
+      # The layer and adoption stack are retained so that identities in the key remain valid.
+      entry = LayerAdoptionCacheEntry(
+        adoption_stack=adoption_stack,
+        analysis=analysis,
+        block=block,
+        layer=layer
+      )
+
+    self._adoptions[key] = entry
+
+    analysis = LanguageServiceAnalysis()
+    analysis += entry.analysis
+
+    return analysis, entry.block
+
+
+def get_common_prefix_length(a: str, b: str, /):
+  low = 0
+  high = min(len(a), len(b))
+
+  while low < high:
+    mid = (low + high + 1) // 2
+
+    if a[low:mid] == b[low:mid]:
+      low = mid
+    else:
+      high = mid - 1
+
+  return low
+
+
+RELOCATION_ATOMIC_TYPES = (BuiltinFunctionType, EllipsisType, FunctionType, ModuleType, NoneType, bool, bytes, complex, float, int, str, type)
+
+class LayerRelocation:
+  """
+  Moves the locations of a cached layer from the subtree it was prepared from to an identical subtree, possibly at
+  another position or in another source.
+
+  Located values, dataclasses and built-in containers are copied if they contain relocated locations and are otherwise
+  returned unchanged. Locations outside of the subtree and other objects are left unchanged.
+  """
+
+  def __init__(self, old_range: LocationRange, new_range: LocationRange):
+    self.delta = new_range.start - old_range.start
+    self.new_range = new_range
+    self.old_range = old_range
+
+    self._memo = dict[int, Any]()
+
+  def _contains(self, source: Optional[Source], start: int, end: int):
+    old_source = self.old_range.source
+
+    # Parts of the layer reused from previous compilations without relocation can have an older source of the same
+    # document, in which case their locations are still valid in the coordinates of the entry's source
+    return (
+      ((source is old_source) or ((source is not None) and (source.origin is not None) and (source.origin == old_source.origin))) and
+      (start >= self.old_range.start) and
+      (end <= self.old_range.end)
+    )
+
+  def area(self, area: LocationArea):
+    spans = area._spans
+
+    if (not spans) or (not self._contains(area._source, min(spans), max(spans))):
+      return area
+
+    return LocationArea._from_spans(self.new_range.source, array('i', [offset + self.delta for offset in spans]))
+
+  def range(self, range: LocationRange):
+    if not self._contains(range.source, range.start, range.end):
+      return range
+
+    return LocationRange(self.new_range.source, range.start + self.delta, range.end + self.delta)
+
+  def value(self, value: Any, /) -> Any:
+    if isinstance(value, RELOCATION_ATOMIC_TYPES) and not isinstance(value, LocatedValue):
+      return value
+
+    memo_key = id(value)
+
+    if memo_key in self._memo:
+      return self._memo[memo_key]
+
+    # Cycles resolve to the original object
+    self._memo[memo_key] = value
+    result = self._relocate(value)
+    self._memo[memo_key] = result
+
+    return result
+
+  def _relocate(self, value: Any, /) -> Any:
+    match value:
+      case LocationArea():
+        return self.area(value)
+      case LocationRange():
+        return self.range(value)
+      case Source():
+        return value
+      case DiagnosticDocumentReference(area=LocationArea() as area):
+        new_area = self.area(area)
+
+        if (new_area is area) or (not new_area.source):
+          return value
+
+        return replace(value, area=new_area, document_id=new_area.source.origin)
+
+    value_type = type(value)
+
+    if value_type in (frozenset, list, set, tuple):
+      items = [self.value(item) for item in value]
+      return value_type(items) if any((new_item is not item) for new_item, item in zip(items, value)) else value
+
+    if value_type is dict:
+      items = [(self.value(key), self.value(item)) for key, item in value.items()]
+      return dict(items) if any((new_key is not key) or (new_item is not item) for (new_key, new_item), (key, item) in zip(items, value.items())) else value
+
+    if not (isinstance(value, LocatedValue) or is_dataclass(value)) or not hasattr(value, '__dict__'):
+      return value
+
+    state = vars(value)
+    new_state = { key: new_item for key, item in state.items() if (new_item := self.value(item)) is not item }
+
+    if isinstance(value, dict):
+      items = [(self.value(key), self.value(item)) for key, item in dict.items(value)]
+      items_changed = any((new_key is not key) or (new_item is not item) for (new_key, new_item), (key, item) in zip(items, dict.items(value)))
+    elif isinstance(value, list):
+      items = [self.value(item) for item in list.__iter__(value)]
+      items_changed = any((new_item is not item) for new_item, item in zip(items, list.__iter__(value)))
+    else:
+      items = None
+      items_changed = False
+
+    if (not new_state) and (not items_changed):
+      return value
+
+    new_value = self._copy(value, new_state)
+
+    if isinstance(value, dict):
+      dict.clear(new_value)
+      dict.update(new_value, items)
+    elif isinstance(value, list):
+      list.clear(new_value)
+      list.extend(new_value, items)
+
+    return new_value
+
+  def _copy(self, value: Any, state: dict[str, Any], /):
+    new_value = copy.copy(value)
+    vars(new_value).update(state)
+
+    return new_value
+
+
 # ----
 
 
@@ -504,16 +803,104 @@ class FiberProtocol: # (Exportable):
     }
 
 
+TransformerKey = tuple[int, int]
+
+@dataclass(frozen=True, kw_only=True)
+class FiberParserStructure:
+  """
+  The root type derived from the units' parser classes, which is shared by compilations until units are reloaded.
+
+  Parsers are referred to by their index rather than by identity as they are instantiated again by each compilation.
+  Transformers and their attributes are not shared as they are created by parser instances and can depend on the state
+  of a compilation, such as the device tree.
+  """
+
+  parser_types: tuple[type[BaseParser], ...]
+  revision: int
+  root_type: lang.DivisibleCompositeDictType
+
+  @classmethod
+  def create(cls, parser_types: tuple[type[BaseParser], ...], *, revision: int):
+    root_type = lang.DivisibleCompositeDictType()
+
+    # Parser indices are used as keys of units' attributes, hence the key of native attributes.
+    root_type.add({
+      'name': lang.Attribute(
+        label="Protocol name",
+        description="The protocol's name.",
+        type=lang.StrType()
+      ),
+      'steps': lang.Attribute(
+        type=lang.AnyType()
+      )
+    }, key=-1)
+
+    for parser_index, Parser in enumerate(parser_types):
+      root_type.add(Parser.root_attributes, key=parser_index, optional=True)
+
+    return cls(
+      parser_types=parser_types,
+      revision=revision,
+      root_type=root_type
+    )
+
+
 class FiberParser:
-  def __init__(self, draft: Draft, *, Parsers: Sequence[type[BaseParser]], host: 'Host'):
+  _structures = WeakKeyDictionary['PluginManager', FiberParserStructure]()
+
+  def __init__(
+    self,
+    draft: Draft,
+    *,
+    cancel_event: Optional[threading.Event] = None,
+    Parsers: Sequence[type[BaseParser]],
+    host: 'Host',
+    layer_cache: Optional[LayerCache] = None,
+    profile: Optional[CompilationProfile] = None
+  ):
     # Must be before self._parsers is initialized
     self.draft = draft
     self.host = host
 
+    self._cancel_event = cancel_event
+    self._eval_symbols = set[EvalSymbol]()
+    self._layer_attributes_key: Hashable = ()
+    self._layer_cache = layer_cache
+    self._layer_frames = list[bool]()
+    self._layer_symbols = list[set[EvalSymbol]]()
     self._next_eval_symbol = 0
+    self._source_prefix_lengths = dict[int, int]()
     self._parsers: list[BaseParser] = [Parser(self) for Parser in Parsers]
 
-    self.analysis, protocol = self._parse()
+    self.profile = profile
+
+    if self.profile:
+      for parser in self._parsers:
+        for transformer in [*parser.transformers, *parser.leaf_transformers]:
+          self.profile.transformer_namespaces[type(transformer)] = parser.namespace
+
+    if self._layer_cache:
+      self._layer_cache.begin()
+
+    profile_token = current_profile.set(self.profile)
+    start_time = time.perf_counter()
+
+    try:
+      self.analysis, protocol = self._parse()
+    except DraftCompilationCancelledError:
+      if self._layer_cache:
+        self._layer_cache.abort()
+
+      raise
+    finally:
+      current_profile.reset(profile_token)
+
+      if self.profile:
+        self.profile.total_time = time.perf_counter() - start_time
+
+      if self._layer_cache:
+        self._layer_cache.end()
+
     self.protocol = protocol if not isinstance(protocol, EllipsisType) else None
 
   def _parse(self):
@@ -540,7 +927,7 @@ class FiberParser:
         description="The unit registry."
       ),
       'username': EvalEnvValue(
-        lambda node: DeferredExprDef('username', node=node, phase=0, symbol=global_symbol, type=instantiate_type_instance(prelude[0]['str'])),
+        lambda node: DeferredExprDef('username', node=node, phase=0, symbol=global_symbol, type=instantiate_type_instance(get_prelude()[0]['str'])),
         description="The user's name."
       )
     }, name="Global", symbol=global_symbol)
@@ -558,21 +945,8 @@ class FiberParser:
 
     # Root dictionary
 
-    root_type = lang.DivisibleCompositeDictType()
-
-    root_type.add({
-      'name': lang.Attribute(
-        label="Protocol name",
-        description="The protocol's name.",
-        type=lang.StrType()
-      ),
-      'steps': lang.Attribute(
-        type=lang.AnyType()
-      )
-    }, key=0)
-
-    for parser in self._parsers:
-      root_type.add(parser.root_attributes, key=parser, optional=True)
+    structure = self.structure
+    root_type = structure.root_type
 
     context = AnalysisContext()
     root_result = analysis.add(root_type.analyze(data, context))
@@ -583,34 +957,36 @@ class FiberParser:
 
     # Transformers
 
-    transformers = BaseTransformers()
-
-    for parser in self._parsers:
-      transformers += parser.transformers
+    transformer_keys: list[TransformerKey] = sorted((
+      (parser_index, transformer_index) for parser_index, parser in enumerate(self._parsers) for transformer_index in range(len(parser.transformers))
+    ), key=(lambda key: -self._parsers[key[0]].transformers[key[1]].priority))
 
-    self.transformers = sorted(transformers, key=(lambda transformer: -transformer.priority))
-    del transformers
+    self.transformers = [self._parsers[parser_index].transformers[transformer_index] for parser_index, transformer_index in transformer_keys]
 
 
     # Root block type (1)
 
-    self.block_type = lang.DivisibleCompositeDictType()
+    transformer_block_type = lang.DivisibleCompositeDictType()
 
-    for transformer in self.transformers:
-      self.block_type.add(transformer.attributes, key=transformer, optional=True)
+    for transformer, transformer_key in zip(self.transformers, transformer_keys):
+      transformer_block_type.add(transformer.attributes, key=transformer_key, optional=True)
+
+    self.block_type = transformer_block_type
 
 
     # Root unit attributes
 
     protocol_details = ProtocolDetails()
 
-    for parser in self._parsers:
-      unit_attrs = analysis.add(root_type.analyze_namespace(root_result, context, key=parser))
+    for parser_index, parser in enumerate(self._parsers):
+      unit_attrs = analysis.add(root_type.analyze_namespace(root_result, context, key=parser_index))
 
       if isinstance(unit_attrs, EllipsisType):
         continue
 
-      protocol_unit_data = analysis.add(parser.enter_protocol(unit_attrs, root_envs))
+      with measure(parser.namespace, 'enter_protocol'):
+        protocol_unit_data = analysis.add(parser.enter_protocol(unit_attrs, root_envs))
+
       root_envs += protocol_unit_data.envs
 
       if protocol_unit_data.details:
@@ -624,19 +1000,34 @@ class FiberParser:
 
     # Root block type (2)
 
-    self.block_type = lang.DivisibleCompositeDictType()
+    # Layer attributes depend on the protocol and are therefore only added once it has been entered
+    self._layer_attributes_parsers = set[BaseParser]()
+    self._preload_parsers = [(parser_index, parser) for parser_index, parser in enumerate(self._parsers) if hasattr(parser, 'preload')]
 
-    for parser in self._parsers:
-      if parser.layer_attributes is not None:
-        self.block_type.add(parser.layer_attributes, key=parser, optional=True)
+    if any((parser.layer_attributes is not None) for parser in self._parsers):
+      self.block_type = lang.DivisibleCompositeDictType()
+
+      for parser_index, parser in enumerate(self._parsers):
+        if (layer_attributes := parser.layer_attributes) is not None:
+          self.block_type.add(layer_attributes, key=parser_index, optional=True)
+          self._layer_attributes_parsers.add(parser)
+
+      self.block_type.extend(transformer_block_type)
+
+    # Layer attributes are part of the layer cache key as they depend on the protocol, e.g. on shorthands
+    self._layer_attributes_key = tuple(
+      (parser_index, tuple((name, fingerprint_attribute(attribute)) for name, attribute in layer_attributes.items()))
+      for parser_index, parser in enumerate(self._parsers) if (layer_attributes := parser.layer_attributes) is not None
+    )
 
-    for transformer in self.transformers:
-      self.block_type.add(transformer.attributes, key=transformer, optional=True)
+    self._transformer_entries = [
+      (self._parsers[transformer_key[0]], transformer, transformer_key) for transformer, transformer_key in zip(self.transformers, transformer_keys)
+    ]
 
 
     # Root block
 
-    root_result_native = analysis.add(root_type.analyze_namespace(root_result, context, key=0))
+    root_result_native = analysis.add(root_type.analyze_namespace(root_result, context, key=-1))
 
     if isinstance(root_result_native, EllipsisType):
       return analysis, Ellipsis
@@ -670,7 +1061,8 @@ class FiberParser:
     # Leave
 
     for parser in self._parsers:
-      analysis += parser.leave_protocol()
+      with measure(parser.namespace, 'leave_protocol'):
+        analysis += parser.leave_protocol()
 
 
     # Return
@@ -684,12 +1076,84 @@ class FiberParser:
     )
 
 
+  @functools.cached_property
+  def structure(self):
+    manager = self.host.manager
+    structure = self._structures.get(manager)
+    parser_types = tuple(type(parser) for parser in self._parsers)
+
+    if (not structure) or (structure.revision != manager.revision) or (structure.parser_types != parser_types):
+      structure = FiberParserStructure.create(parser_types, revision=manager.revision)
+      self._structures[manager] = structure
+
+    return structure
+
   def allocate_eval_symbol(self):
+    reserved_symbols = self._layer_cache.reserved_symbols if self._layer_cache else frozenset()
+
+    while (self._next_eval_symbol in self._eval_symbols) or (self._next_eval_symbol in reserved_symbols):
+      self._next_eval_symbol += 1
+
     symbol = EvalSymbol(self._next_eval_symbol)
     self._next_eval_symbol += 1
+    self._use_eval_symbols({symbol})
 
     return symbol
 
+  def _use_eval_symbols(self, symbols: AbstractSet[EvalSymbol], /):
+    self._eval_symbols |= symbols
+
+    for layer_symbols in self._layer_symbols:
+      layer_symbols |= symbols
+
+  def _create_layer_cache_key(
+    self,
+    attrs: Any,
+    /,
+    envs: EvalEnvs,
+    *,
+    extra_attributes: Optional[dict[str, lang.Attribute | lang.Type]],
+    mode: Literal['any', 'lead', 'passive']
+  ) -> Optional[LayerCacheKey]:
+    if (self._layer_cache is None) or (not isinstance(attrs, LocatedValue)) or (attrs.full_area.source is None):
+      return None
+
+    attrs_range = get_layer_range(attrs)
+
+    # Environments are created anew by each compilation and are therefore compared by their symbol
+    # and names rather than by identity. Locations are not part of the key and are relocated when the
+    # layer is reused.
+    return (
+      self.host.manager.revision,
+      self._layer_attributes_key,
+      mode,
+      tuple(extra_attributes.keys()) if extra_attributes is not None else None,
+      tuple((env.name, env.symbol, tuple(env.values.keys())) for env in envs),
+      attrs_range.source.value[attrs_range.start:attrs_range.end]
+    )
+
+  def _relocate_layer_cache_entry(self, entry: LayerCacheEntry, attrs_range: LocationRange):
+    old_source = entry.range.source
+    new_source = attrs_range.source
+
+    # The entry can be used as is if its subtree and everything before it are unchanged
+    if (entry.range.start == attrs_range.start) and (old_source.origin == new_source.origin):
+      if (prefix_length := self._source_prefix_lengths.get(id(old_source))) is None:
+        prefix_length = get_common_prefix_length(old_source.value, new_source.value)
+        self._source_prefix_lengths[id(old_source)] = prefix_length
+
+      if entry.range.end <= prefix_length:
+        return entry
+
+    relocation = LayerRelocation(entry.range, attrs_range)
+
+    return LayerCacheEntry(
+      analysis=relocation.value(entry.analysis),
+      layer=relocation.value(entry.layer),
+      range=attrs_range,
+      symbols=entry.symbols
+    )
+
   def parse_layer(
     self,
     attrs: Any,
@@ -698,6 +1162,68 @@ class FiberParser:
     *,
     extra_attributes: Optional[dict[str, lang.Attribute | lang.Type]] = None,
     mode: Literal['any', 'lead', 'passive'] = 'lead'
+  ):
+    if self._cancel_event and self._cancel_event.is_set():
+      raise DraftCompilationCancelledError
+
+    cache_key = self._create_layer_cache_key(attrs, envs, extra_attributes=extra_attributes, mode=mode)
+
+    if cache_key is None:
+      with measure(CompilationProfile.default_namespace, 'parse_layer'):
+        return self._parse_layer(attrs, envs, extra_attributes=extra_attributes, mode=mode)
+
+    assert self._layer_cache
+    assert isinstance(attrs, LocatedValue)
+
+    attrs_range = get_layer_range(attrs)
+
+    if (entry := self._layer_cache.get_layer(cache_key, start=attrs_range.start, used_symbols=self._eval_symbols)):
+      self._use_eval_symbols(entry.symbols)
+
+      entry = self._relocate_layer_cache_entry(entry, attrs_range)
+      self._layer_cache.set_layer(cache_key, entry)
+
+      analysis = LanguageServiceAnalysis()
+      analysis += entry.analysis
+
+      return analysis, entry.layer
+
+    self._layer_frames.append(True)
+    self._layer_symbols.append(set())
+
+    try:
+      with measure(CompilationProfile.default_namespace, 'parse_layer'):
+        analysis, layer = self._parse_layer(attrs, envs, extra_attributes=extra_attributes, mode=mode)
+    finally:
+      reusable = self._layer_frames.pop()
+      symbols = self._layer_symbols.pop()
+
+    if reusable:
+      if isinstance(layer, Layer):
+        layer.cache = self._layer_cache
+
+      self._layer_cache.set_layer(cache_key, LayerCacheEntry(
+        analysis=analysis,
+        layer=layer,
+        range=attrs_range,
+        symbols=frozenset(symbols)
+      ))
+
+      analysis_copy = LanguageServiceAnalysis()
+      analysis_copy += analysis
+
+      return analysis_copy, layer
+
+    return analysis, layer
+
+  def _parse_layer(
+    self,
+    attrs: Any,
+    /,
+    envs: EvalEnvs,
+    *,
+    extra_attributes: Optional[dict[str, lang.Attribute | lang.Type]],
+    mode: Literal['any', 'lead', 'passive']
   ):
     analysis = LanguageServiceAnalysis()
     context = AnalysisContext(
@@ -706,11 +1232,12 @@ class FiberParser:
 
     if extra_attributes is not None:
       block_type = self.block_type.copy()
-      block_type.add(extra_attributes, key=1)
+      block_type.add(extra_attributes, key=-1)
     else:
       block_type = self.block_type
 
-    block_result = analysis.add(block_type.analyze(attrs, context))
+    with measure(CompilationProfile.default_namespace, 'analyze_block'):
+      block_result = analysis.add(block_type.analyze(attrs, context))
 
     if isinstance(block_result, EllipsisType):
       return analysis, Ellipsis
@@ -718,7 +1245,7 @@ class FiberParser:
     # Process extra info
 
     if extra_attributes is not None:
-      extra_info = analysis.add(block_type.analyze_namespace(block_result, context, key=1))
+      extra_info = analysis.add(block_type.analyze_namespace(block_result, context, key=-1))
     else:
       extra_info = None
 
@@ -731,35 +1258,38 @@ class FiberParser:
 
     result_by_parser = dict[BaseParser, Any]()
 
-    for parser in self._parsers:
-      if hasattr(parser, 'preload'):
-        result = analysis.add(self.block_type.analyze_namespace(block_result, context, key=parser))
+    for parser_index, parser in self._preload_parsers:
+      result = analysis.add(self.block_type.analyze_namespace(block_result, context, key=parser_index))
 
-        if isinstance(result, EllipsisType):
-          return analysis, Ellipsis
+      if isinstance(result, EllipsisType):
+        return analysis, Ellipsis
 
+      # Preloading can change the parser's state, which prevents this layer and its parents from being reused.
+      if result:
+        self._layer_frames[:] = [False] * len(self._layer_frames)
+
+      with measure(parser.namespace, 'preload'):
         _ = analysis.add(parser.preload(result))
-        result_by_parser[parser] = result
+      result_by_parser[parser] = result
 
     failure = False
 
-    for transformer in self.transformers:
-      parser = next(parser for parser in self._parsers if transformer in parser.transformers)
-
+    for parser, transformer, transformer_key in self._transformer_entries:
       current_envs = envs + extra_envs
       context = AnalysisContext(envs=current_envs)
 
-      if parser.layer_attributes is not None:
+      if parser in self._layer_attributes_parsers:
         unit_attrs = result_by_parser[parser]
       else:
-        unit_attrs = analysis.add(self.block_type.analyze_namespace(block_result, context, key=transformer))
+        unit_attrs = analysis.add(self.block_type.analyze_namespace(block_result, context, key=transformer_key))
 
       if isinstance(unit_attrs, EllipsisType):
         failure = failure or isinstance(transformer, BaseLeadTransformer)
         continue
 
       if isinstance(transformer, BaseLeadTransformer):
-        new_lead_transforms = analysis.add(transformer.prepare(unit_attrs, current_envs))
+        with measure(parser.namespace, 'prepare'):
+          new_lead_transforms = analysis.add(transformer.prepare(unit_attrs, current_envs))
 
         if not isinstance(new_lead_transforms, EllipsisType):
           if (not lead_transforms) and new_lead_transforms:
@@ -767,7 +1297,8 @@ class FiberParser:
 
           lead_transforms += [(transformer, transform) for transform in new_lead_transforms]
       else:
-        new_passive_transform = analysis.add(transformer.prepare(unit_attrs, current_envs))
+        with measure(parser.namespace, 'prepare'):
+          new_passive_transform = analysis.add(transformer.prepare(unit_attrs, current_envs))
 
         if new_passive_transform and not isinstance(new_passive_transform, EllipsisType):
           extra_envs += new_passive_transform.envs
@@ -805,7 +1336,8 @@ class FiberParser:
 
     for parser in self._parsers:
       for transformer in parser.leaf_transformers:
-        current_block = analysis.add(transformer.execute(block))
+        with measure(parser.namespace, 'execute'):
+          current_block = analysis.add(transformer.execute(block))
 
         if isinstance(current_block, EllipsisType):
           return analysis, Ellipsis
@@ -825,5 +1357,6 @@ __all__ = [
   'BaseTransformer',
   'BaseTransformers',
   'Layer',
+  'LayerCache',
   'ProcessTransformer'
 ]
@@ -318,7 +318,7 @@ class ProcessProgram(HeadProgram):
       )
     )
 
-    analysis, data = await self._block._data.evaluate_final_async(EvalContext(stack, cwd_path=self._handle.master.experiment.path))
+    analysis, data = await self._block._data.evaluate_final_async(EvalContext(stack, cwd_path=self._handle.master.experiment.path, dependency_graph=self._handle.master.dependency_graph, evaluation_timeout=self._handle.master.host.expression_timeout))
 
     self._handle.send_analysis(RuntimeAnalysis.downcast(analysis))
 
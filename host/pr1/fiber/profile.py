@@ -0,0 +1,174 @@
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from logging import Logger
+from typing import Any, Optional
+
+
+@dataclass(kw_only=True)
+class CompilationProfileEntry:
+  count: int = 0
+  self_time: float = 0.0
+  time: float = 0.0
+
+  def export(self):
+    return {
+      "count": self.count,
+      "selfTime": self.self_time,
+      "time": self.time
+    }
+
+@dataclass(kw_only=True)
+class CompilationProfileCacheEntry:
+  hits: int = 0
+  misses: int = 0
+
+  @property
+  def hit_rate(self):
+    accesses = self.hits + self.misses
+    return (self.hits / accesses) if accesses > 0 else None
+
+  def export(self):
+    return {
+      "hitRate": self.hit_rate,
+      "hits": self.hits,
+      "misses": self.misses
+    }
+
+class CompilationProfileMeasurement:
+  __slots__ = ('_child_time', '_namespace', '_phase', '_profile', '_start_time')
+
+  def __init__(self, profile: 'CompilationProfile', namespace: Optional[str], phase: str):
+    self._child_time = 0.0
+    self._namespace = namespace
+    self._phase = phase
+    self._profile = profile
+    self._start_time = 0.0
+
+  def __enter__(self):
+    frames = self._profile._frames
+
+    # Measurements without a namespace, such as static analysis, are attributed to the enclosing one
+    if self._namespace is None:
+      self._namespace = frames[-1]._namespace if frames else CompilationProfile.default_namespace
+
+    frames.append(self)
+    self._start_time = time.perf_counter()
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    duration = time.perf_counter() - self._start_time
+    frames = self._profile._frames
+
+    frames.pop()
+
+    if frames:
+      frames[-1]._child_time += duration
+
+    assert self._namespace is not None
+    entry = self._profile.get_entry(self._namespace, self._phase)
+
+    entry.count += 1
+    entry.self_time += duration - self._child_time
+    entry.time += duration
+
+class NullMeasurement:
+  def __enter__(self):
+    pass
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    pass
+
+null_measurement = NullMeasurement()
+
+
+class CompilationProfile:
+  """
+  Wall time and call counts of compilation phases, aggregated by unit namespace.
+
+  The time of a measurement includes that of nested measurements, while its self time excludes it. Accesses to
+  caches consulted during compilation are counted separately.
+  """
+
+  default_namespace = 'fiber'
+
+  def __init__(self):
+    self.caches = dict[str, CompilationProfileCacheEntry]()
+    self.entries = dict[str, dict[str, CompilationProfileEntry]]()
+    self.total_time = 0.0
+    self.transformer_namespaces = dict[type, str]()
+
+    self._frames = list[CompilationProfileMeasurement]()
+
+  def get_entry(self, namespace: str, phase: str):
+    namespace_entries = self.entries.setdefault(namespace, dict())
+
+    if not (entry := namespace_entries.get(phase)):
+      entry = CompilationProfileEntry()
+      namespace_entries[phase] = entry
+
+    return entry
+
+  def measure(self, namespace: Optional[str], phase: str):
+    return CompilationProfileMeasurement(self, namespace, phase)
+
+  def record_cache_access(self, cache_name: str, hit: bool):
+    if not (entry := self.caches.get(cache_name)):
+      entry = CompilationProfileCacheEntry()
+      self.caches[cache_name] = entry
+
+    if hit:
+      entry.hits += 1
+    else:
+      entry.misses += 1
+
+  def export(self):
+    return {
+      "caches": {
+        cache_name: entry.export() for cache_name, entry in self.caches.items()
+      },
+      "namespaces": {
+        namespace: {
+          phase: entry.export() for phase, entry in namespace_entries.items()
+        } for namespace, namespace_entries in self.entries.items()
+      },
+      "totalTime": self.total_time
+    }
+
+  def log(self, logger: Logger):
+    logger.debug(f"Compiled in {(self.total_time * 1000):.2f} ms")
+
+    namespace_self_times = sorted((
+      (sum(entry.self_time for entry in namespace_entries.values()), namespace) for namespace, namespace_entries in self.entries.items()
+    ), reverse=True)
+
+    for namespace_self_time, namespace in namespace_self_times:
+      phases = ", ".join(f"{phase}: {entry.count} calls, {(entry.self_time * 1000):.2f} ms" for phase, entry in self.entries[namespace].items())
+      logger.debug(f"  {namespace}: {(namespace_self_time * 1000):.2f} ms ({phases})")
+
+    for cache_name, entry in self.caches.items():
+      hit_rate = entry.hit_rate
+      logger.debug(f"  {cache_name} cache: {entry.hits} hits, {entry.misses} misses" + (f" ({(hit_rate * 100):.1f}% hit rate)" if hit_rate is not None else ""))
+
+
+current_profile = ContextVar[Optional[CompilationProfile]]('current_profile', default=None)
+
+def measure(namespace: Optional[str], phase: str, /) -> Any:
+  profile = current_profile.get()
+  return profile.measure(namespace, phase) if profile else null_measurement
+
+def measure_transformer(transformer: Any, phase: str, /) -> Any:
+  profile = current_profile.get()
+  return profile.measure(profile.transformer_namespaces.get(type(transformer)), phase) if profile else null_measurement
+
+def record_cache_access(cache_name: str, hit: bool, /):
+  if profile := current_profile.get():
+    profile.record_cache_access(cache_name, hit)
+
+
+__all__ = [
+  'CompilationProfile',
+  'current_profile',
+  'measure',
+  'measure_transformer',
+  'record_cache_access'
+]
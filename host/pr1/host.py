@@ -6,23 +6,32 @@ import time
 import uuid
 from types import EllipsisType, NoneType
 from typing import Any, Optional, Protocol, cast
+from weakref import WeakKeyDictionary
+
+from quantops import Quantity
 
 from . import logger, reader
 from .analysis import DiagnosticAnalysis
 from .devices.nodes.collection import CollectionNode
 from .devices.nodes.common import BaseNode, NodeId, NodePath
 from .document import Document
-from .draft import Draft, DraftCompilation
-from .experiment import Experiment, ExperimentId
+from .draft import (Draft, DraftCompilation, DraftCompilationCache,
+                    DraftCompilationExportHistory, DraftCompilationWorker)
+from .experiment import EventIndex, Experiment, ExperimentId
 from .fiber.master2 import Master
 from .fiber.parser import AnalysisContext, GlobalContext
-from .input import (Attribute, BoolType, KVDictType, PrimitiveType, RecordType,
-                    StrType, UnionType)
+from .input import (Attribute, BoolType, EnumType, IntType, KVDictType,
+                    PrimitiveType, QuantityType, RecordType, StrType,
+                    UnionType)
 from .langservice import LanguageServiceAnalysis
 from .plugin.manager import PluginManager, PluginName
+from .report import ExperimentReportCompression, ExperimentReportDurability
 from .util.misc import create_datainstance
 from .util.pool import Pool
+from .util.provenance import (ProvenanceCapture, ProvenanceMode,
+                              current_provenance_capture)
 from .units.base import BaseExecutor
+from .ureg import ureg
 
 
 class HostRootNode(CollectionNode):
@@ -70,9 +79,19 @@ class PluginConf(Protocol):
   path: Optional[str]
 
 class HostConf(Protocol):
+  expressionTimeout: Optional[Quantity]
   id: str
+  maxUpdateRate: Optional[Quantity]
   name: str
   plugin: dict[str, PluginConf]
+  provenance: ProvenanceMode
+  provenanceSampleInterval: int
+  reportCompression: ExperimentReportCompression
+  reportFollowInterval: Quantity
+  reportQueueSize: int
+  reportSyncEventCount: Optional[int]
+  reportSyncInterval: Optional[Quantity]
+  reportSyncOnError: bool
 
 
 class Host:
@@ -85,6 +104,9 @@ class Host:
     self.experiments_path = self.data_dir / "experiments"
     self.experiments_path.mkdir(exist_ok=True)
 
+    self.compilation_cache = DraftCompilationCache()
+    self.compilation_export_histories = WeakKeyDictionary[Any, DraftCompilationExportHistory]()
+    self.compilation_worker = DraftCompilationWorker(self.compilation_cache)
     self.devices = dict[NodeId, BaseNode]()
     self.pool: Pool
     self.root_node = HostRootNode(self.devices)
@@ -97,7 +119,9 @@ class Host:
     # -- Load configuration -------------------------------
 
     conf_type = RecordType({
+      'expressionTimeout': Attribute(QuantityType('second', allow_nil=True, min=(0.001 * ureg.second)), default=None),
       'id': StrType(),
+      'maxUpdateRate': Attribute(QuantityType('hertz', allow_nil=True, min=(0.0 * ureg.hertz)), default=(20.0 * ureg.hertz)),
       'name': StrType(),
       'plugins': UnionType(
         PrimitiveType(NoneType),
@@ -110,6 +134,14 @@ class Host:
           })
         )
       ),
+      'provenance': Attribute(EnumType('full', 'off', 'sampled'), default='off'),
+      'provenanceSampleInterval': Attribute(IntType(mode='positive'), default=100),
+      'reportCompression': Attribute(EnumType('lzma', 'none', 'zlib'), default='zlib'),
+      'reportFollowInterval': Attribute(QuantityType('second', min=(0.0 * ureg.second)), default=(1.0 * ureg.second)),
+      'reportQueueSize': Attribute(IntType(mode='positive'), default=1024),
+      'reportSyncEventCount': Attribute(UnionType(PrimitiveType(NoneType), IntType(mode='positive')), default=None),
+      'reportSyncInterval': Attribute(QuantityType('second', allow_nil=True, min=(0.0 * ureg.second)), default=(1.0 * ureg.second)),
+      'reportSyncOnError': Attribute(BoolType(), default=True),
       'version': PrimitiveType(int)
     })
 
@@ -128,7 +160,16 @@ class Host:
       document = Document.text(file.read())
 
     analysis = LanguageServiceAnalysis()
-    conf_data = analysis.add(reader.loads2(document.source))
+
+    if (fast_result := reader.loads_fast(document.source)):
+      plain_conf_data, conf_locations = fast_result
+
+      # Plugin options, below 'plugins' and the plugin's name, are only located once their plugin is known to be enabled
+      conf_data = conf_locations.locate(plain_conf_data, depth=2)
+    else:
+      conf_locations = None
+      conf_data = analysis.add(reader.loads2(document.source))
+
     raw_conf = analysis.add(conf_type.analyze(conf_data, AnalysisContext()))
 
     analysis.log_diagnostics(logger)
@@ -141,12 +182,26 @@ class Host:
     plugins_conf = {
       namespace.value: create_datainstance({
         **conf.plugins[namespace]._asdict(), # type: ignore
-        'options': raw_plugin_conf.value.options
+        'options': conf_locations.expand(raw_plugin_conf.value.options) if conf_locations and conf.plugins[namespace].enabled else raw_plugin_conf.value.options
       }) for namespace, raw_plugin_conf in (raw_conf.value.plugins.value or dict()).items()
     }
 
+    # A null or zero maximum update rate disables rate limiting
+    max_update_rate: float = (conf.maxUpdateRate / ureg.hertz).magnitude if (conf.maxUpdateRate is not None) else 0.0
+
+    self.expression_timeout: Optional[float] = (conf.expressionTimeout / ureg.second).magnitude if (conf.expressionTimeout is not None) else None
     self.id = conf.id
+    self.min_update_interval: Optional[float] = (1.0 / max_update_rate) if (max_update_rate > 0.0) else None
     self.name = conf.name
+    self.provenance_capture = ProvenanceCapture(conf.provenance, sample_interval=conf.provenanceSampleInterval)
+    self.report_compression = conf.reportCompression
+    self.report_durability = ExperimentReportDurability(
+      sync_event_count=conf.reportSyncEventCount,
+      sync_interval=((conf.reportSyncInterval / ureg.second).magnitude if (conf.reportSyncInterval is not None) else None),
+      sync_on_error=conf.reportSyncOnError
+    )
+    self.report_follow_interval: float = (conf.reportFollowInterval / ureg.second).magnitude
+    self.report_queue_size = conf.reportQueueSize
     self.start_time = round(time.time() * 1000)
 
 
@@ -174,6 +229,9 @@ class Host:
   async def start(self):
     logger.info("Initializing host")
 
+    # Inherited by all tasks created by the host
+    current_provenance_capture.set(self.provenance_capture)
+
     async with Pool.open("Host pool") as self.pool:
       logger.debug("Initializing executors")
 
@@ -204,24 +262,27 @@ class Host:
   async def reload_units(self):
     logger.info("Reloading development units")
 
-    self.manager.reload()
-
     analysis = DiagnosticAnalysis()
 
-    for unit_info in self.manager.plugin_infos.values():
-      namespace = unit_info.namespace
+    # Compilations read units and devices from the compilation worker's thread
+    async with self.compilation_worker.hold():
+      self.manager.reload()
+      self.compilation_worker.cache.clear()
+
+      for unit_info in self.manager.plugin_infos.values():
+        namespace = unit_info.namespace
 
-      if unit_info.enabled and unit_info.development:
-        if namespace in self.executors:
-          await self.executors[namespace].destroy()
-          del self.executors[namespace]
+        if unit_info.enabled and unit_info.development:
+          if namespace in self.executors:
+            await self.executors[namespace].destroy()
+            del self.executors[namespace]
 
-        unit_analysis, executor = self.manager.create_executor(namespace, host=self)
-        analysis += unit_analysis
+          unit_analysis, executor = self.manager.create_executor(namespace, host=self)
+          analysis += unit_analysis
 
-        if not isinstance(executor, EllipsisType):
-          self.executors[namespace] = executor
-          await executor.initialize()
+          if not isinstance(executor, EllipsisType):
+            self.executors[namespace] = executor
+            await executor.initialize()
 
     analysis.log_diagnostics(logger)
 
@@ -277,6 +338,46 @@ class Host:
     self.previous_state = state
     return state_update
 
+  async def _stream_report_info(self, experiment: Experiment):
+    for chunk in experiment.report_reader.export_chunks(GlobalContext(self)):
+      yield chunk
+
+    yield { "type": "done" }
+
+  async def _stream_report_events(self, experiment: Experiment, event_indices: set[EventIndex], *, follow: bool):
+    context = GlobalContext(self)
+    report_reader = experiment.report_reader
+
+    # Requested events which do not exist yet remain pending and are sent once they do if following
+    event_count = report_reader.event_count
+    pending_event_indices = set(event_indices)
+
+    for chunk in report_reader.export_events_chunks(context, { event_index for event_index in pending_event_indices if event_index < event_count }):
+      pending_event_indices -= chunk["events"].keys()
+      yield chunk
+
+    # Events appended to the report of a running experiment are sent as they are read
+    if follow:
+      while True:
+        running = experiment.master is not None
+
+        if running:
+          await asyncio.sleep(self.report_follow_interval)
+
+        report_reader = experiment.report_reader
+        new_event_count = report_reader.event_count
+
+        for chunk in report_reader.export_events_chunks(context, { event_index for event_index in pending_event_indices if event_index < new_event_count } | set(range(event_count, new_event_count))):
+          pending_event_indices -= chunk["events"].keys()
+          yield chunk
+
+        event_count = new_event_count
+
+        if not running:
+          break
+
+    yield { "type": "done" }
+
   async def process_request(self, request, *, agent) -> Any:
     if request["type"] == "createDraftSample":
       return "# Example protocol\nname: My protocol\n\nstages:\n  - steps:\n      - name: Step no. 1\n        duration: 5 min"
@@ -293,8 +394,8 @@ class Host:
         draft = Draft.load(request["draft"])
 
         try:
-          compilation = draft.compile(host=self)
-        except:
+          compilation_result = await self.compilation_worker.compile(draft, host=self, profile=request.get("profile", False))
+        except Exception:
           import traceback
           traceback.print_exc()
 
@@ -305,6 +406,10 @@ class Host:
             protocol=None
           )
 
+          compilation_result = None
+        else:
+          compilation = compilation_result.compilation
+
         if compilation.protocol and (experiment_id := request["studyExperimentId"]):
           experiment = self.experiments[experiment_id]
           assert experiment.master
@@ -313,8 +418,18 @@ class Host:
         else:
           study = None
 
+        compilation_export = compilation.export(GlobalContext(self))
+
+        # Only send differences from the last export sent to this client, unless it requested a resynchronization
+        if request.get("exportEncoding") == "diff":
+          export_history = self.compilation_export_histories.setdefault(agent, DraftCompilationExportHistory())
+          compilation_export = export_history.encode(draft.id, compilation_export, base_revision=request.get("baseRevision"))
+
         return {
-          **compilation.export(GlobalContext(self)),
+          **compilation_export,
+          "compileTime": (compilation_result and compilation_result.compile_time),
+          "profile": (compilation.profile.export() if request.get("profile") and compilation.profile else None),
+          "queueTime": (compilation_result and compilation_result.queue_time),
           "study": study and {
             "mark": study[1].export(),
             "point": study[0].export()
@@ -356,6 +471,22 @@ class Host:
         experiment = self.experiments[request["experimentId"]]
         return experiment.report_reader.export_events(GlobalContext(self), set(request["eventIndices"]))
 
+      case "streamExperimentReportInfo":
+        experiment = self.experiments[request["experimentId"]]
+        channel = agent.register_generator_channel(self._stream_report_info(experiment))
+
+        return {
+          "channelId": channel.id
+        }
+
+      case "streamExperimentReportEvents":
+        experiment = self.experiments[request["experimentId"]]
+        channel = agent.register_generator_channel(self._stream_report_events(experiment, set(request["eventIndices"]), follow=request.get("follow", False)))
+
+        return {
+          "channelId": channel.id
+        }
+
       case "requestToExecutor":
         return await self.executors[request["namespace"]].request(request["data"], agent=agent)
 
@@ -385,7 +516,11 @@ class Host:
           raise Exception("Already running")
 
         draft = Draft.load(request["draft"])
-        compilation = draft.compile(host=self)
+        compilation = (await self.compilation_worker.compile(draft, host=self, supersede=False)).compilation
+
+        # The experiment could have been started while the draft was compiling
+        if experiment.master:
+          raise Exception("Already running")
 
         logger.info(f"Running protocol on experiment '{experiment.id}'")
 
@@ -322,6 +322,7 @@ class DivisibleCompositeDictType(Type, Generic[T]):
     self._attributes_by_key = dict[T, dict[str, Attribute]]()
     self._attributes_by_name = dict[str, tuple[bool, Optional[T]]]()
     self._attributes_by_unique_name = dict[str, tuple[T, str]]()
+    self._completion_items: Optional[list[LanguageServiceCompletionItem]] = None
 
     # [_/1]
     # [_/1], a/1
@@ -333,6 +334,13 @@ class DivisibleCompositeDictType(Type, Generic[T]):
 
   @property
   def completion_items(self):
+    # Cached as the type is analyzed for every block
+    if self._completion_items is None:
+      self._completion_items = self._create_completion_items()
+
+    return self._completion_items
+
+  def _create_completion_items(self):
     completion_items = list[LanguageServiceCompletionItem]()
 
     for namespace, attrs in self._attributes_by_key.items():
@@ -354,6 +362,7 @@ class DivisibleCompositeDictType(Type, Generic[T]):
     assert key is not None
 
     self._attributes_by_key[key] = dict()
+    self._completion_items = None
 
     for attr_name, raw_attr in attrs.items():
       if isinstance(raw_attr, Attribute):
@@ -383,6 +392,10 @@ class DivisibleCompositeDictType(Type, Generic[T]):
         case (True, (True, _)):
           raise ValueError(f"Duplicate name '{attr_name}'")
 
+  def extend(self, other: 'DivisibleCompositeDictType[T]', /):
+    for key, attrs in other._attributes_by_key.items():
+      self.add(attrs, key=key)
+
   def analyze(self, obj, /, context):
     analysis = LanguageServiceAnalysis()
     primitive_result = analysis.add(PrimitiveType(dict).analyze(obj, context))
@@ -481,6 +494,7 @@ class DivisibleCompositeDictType(Type, Generic[T]):
     output._attributes_by_key = self._attributes_by_key.copy()
     output._attributes_by_name = self._attributes_by_name.copy()
     output._attributes_by_unique_name = self._attributes_by_unique_name.copy()
+    output._completion_items = self._completion_items
 
     output._foldable = self._foldable
     output._separator = self._separator
@@ -10,7 +10,7 @@ from ..fiber.eval import EvalContext
 from ..fiber.expr import Evaluable, EvaluableConstantValue, EvaluablePythonExpr
 from ..langservice import *
 from ..reader import LocatedValue
-from ..staticanalysis.expr import BaseExprEval, BaseExprWatch, Dependency
+from ..staticanalysis.expr import BaseExprEval, BaseExprWatch
 from ..util.pool import Pool
 from . import PossibleExprType, Type
 
@@ -149,12 +149,14 @@ class VariableDynamicValue(DynamicValue):
   _watched: BaseExprWatch
 
   async def watch(self, context: EvalContext):
-    async for changed_dependencies in collect_generators((dependency, dependency.watch()) for dependency in self._watched.dependencies):
-      yield self._evaluate(context, changed_dependencies)
-
-  def _evaluate(self, context: EvalContext, changed_dependencies: set[Dependency]):
-    raw_result = self._watched.evaluate(changed_dependencies)
+    if context.dependency_graph:
+      async for raw_result in context.dependency_graph.watch(self._obj.expr):
+        yield self._analyze(context, raw_result)
+    else:
+      async for changed_dependencies in collect_generators((dependency, dependency.watch()) for dependency in self._watched.dependencies):
+        yield self._analyze(context, self._watched.evaluate(changed_dependencies))
 
+  def _analyze(self, context: EvalContext, raw_result: Any):
     analysis, result = self._obj_type.analyze(LocatedValue(raw_result, self._obj.contents.area), AnalysisContext(auto_expr=True))
 
     if isinstance(result, EllipsisType):
@@ -1,11 +1,15 @@
-from dataclasses import dataclass, field
+from array import array
+from collections.abc import ItemsView, KeysView, ValuesView
+from dataclasses import dataclass, field, replace
 from enum import Enum
 import ast
+import bisect
+import copy
 import functools
 import math
 import re
 import sys
-from typing import Any, Generic, Optional, TypeVar, cast
+from typing import Any, Generic, Iterable, Optional, Sequence, TypeVar, cast
 
 from .util.misc import DataInstance, create_datainstance
 from .error import Diagnostic, DiagnosticDocumentReference
@@ -41,11 +45,22 @@ class Location:
 
 
 class LocationRange:
+  __slots__ = ('end', 'source', 'start')
+
   def __init__(self, source: 'Source', start: int, end: int):
     self.end = end
     self.source = source
     self.start = start
 
+  def __getstate__(self):
+    return (self.source, self.start, self.end)
+
+  def __setstate__(self, state: 'tuple[Source, int, int] | dict[str, Any]'):
+    if isinstance(state, dict):
+      state = (state['source'], state['start'], state['end'])
+
+    self.source, self.start, self.end = state
+
   def __mod__(self, offset: tuple[int, int] | int):
     start, end = offset if isinstance(offset, tuple) else (offset, offset + 1)
 
@@ -86,37 +101,65 @@ class LocationRange:
     return cls(source, 0, len(value))
 
 
+# Ranges are stored as consecutive (start, end) pairs of 32-bit integers rather than as LocationRange
+# objects, which are only created when accessed. All ranges of an area belong to the same source.
 class LocationArea:
-  def __init__(self, ranges: Optional[list[LocationRange]] = None):
-    self.ranges = ranges or list()
+  __slots__ = ('_source', '_spans')
+
+  def __init__(self, ranges: 'Optional[Sequence[LocationRange]]' = None):
+    self._source: 'Optional[Source]' = ranges[0].source if ranges else None
+    self._spans = array('i', [offset for range in ranges for offset in (range.start, range.end)]) if ranges else array('i')
+
+  @classmethod
+  def _from_spans(cls, source: 'Optional[Source]', spans: array):
+    area = cls.__new__(cls)
+    area._source = source if spans else None
+    area._spans = spans
+
+    return area
+
+  def __getstate__(self):
+    return (self._source, self._spans)
+
+  def __setstate__(self, state: 'tuple[Optional[Source], array] | dict[str, Any]'):
+    if isinstance(state, dict):
+      other = LocationArea(state['ranges'])
+      state = (other._source, other._spans)
+
+    self._source, self._spans = state
+
+  @property
+  def ranges(self):
+    spans = self._spans
+    return [LocationRange(self._source, spans[index], spans[index + 1]) for index in range(0, len(spans), 2)] # type: ignore
 
   @property
   def source(self):
-    return self.ranges[0].source if self.ranges else None
+    return self._source
 
   def enclosing_range(self):
     return LocationRange(
-      source=self.ranges[0].source,
-      start=self.ranges[0].start,
-      end=self.ranges[-1].end
+      source=self._source, # type: ignore
+      start=self._spans[0],
+      end=self._spans[-1]
     )
 
   def single_range(self):
-    assert len(self.ranges) == 1
-    return self.ranges[0]
+    assert len(self._spans) == 2
+    return LocationRange(self._source, self._spans[0], self._spans[1]) # type: ignore
 
   def location(self):
-    assert len(self.ranges) == 1
-    return self.ranges[0].location()
+    assert len(self._spans) == 2
+    return self.single_range().location()
 
   def format(self):
     output = str()
 
-    if not self.ranges:
+    if not self._spans:
       return output
 
-    source = self.ranges[0].source
-    lines_source = source.splitlines()
+    source = self._source
+    assert source is not None
 
     lines_ranges = dict()
 
@@ -130,7 +173,7 @@ class LocationArea:
 
         lines_ranges[line_index].append(range(
           start.column if line_index == start.line else 0,
-          end.column if line_index == end.line else len(lines_source[line_index]) + 1
+          end.column if line_index == end.line else len(source.line_value(line_index)) + 1
         ))
 
     lines_list = sorted(lines_ranges.keys())
@@ -138,7 +181,7 @@ class LocationArea:
     width_line = math.ceil(math.log(lines_list[-1] + 2, 10))
 
     for index, line_index in enumerate(lines_list):
-      line_source = lines_source[line_index]
+      line_source = source.line_value(line_index)
 
       if (index > 0) and (line_index != (lines_list[index - 1] + 1)):
         output += "\n"
@@ -156,28 +199,43 @@ class LocationArea:
 
     return output
 
-  def __add__(self, other: 'LocationArea'):
-    ranges = (self.ranges + [other]) if isinstance(other, LocationRange) else (self.ranges + other.ranges)
-    output = list()
+  def __add__(self, other: 'LocationArea | LocationRange'):
+    if isinstance(other, LocationRange):
+      return LocationArea._merge_spans(self._source if self._spans else other.source, [*self._iter_spans(), (other.start, other.end)])
+
+    return LocationArea._merge_spans(self._source if self._spans else other._source, [*self._iter_spans(), *other._iter_spans()])
+
+  def _iter_spans(self):
+    spans = self._spans
+    return zip(spans[0::2], spans[1::2])
 
-    for range in sorted(ranges):
-      if output and (output[-1].end >= range.start):
-        output[-1].end = max(output[-1].end, range.end)
+  # Equivalent to summing areas one by one, without sorting the accumulated ranges on every addition
+  @staticmethod
+  def merge(ranges: 'Sequence[LocationRange]'):
+    return LocationArea._merge_spans(ranges[0].source if ranges else None, [(range.start, range.end) for range in ranges])
+
+  @staticmethod
+  def _merge_spans(source: 'Optional[Source]', spans: 'list[tuple[int, int]]'):
+    output = array('i')
+
+    for start, end in sorted(spans):
+      if output and (output[-1] >= start):
+        output[-1] = max(output[-1], end)
       else:
-        output.append(LocationRange(range.source, range.start, range.end))
+        output += array('i', (start, end))
 
-    # print(self, '+', other, '->', output)
-    return LocationArea(output)
+    return LocationArea._from_spans(source, output)
 
   def __mod__(self, offset: tuple[int, int] | int):
     start, end = offset if isinstance(offset, tuple) else (offset, offset + 1)
 
     index = 0
-    output = list()
+    output = array('i')
 
-    for range in self.ranges:
+    for range_start_offset, range_end_offset in self._iter_spans():
+      range_length = range_end_offset - range_start_offset
       range_start = index
-      range_end = index + (range.end - range.start)
+      range_end = index + range_length
 
       delta_start = 0
       delta_end = 0
@@ -189,16 +247,14 @@ class LocationArea:
         delta_end = range_end - end
 
       if not ((end < range_start) or (start > range_end)):
-        output.append(LocationRange(range.source, range.start - delta_start, range.end - delta_end))
-
-      index += (range.end - range.start)
+        output += array('i', (range_start_offset - delta_start, range_end_offset - delta_end))
 
-    # print(self.ranges, '->', output, start, end)
+      index += range_length
 
-    return LocationArea(output)
+    return LocationArea._from_spans(self._source, output)
 
   def __repr__(self):
-    return "LocationArea(" + ", ".join([f"{range.start} -> {range.end}" for range in self.ranges]) + ")"
+    return "LocationArea(" + ", ".join([f"{start} -> {end}" for start, end in self._iter_spans()]) + ")"
 
 
 class LocatedError(Exception):
@@ -220,13 +276,12 @@ class LocatedError(Exception):
     if (start.line == end.line) and (start.column == end.column):
       end = Position(end.line, end.column + 1)
 
-    lines = self.location.source.splitlines()
+    source = self.location.source
     width_line = math.ceil(math.log(end.line + 1 + context_after + 1, 10))
     end_line = end.line - (1 if end.column == 0 else 0)
 
-    for line_index, line in enumerate(lines):
-      if (line_index < start.line - context_before) or (line_index > end_line + context_after):
-        continue
+    for line_index in range(max(start.line - context_before, 0), min(end_line + context_after + 1, source.line_count)):
+      line = source.line_value(line_index)
 
       print(f" {str(line_index + 1).rjust(width_line, ' ')} | {line}", file=file)
 
@@ -279,19 +334,22 @@ class LocatedValue(Generic[T_co]):
     if not area:
       return UnlocatedValue(obj)
 
+    # Children of deeply-located containers are only located when accessed
     match obj:
       case LocatedValue():
         return obj
       case dict() if deep:
-        return LocatedDict({ cls.new(key, area, deep=True): cls.new(value, area, deep=True) for key, value in obj.items() }, area)
+        return LazyLocatedDict(obj, area)
       case dict():
         return LocatedDict(obj, area)
       case list() if deep:
-        return LocatedList([cls.new(value, area, deep=True) for value in obj], area)
+        return LazyLocatedList(obj, area)
       case list():
         return LocatedList(obj, area)
       case str():
         return LocatedString(obj, area, absolute=False)
+      case _ if is_opaque_value(obj):
+        return ShallowLocatedValue(obj, area)
       case _:
         return LocatedValueContainer(obj, area)
 
@@ -336,11 +394,38 @@ class UnlocatedValue(Generic[T]):
 PossiblyLocatedValue = LocatedValue[T] | UnlocatedValue[T]
 
 
+# Opaque values are never located deeply, even if they contain other values
+def is_opaque_value(obj: Any, /):
+  if isinstance(obj, (bytes, bytearray, memoryview)):
+    return True
+
+  # NumPy is not imported here, arrays can only exist if it was imported elsewhere
+  numpy = sys.modules.get('numpy')
+  return (numpy is not None) and isinstance(obj, numpy.ndarray)
+
+def dislocate_value(obj: Any, /) -> Any:
+  match obj:
+    case LocatedValue():
+      return obj.dislocate()
+    case dict():
+      return { dislocate_value(key): dislocate_value(value) for key, value in obj.items() }
+    case list():
+      return [dislocate_value(item) for item in obj]
+    case _:
+      return obj
+
+
 class LocatedValueContainer(LocatedValue[T], Generic[T]):
   def __repr__(self):
     return f"{self.__class__.__name__}({self.value!r})"
 
 
+# A located container whose children are plain values
+class ShallowLocatedValue(LocatedValueContainer[T], Generic[T]):
+  def dislocate(self):
+    return self.value
+
+
 class LocatedString(str, LocatedValue[str]):
   def __new__(cls, value: str, *args, **kwargs):
     return super(LocatedString, cls).__new__(cls, value)
@@ -405,14 +490,24 @@ class LocatedString(str, LocatedValue[str]):
     stripped = self.value.rstrip(chars)
     return self[0:len(stripped)]
 
+  # Offsets of the first character of each line, computed once and shared by all position lookups
+  @functools.cached_property
+  def _line_starts(self):
+    return [0, *(match.end() for match in re.finditer("\n", self.value))]
+
   @functools.cached_property
   def _line_cumlengths(self):
-    lengths = [0]
+    return [*self._line_starts, len(self.value)]
+
+  @property
+  def line_count(self):
+    return len(self._line_starts)
 
-    for line in self.splitlines(keepends=True):
-      lengths.append(lengths[-1] + len(line))
+  def line_value(self, line: int):
+    line_starts = self._line_starts
+    end = (line_starts[line + 1] - 1) if (line + 1) < len(line_starts) else len(self.value)
 
-    return lengths
+    return self.value[line_starts[line]:end]
 
   def compute_location(self, position: Position):
     return self._line_cumlengths[position.line] + position.column
@@ -442,10 +537,8 @@ class LocatedString(str, LocatedValue[str]):
     return self[start:end]
 
   def offset_position(self, offset: int):
-    line = self.value[:offset].count("\n")
-    column = (offset - self.value[:offset].rindex("\n") - 1) if line > 0 else offset
-
-    return Position(line, column)
+    line = bisect.bisect_right(self._line_starts, offset) - 1
+    return Position(line, offset - self._line_starts[line])
 
   @staticmethod
   def from_match_group(match: re.Match, group: int):
@@ -483,6 +576,105 @@ class LocatedList(list[T], LocatedValue[list[T]], Generic[T]):
     return f"{self.__class__.__name__}({self.value!r})"
 
 
+# A dict which stores plain values and locates them with a common area when accessed
+class LazyDict(dict[K, V], Generic[K, V]):
+  def __init__(self, value: dict, area: LocationArea):
+    dict.__init__(self, value)
+    self._locate_area = area
+
+  def _locate(self, obj: Any):
+    return LocatedValue.new(obj, self._locate_area, deep=True)
+
+  def __getitem__(self, key: K) -> V:
+    return self._locate(dict.__getitem__(self, key))
+
+  def __iter__(self):
+    for key in dict.__iter__(self):
+      yield self._locate(key)
+
+  def __reversed__(self):
+    for key in dict.__reversed__(self):
+      yield self._locate(key)
+
+  def copy(self):
+    return LazyDict(dict.copy(self), self._locate_area)
+
+  def get(self, key: K, default: Any = None, /):
+    return self[key] if key in self else default
+
+  # The views read through __iter__() and __getitem__() and therefore also locate keys and values
+  def items(self): # type: ignore
+    return ItemsView(self)
+
+  def keys(self): # type: ignore
+    return KeysView(self)
+
+  def values(self): # type: ignore
+    return ValuesView(self)
+
+  def pop(self, key: K, /, *args: Any):
+    if key in self:
+      return self._locate(dict.pop(self, key))
+
+    return dict.pop(self, key, *args)
+
+  def popitem(self):
+    key, value = dict.popitem(self)
+    return self._locate(key), self._locate(value)
+
+  def setdefault(self, key: K, default: Any = None, /):
+    return self._locate(dict.setdefault(self, key, default))
+
+class LazyLocatedDict(LazyDict[K, V], LocatedDict[K, V], Generic[K, V]):
+  def __init__(self, value: dict, area: LocationArea):
+    LazyDict.__init__(self, value, area)
+    LocatedValue.__init__(self, LazyDict(value, area), area)
+
+  def __repr__(self):
+    return f"{self.__class__.__name__}({dict.__repr__(self)})"
+
+  def copy(self):
+    return LazyLocatedDict(dict.copy(self), self.area)
+
+  def dislocate(self):
+    return dislocate_value(dict(dict.items(self)))
+
+
+# A list which stores plain items and locates them with a common area when accessed
+class LazyList(list[T], Generic[T]):
+  def __init__(self, value: list, area: LocationArea):
+    list.__init__(self, value)
+    self._locate_area = area
+
+  def _locate(self, obj: Any):
+    return LocatedValue.new(obj, self._locate_area, deep=True)
+
+  def __getitem__(self, key: int | slice): # type: ignore
+    if isinstance(key, slice):
+      return [self._locate(item) for item in list.__getitem__(self, key)]
+
+    return self._locate(list.__getitem__(self, key))
+
+  def __iter__(self):
+    for item in list.__iter__(self):
+      yield self._locate(item)
+
+  def __reversed__(self):
+    for item in list.__reversed__(self):
+      yield self._locate(item)
+
+class LazyLocatedList(LazyList[T], LocatedList[T], Generic[T]):
+  def __init__(self, value: list, area: LocationArea):
+    LazyList.__init__(self, value, area)
+    LocatedValue.__init__(self, LazyList(value, area), area)
+
+  def __repr__(self):
+    return f"{self.__class__.__name__}({list.__repr__(self)})"
+
+  def dislocate(self):
+    return dislocate_value(list(list.__iter__(self)))
+
+
 class Source(LocatedString):
   def __init__(self, value: LocatedString | str, *, origin: Optional[Any] = None):
     if isinstance(value, LocatedString):
@@ -628,125 +820,157 @@ def tokenize(raw_source: Source | str, /):
   source = Source(raw_source) if not isinstance(raw_source, Source) else raw_source
   tokens = list[Token]()
 
+  for line in tokenize_lines(source, range(source.line_count)):
+    errors += line.errors
+    warnings += line.warnings
 
-  # Check if all characters are ASCII
+    if line.token:
+      tokens.append(line.token)
 
-  for line in source.splitlines():
-    if not is_basic_ascii(line):
-      start_index = None
+  return tokens, errors, warnings
 
-      for index, ch in enumerate(line):
-        if is_basic_ascii(ch):
-          if start_index is not None:
-            warnings.append(InvalidCharacterError(line[start_index:index]))
-            start_index = None
-        else:
-          if start_index is None:
-            start_index = index
 
-      if start_index is not None:
-        warnings.append(InvalidCharacterError(line[start_index:]))
+@dataclass(kw_only=True)
+class TokenizedLine:
+  errors: list[ReaderError]
+  token: Optional[Token]
+  warnings: list[ReaderError]
 
+  # Depth of the token, or -1 if the line has no token or only contains whitespace and comments
+  @property
+  def depth(self):
+    token = self.token
+    return token.depth if token and ((token.kind != TokenKind.Default) or token.key or token.value or (token.raw_value is None)) else -1
 
-  # Iterate over all lines and identify their line break
-  for full_line in source.splitlines(keepends=True):
-    if full_line[-1] == "\n":
-      line = full_line[:-1]
-      line_break = full_line[-1]
-    else:
-      line = full_line
-      line_break = str()
+def tokenize_lines(source: Source, line_indices: Iterable[int], /):
+  line_starts = source._line_cumlengths
 
-    # Find and remove the comment on the line, if any
-    comment_offset = line.find("#")
+  for line_index in line_indices:
+    errors = list[ReaderError]()
+    warnings = list[ReaderError]()
 
-    if comment_offset >= 0:
-      comment = line[(comment_offset + 1):].strip() or None
-      line = line[0:comment_offset]
-    else:
-      comment = None
+    token = tokenize_line(source[line_starts[line_index]:line_starts[line_index + 1]], errors, warnings)
 
-    # Calculate the indentation
-    indent_offset = len(line) - len(line.lstrip(Whitespace))
+    yield TokenizedLine(
+      errors=errors,
+      token=token,
+      warnings=warnings
+    )
 
-    # Remove whitespace on the right end of the line
-    unstripped_line = line
-    line = line.rstrip(Whitespace)
+def tokenize_line(full_line: LocatedString, errors: list[ReaderError], warnings: list[ReaderError]):
+  # Identify the line break
+  if full_line.value.endswith("\n"):
+    line = full_line[:-1]
+    line_break = full_line[-1]
+  else:
+    line = full_line
+    line_break = str()
 
-    # If the line only contained whitespace, that whitespace has already been removed above.
-    if indent_offset % IndentationWidth > 0:
-      # Raise an error if there is an odd whitespace count on the left end of the line and it is not empty
-      if line:
-        errors.append(UnreadableIndentationError(line[indent_offset:]))
-        continue
+  # Check if all characters are ASCII
+  if not is_basic_ascii(line):
+    start_index = None
+
+    for index, ch in enumerate(line):
+      if is_basic_ascii(ch):
+        if start_index is not None:
+          warnings.append(InvalidCharacterError(line[start_index:index]))
+          start_index = None
       else:
-        # Otherwise suppress the comment if the line is empty
-        comment = None
+        if start_index is None:
+          start_index = index
 
-    # Initialize a token instance
-    offset = indent_offset
-    token = Token(
-      comment=comment,
-      data=line[offset:],
-      depth=(indent_offset // IndentationWidth),
-      key=None,
-      kind=TokenKind.Default,
-      raw_value=None,
-      value=None
-    )
+    if start_index is not None:
+      warnings.append(InvalidCharacterError(line[start_index:]))
 
-    # Skip this line if empty or full of whitespace
-    if not line:
-      token.raw_value = unstripped_line
 
-    # If the line starts with a '|', then the token is a string and this iteration ends
-    elif line[offset] == "|":
-      offset = get_offset(line, offset)
-      token.kind = TokenKind.String
-      token.value = line[offset:] + line_break
+  # Find and remove the comment on the line, if any
+  comment_offset = line.find("#")
+
+  if comment_offset >= 0:
+    comment = line[(comment_offset + 1):].strip() or None
+    line = line[0:comment_offset]
+  else:
+    comment = None
+
+  # Calculate the indentation
+  indent_offset = len(line) - len(line.lstrip(Whitespace))
 
-    # Otherwise, continue
+  # Remove whitespace on the right end of the line
+  unstripped_line = line
+  line = line.rstrip(Whitespace)
+
+  # If the line only contained whitespace, that whitespace has already been removed above.
+  if indent_offset % IndentationWidth > 0:
+    # Raise an error if there is an odd whitespace count on the left end of the line and it is not empty
+    if line:
+      errors.append(UnreadableIndentationError(line[indent_offset:]))
+      return None
     else:
-      # If the line starts with a '-', then the token is a list
-      if line[offset] == "-":
-        offset = get_offset(line, offset)
-        token.kind = TokenKind.List
+      # Otherwise suppress the comment if the line is empty
+      comment = None
 
-      colon_offset = line.find(":", offset)
+  # Initialize a token instance
+  offset = indent_offset
+  token = Token(
+    comment=comment,
+    data=line[offset:],
+    depth=(indent_offset // IndentationWidth),
+    key=None,
+    kind=TokenKind.Default,
+    raw_value=None,
+    value=None
+  )
+
+  # Skip this line if empty or full of whitespace
+  if not line:
+    token.raw_value = unstripped_line
+
+  # If the line starts with a '|', then the token is a string and this iteration ends
+  elif line[offset] == "|":
+    offset = get_offset(line, offset)
+    token.kind = TokenKind.String
+    token.value = line[offset:] + line_break
+
+  # Otherwise, continue
+  else:
+    # If the line starts with a '-', then the token is a list
+    if line[offset] == "-":
+      offset = get_offset(line, offset)
+      token.kind = TokenKind.List
 
-      # If there is a ':', the token is a key or key-value pair, possibly also a list
-      if colon_offset >= 0:
-        key = line[offset:colon_offset].rstrip(Whitespace)
-        value_offset = get_offset(line, colon_offset)
-        value = line[value_offset:]
+    colon_offset = line.find(":", offset)
 
-        if key:
-          token.key = key
-        else:
-          errors.append(MissingKeyError(key))
-          token.key = None
+    # If there is a ':', the token is a key or key-value pair, possibly also a list
+    if colon_offset >= 0:
+      key = line[offset:colon_offset].rstrip(Whitespace)
+      value_offset = get_offset(line, colon_offset)
+      value = line[value_offset:]
 
-        token.value = value if value else None
+      if key:
+        token.key = key
+      else:
+        errors.append(MissingKeyError(key))
+        token.key = None
 
-      # If the token is a list, then it is just a value
-      elif token.kind == TokenKind.List:
-        value = line[offset:]
+      token.value = value if value else None
 
-        if value:
-          token.value = value
-        else:
-          errors.append(InvalidLineError(token.data))
-          token.raw_value = unstripped_line[offset:]
-          token.value = None
+    # If the token is a list, then it is just a value
+    elif token.kind == TokenKind.List:
+      value = line[offset:]
 
-      # Otherwise the line is invalid
+      if value:
+        token.value = value
       else:
         errors.append(InvalidLineError(token.data))
-        token.value = line[offset:]
+        token.raw_value = unstripped_line[offset:]
+        token.value = None
 
-    tokens.append(token)
+    # Otherwise the line is invalid
+    else:
+      errors.append(InvalidLineError(token.data))
+      token.value = line[offset:]
 
-  return tokens, errors, warnings
+  return token
 
 
 # Removes the index of the first non-whitespace character in 'line' starting from 'origin'
@@ -804,11 +1028,20 @@ class InvalidTokenError(ReaderError):
 
 
 def analyze(tokens: list[Token]):
-  errors = list[ReaderError]()
-  warnings = list[ReaderError]()
+  stack = [StackEntry()]
+  errors, warnings = analyze_lines(enumerate(tokens), stack)
+
+  return add_location(stack[0]), [error for _, error in errors], [warning for _, warning in warnings]
 
+
+# Analyzes tokens from 'stack', which is left with its initial length, with diagnostics tagged by the index of their line
+# Tokens must not be shallower than the last entry of the initial stack, which is left unfinalized.
+def analyze_lines(lines: Iterable[tuple[int, Token]], stack: list[StackEntry]):
+  errors = list[tuple[int, ReaderError]]()
+  warnings = list[tuple[int, ReaderError]]()
+
+  base_depth = len(stack) - 1
   comments = list[tuple[LocatedString, int]]()
-  stack = [StackEntry()]
   whitespace_tokens = list[Token]()
 
   # Pops the stack until reaching 'new_depth'
@@ -852,7 +1085,7 @@ def analyze(tokens: list[Token]):
     whitespace_tokens.clear()
 
 
-  for token in tokens:
+  for line_index, token in lines:
     depth = len(stack) - 1
     head = stack[-1]
 
@@ -866,7 +1099,7 @@ def analyze(tokens: list[Token]):
       continue
 
     if token.depth > depth:
-      errors.append(InvalidIndentationError(token.data))
+      errors.append((line_index, InvalidIndentationError(token.data)))
       comments.clear()
       continue
 
@@ -913,13 +1146,13 @@ def analyze(tokens: list[Token]):
 
       # Add an error if the token's kind is unexpected
       if token.kind != TokenKind.Default:
-        errors.append(InvalidTokenError(token.data))
+        errors.append((line_index, InvalidTokenError(token.data)))
         continue
 
       # Add an error if the token's key already exists
       if token.key in head.value:
         assert token.key
-        errors.append(DuplicateKeyError(next(key for key in head.value if key == token.key), token.key))
+        errors.append((line_index, DuplicateKeyError(next(key for key in head.value if key == token.key), token.key)))
         continue
 
       head.comments.append(relevant_comments)
@@ -945,7 +1178,7 @@ def analyze(tokens: list[Token]):
       assert isinstance(head.value, list)
 
       if token.kind != TokenKind.List:
-        errors.append(InvalidTokenError(token.data))
+        errors.append((line_index, InvalidTokenError(token.data)))
         continue
 
       head.comments.append(relevant_comments)
@@ -987,7 +1220,7 @@ def analyze(tokens: list[Token]):
 
     elif head.mode == StackEntryMode.String:
       if token.kind != TokenKind.String:
-        errors.append(InvalidTokenError(token.data))
+        errors.append((line_index, InvalidTokenError(token.data)))
         continue
 
       assert isinstance(head.value, LocatedString)
@@ -997,10 +1230,10 @@ def analyze(tokens: list[Token]):
       head.area += token.value.area
       head.value += token.value
 
-  # Return to the root level
-  descend(0)
+  # Return to the initial level
+  descend(base_depth)
 
-  return add_location(stack[0]), errors, warnings
+  return errors, warnings
 
 
 # Finalizes created objects
@@ -1009,17 +1242,20 @@ def add_location(entry: StackEntry) -> Any:
     case StackEntryMode.Dict:
       assert isinstance(entry.value, dict)
 
-      area = LocationArea()
-      full_area = LocationArea()
+      area_ranges = list[LocationRange]()
+      full_area_ranges = list[LocationRange]()
 
       for key, value in entry.value.items():
-        full_area += LocationArea([(key.full_area + value.full_area).enclosing_range()])
+        full_area_ranges.append((key.full_area + value.full_area).enclosing_range())
 
         if isinstance(value, str):
           assert isinstance(value, LocatedString)
-          area += LocationArea([(key.area + value.area).enclosing_range()])
+          area_ranges.append((key.area + value.area).enclosing_range())
         else:
-          area += key.area
+          area_ranges += key.area.ranges
+
+      area = LocationArea.merge(area_ranges)
+      full_area = LocationArea.merge(full_area_ranges)
 
       return ReliableLocatedDict(
         entry.value,
@@ -1033,12 +1269,8 @@ def add_location(entry: StackEntry) -> Any:
     case StackEntryMode.List:
       assert isinstance(entry.value, list)
 
-      area = LocationArea()
-      full_area = LocationArea()
-
-      for item in entry.value:
-        full_area += item.full_area
-        area += item.area
+      area = LocationArea.merge([range for item in entry.value for range in item.area.ranges])
+      full_area = LocationArea.merge([range for item in entry.value for range in item.full_area.ranges])
 
       return ReliableLocatedList(
         entry.value,
@@ -1119,6 +1351,660 @@ def loads2(raw_source: Source | str, /):
   ), result
 
 
+## Incremental parsing
+
+@dataclass(frozen=True, kw_only=True)
+class TextEdit:
+  offset: int
+  removed_length: int
+  inserted_text: str
+
+@dataclass(kw_only=True)
+class ParseTree:
+  analysis_errors: list[tuple[int, ReaderError]] # Diagnostics are tagged with the index of their line
+  analysis_warnings: list[tuple[int, ReaderError]]
+  line_depths: array # See TokenizedLine.depth
+  source: Source
+  tokenization_errors: list[tuple[int, ReaderError]]
+  tokenization_warnings: list[tuple[int, ReaderError]]
+  value: Any
+
+  @property
+  def analysis(self):
+    from .analysis import DiagnosticAnalysis
+
+    return DiagnosticAnalysis(
+      errors=cast(list[Diagnostic], self.errors),
+      warnings=cast(list[Diagnostic], self.warnings)
+    )
+
+  @property
+  def errors(self):
+    return [error for _, error in self.tokenization_errors] + [error for _, error in self.analysis_errors]
+
+  @property
+  def warnings(self):
+    return [warning for _, warning in self.tokenization_warnings] + [warning for _, warning in self.analysis_warnings]
+
+
+# Copies located values produced by analyze() onto another source, moving offsets starting from 'cut' by 'delta'
+@dataclass(frozen=True, kw_only=True)
+class Relocation:
+  cut: int
+  delta: int
+  source: Source
+
+  def area(self, area: LocationArea):
+    spans = area._spans
+
+    if self.delta and spans and (max(spans) >= self.cut):
+      spans = array('i', [(offset + self.delta) if offset >= self.cut else offset for offset in spans])
+
+    return LocationArea._from_spans(self.source, spans)
+
+  def range(self, range: LocationRange):
+    return LocationRange(
+      self.source,
+      (range.start + self.delta) if range.start >= self.cut else range.start,
+      (range.end + self.delta) if range.end >= self.cut else range.end
+    )
+
+  def diagnostic(self, diagnostic: ReaderError):
+    relocated = copy.copy(diagnostic)
+    relocated.references = [replace(reference, area=self.area(reference.area)) if isinstance(reference, DiagnosticDocumentReference) and reference.area else reference for reference in diagnostic.references]
+
+    return relocated
+
+  def value(self, value: Any) -> Any:
+    match value:
+      case ReliableLocatedDict():
+        keys = { key: self.value(key) for key in dict.keys(value) }
+
+        return ReliableLocatedDict(
+          { keys[key]: self.value(item) for key, item in dict.items(value) },
+          self.area(value.area),
+          comments={ keys[key]: [self.value(comment) for comment in comments] for key, comments in value.comments.items() },
+          completion_ranges={ self.range(range) for range in value.completion_ranges },
+          fold_range=self.range(value.fold_range),
+          full_area=self.area(value.full_area)
+        )
+      case ReliableLocatedList():
+        return ReliableLocatedList(
+          [self.value(item) for item in list.__iter__(value)],
+          self.area(value.area),
+          comments=[[self.value(comment) for comment in comments] for comments in value.comments],
+          completion_ranges={ self.range(range) for range in value.completion_ranges },
+          fold_range=self.range(value.fold_range),
+          full_area=self.area(value.full_area)
+        )
+      case LocatedString():
+        return LocatedString(value.value, self.area(value.area), absolute=value.absolute)
+      case LocatedValueContainer():
+        return LocatedValueContainer(value.value, self.area(value.area))
+      case _:
+        raise ValueError("Invalid value")
+
+
+def loads_tree(raw_source: Source | str, /):
+  source = Source(raw_source) if not isinstance(raw_source, Source) else raw_source
+  lines = list(tokenize_lines(source, range(source.line_count)))
+
+  stack = [StackEntry()]
+  analysis_errors, analysis_warnings = analyze_lines(((line_index, line.token) for line_index, line in enumerate(lines) if line.token), stack)
+
+  return ParseTree(
+    analysis_errors=analysis_errors,
+    analysis_warnings=analysis_warnings,
+    line_depths=array('i', [line.depth for line in lines]),
+    source=source,
+    tokenization_errors=[(line_index, error) for line_index, line in enumerate(lines) for error in line.errors],
+    tokenization_warnings=[(line_index, warning) for line_index, line in enumerate(lines) for warning in line.warnings],
+    value=add_location(stack[0])
+  )
+
+# Only the innermost indentation block which contains all edits is tokenized and analyzed again, and then spliced into
+# a copy of the previous tree. The document is parsed again from scratch if no block is suitable.
+# Each edit's offset refers to the text obtained after applying all preceding edits.
+def reloads_tree(tree: ParseTree, edits: Sequence[TextEdit], /):
+  text = tree.source.value
+
+  # Find the range covered by all edits, both in the previous text and in the new one
+  edit_start: Optional[int] = None
+  edit_old_end = 0
+  edit_new_end = 0
+
+  for edit in edits:
+    edit_end = edit.offset + edit.removed_length
+
+    if not (0 <= edit.offset <= edit_end <= len(text)):
+      raise ValueError("Invalid edit range")
+
+    text = text[0:edit.offset] + edit.inserted_text + text[edit_end:]
+
+    if edit_start is None:
+      edit_start = edit.offset
+      edit_old_end = edit_end
+      edit_new_end = edit_end
+    else:
+      edit_start = min(edit_start, edit.offset)
+      edit_old_end = max(edit_old_end, edit_end - (edit_new_end - edit_old_end))
+      edit_new_end = max(edit_new_end, edit_end)
+
+    edit_new_end += len(edit.inserted_text) - edit.removed_length
+
+  if edit_start is None:
+    return tree
+
+  source = Source(text, origin=tree.source.origin)
+
+  # Edits to the last line might change whether the document ends with a line break, which affects the completion
+  # ranges of all blocks that end with the document
+  if "\n" not in tree.source.value[edit_old_end:]:
+    return loads_tree(source)
+
+  for path in reversed(list(iter_block_paths(tree, edit_start))):
+    if (new_tree := splice_block(tree, source, path, edit_start, edit_old_end)):
+      return new_tree
+
+  return loads_tree(source)
+
+
+BlockPath = list[tuple[ReliableLocatedDict | ReliableLocatedList, Any]]
+
+# Lists the paths from the root to list items and to values whose key starts a block, at or before 'offset', from the
+# outermost to the innermost
+def iter_block_paths(tree: ParseTree, offset: int):
+  line_starts = tree.source._line_cumlengths
+  node = tree.value
+  path = BlockPath()
+
+  while True:
+    match node:
+      case ReliableLocatedDict():
+        key = None
+
+        for item_key in dict.keys(node):
+          if item_key.area.ranges[0].start > offset:
+            break
+
+          key = item_key
+
+        if key is None:
+          return
+
+        path = [*path, (node, key)]
+        node = dict.__getitem__(node, key)
+
+        # Skip values written on the same line as their key
+        key_line = bisect.bisect_right(line_starts, key.area.ranges[0].start) - 1
+
+        if not (isinstance(node, LocatedString) and (node.area.ranges[0].start < line_starts[key_line + 1])):
+          yield path
+
+      case ReliableLocatedList():
+        index = None
+
+        for item_index, item in enumerate(list.__iter__(node)):
+          if item.full_area.ranges[0].start > offset:
+            break
+
+          index = item_index
+
+        if index is None:
+          return
+
+        path = [*path, (node, index)]
+        node = list.__getitem__(node, index)
+
+        yield path
+
+      case _:
+        return
+
+# Analyzes again the block at the end of 'path', if it contains all edits and the edits do not change where it ends
+def splice_block(tree: ParseTree, source: Source, path: BlockPath, edit_start: int, edit_old_end: int):
+  old_line_starts = tree.source._line_cumlengths
+  new_line_starts = source._line_cumlengths
+  line_depths = tree.line_depths
+
+  delta = len(source) - len(tree.source)
+  line_delta = len(new_line_starts) - len(old_line_starts)
+
+  def find_line(offset: int):
+    return bisect.bisect_right(old_line_starts, offset) - 1
+
+  def is_list_item_line(line_index: int):
+    return tree.source.value[old_line_starts[line_index]:old_line_starts[line_index + 1]].lstrip(Whitespace).startswith("-")
+
+  node, node_key = path[-1]
+  list_item = isinstance(node, ReliableLocatedList)
+
+  # A list item, as in "- a: b", is analyzed from the whitespace lines that precede it, whose comments are attached to
+  # it, with an entry for its list. Other blocks, as in "a:", are analyzed from the line after their key, with an entry
+  # for the key's value. The first key of a list item is one level shallower than its children, as in "- a:".
+  if list_item:
+    head_line = find_line(list.__getitem__(node, node_key).full_area.ranges[0].start)
+    depth = line_depths[head_line] + 1
+    edit_start_line = head_line
+    start_line = head_line
+
+    while (start_line > 0) and (line_depths[start_line - 1] < 0):
+      start_line -= 1
+  else:
+    head_line = find_line(node_key.area.ranges[0].start)
+    list_item_key = is_list_item_line(head_line)
+    depth = line_depths[head_line] + (2 if list_item_key else 1)
+    edit_start_line = head_line + 1
+    start_line = head_line + 1
+
+    if start_line >= len(line_depths):
+      return None
+
+  # The block's lines extend until the next token that is shallower than its children
+  end_line = head_line + 1
+
+  while (end_line < len(line_depths)) and not (0 <= line_depths[end_line] < depth):
+    end_line += 1
+
+  # Whitespace lines that follow the last token not skipped for its indentation also contribute to the completion
+  # ranges of the block's parents, and must be left untouched by the edits.
+  def find_whitespace_start(line_depths: Sequence[int], analysis_errors: list[tuple[int, ReaderError]], line_starts: list[int]):
+    skipped_lines = { line_index for line_index, error in analysis_errors if isinstance(error, InvalidIndentationError) }
+    last_line = max((line_index for line_index, line_depth in enumerate(line_depths, start_line) if (line_depth >= 0) and (line_index not in skipped_lines)), default=(start_line - 1))
+
+    return line_starts[last_line + 1]
+
+  whitespace_start = find_whitespace_start(line_depths[start_line:end_line], tree.analysis_errors, old_line_starts)
+
+  if not (old_line_starts[edit_start_line] <= edit_start) or not (edit_old_end <= whitespace_start):
+    return None
+
+  new_end_line = end_line + line_delta
+
+  if not (head_line < new_end_line < len(new_line_starts)) or (new_line_starts[new_end_line] != old_line_starts[end_line] + delta):
+    return None
+
+  lines = list(tokenize_lines(source, range(start_line, new_end_line)))
+  new_line_depths = array('i', [line.depth for line in lines])
+
+  if any(0 <= line_depth < depth for line_depth in new_line_depths[(head_line + 1 - start_line):]):
+    return None
+
+  if list_item and (new_line_depths[head_line - start_line] != depth - 1):
+    return None
+
+  relocation = Relocation(cut=whitespace_start, delta=delta, source=source)
+
+  if list_item:
+    stack = [StackEntry() for _ in range(depth - 1)] + [StackEntry(mode=StackEntryMode.List, value=list())]
+  else:
+    entry_key = relocation.value(node_key)
+    stack = [StackEntry() for _ in range(depth)] + [StackEntry(key=entry_key, parent_key=(entry_key if not list_item_key else None))]
+
+  analysis_errors, analysis_warnings = analyze_lines(((line_index, line.token) for line_index, line in enumerate(lines, start_line) if line.token), stack)
+
+  if find_whitespace_start(new_line_depths, analysis_errors, new_line_starts) != whitespace_start + delta:
+    return None
+
+  # Rebuild the block's parents from their relocated children
+  def rebuild(path_index: int, child_value: Any, *, child_key: Optional[LocatedString] = None, comments: Optional[list[ObjectComments]] = None, completion_ranges: Optional[set[LocationRange]] = None):
+    node, node_key = path[path_index]
+    node_parent_key: Optional[LocatedString] = None
+    relocated_node_key: Optional[LocatedString] = None
+
+    if path_index > 0:
+      parent_node, parent_node_key = path[path_index - 1]
+
+      if isinstance(parent_node, ReliableLocatedDict):
+        relocated_node_key = relocation.value(parent_node_key)
+
+        if not is_list_item_line(find_line(parent_node_key.area.ranges[0].start)):
+          node_parent_key = relocated_node_key
+
+    if isinstance(node, ReliableLocatedDict):
+      keys = { item_key: (child_key if item_key is node_key else relocation.value(item_key)) for item_key in dict.keys(node) }
+
+      node_entry = StackEntry(
+        comments=[[relocation.value(comment) for comment in node.comments[item_key]] for item_key in dict.keys(node)],
+        mode=StackEntryMode.Dict,
+        parent_key=node_parent_key,
+        value={ keys[item_key]: (child_value if item_key is node_key else relocation.value(item)) for item_key, item in dict.items(node) }
+      )
+
+      node_entry.dict_ranges = completion_ranges if (completion_ranges is not None) else { relocation.range(range) for range in node.completion_ranges }
+    else:
+      node_entry = StackEntry(
+        comments=(comments if (comments is not None) else [[relocation.value(comment) for comment in item_comments] for item_comments in node.comments]),
+        mode=StackEntryMode.List,
+        parent_key=node_parent_key,
+        value=[(child_value if item_index == node_key else relocation.value(item)) for item_index, item in enumerate(list.__iter__(node))]
+      )
+
+      node_entry.list_ranges = completion_ranges if (completion_ranges is not None) else { relocation.range(range) for range in node.completion_ranges }
+
+    return relocated_node_key, add_location(node_entry)
+
+  if list_item:
+    entry = stack[depth - 1]
+
+    if (len(entry.value) != 1) or (len(entry.comments) != 1):
+      return None
+
+    # Comments are recorded for each token of the list, including those without a value, as in "-"
+    comments_index = 0
+    line_index = head_line - 1
+
+    while (line_index >= 0) and not (0 <= line_depths[line_index] < depth - 1):
+      if (line_depths[line_index] == depth - 1) and is_list_item_line(line_index):
+        comments_index += 1
+
+      line_index -= 1
+
+    comments = [[relocation.value(comment) for comment in item_comments] for item_comments in node.comments]
+    comments[comments_index] = entry.comments[0]
+
+    start = old_line_starts[start_line]
+
+    child_key, child_value = rebuild(len(path) - 1, entry.value[0], comments=comments, completion_ranges={
+      *(relocation.range(range) for range in node.completion_ranges if not (start <= range.start < whitespace_start)),
+      *(range for range in entry.list_ranges if range.start < whitespace_start + delta)
+    })
+
+    ancestor_count = len(path) - 1
+  else:
+    entry = stack[depth]
+
+    if entry.mode is None:
+      entry.area = entry_key.area
+
+    child_key = entry_key
+    child_value = add_location(entry)
+    ancestor_count = len(path)
+
+  for path_index in reversed(range(ancestor_count)):
+    child_key, child_value = rebuild(path_index, child_value, child_key=child_key)
+
+  def splice_diagnostics(old_diagnostics: list[tuple[int, ReaderError]], new_diagnostics: list[tuple[int, ReaderError]]):
+    return [(line_index, relocation.diagnostic(diagnostic)) for line_index, diagnostic in old_diagnostics if line_index < start_line]\
+      + new_diagnostics\
+      + [(line_index + line_delta, relocation.diagnostic(diagnostic)) for line_index, diagnostic in old_diagnostics if line_index >= end_line]
+
+  return ParseTree(
+    analysis_errors=splice_diagnostics(tree.analysis_errors, analysis_errors),
+    analysis_warnings=splice_diagnostics(tree.analysis_warnings, analysis_warnings),
+    line_depths=(line_depths[:start_line] + new_line_depths + line_depths[end_line:]),
+    source=source,
+    tokenization_errors=splice_diagnostics(tree.tokenization_errors, [(line_index, error) for line_index, line in enumerate(lines, start_line) for error in line.errors]),
+    tokenization_warnings=splice_diagnostics(tree.tokenization_warnings, [(line_index, warning) for line_index, line in enumerate(lines, start_line) for warning in line.warnings]),
+    value=child_value
+  )
+
+
+## Fast loading
+
+Span = tuple[int, int]
+
+@dataclass(kw_only=True, slots=True)
+class LocationTableEntry:
+  areas: Optional[tuple[LocationArea, LocationArea]] = None
+  parent_key_span: Optional[Span]
+  spans: list[tuple[Span, Span]] # For each item, the spans of its key and of its value, or (-1, -1) when absent
+  value: dict | list
+
+# Spans of the plain values returned by loads_fast(), from which located values are created on demand
+class LocationTable:
+  def __init__(self, source: Source):
+    self.source = source
+    self._entries = dict[int, LocationTableEntry]()
+
+  def _add(self, value: dict | list, spans: list[tuple[Span, Span]], parent_key_span: Optional[Span]):
+    self._entries[id(value)] = LocationTableEntry(
+      parent_key_span=parent_key_span,
+      spans=spans,
+      value=value
+    )
+
+  def _area(self, start: int, end: int):
+    return LocationArea._from_spans(self.source, array('i', (start, end)))
+
+  def _string(self, value: str, span: Span):
+    return LocatedString(value, self._area(*span))
+
+  def _areas(self, value: dict | list):
+    entry = self._entries[id(value)]
+
+    if entry.areas is None:
+      area_spans = list[Span]()
+      full_area_spans = list[Span]()
+
+      for (key_span, value_span), item in zip(entry.spans, (value.values() if isinstance(value, dict) else value)):
+        if isinstance(item, (dict, list)):
+          item_area, item_full_area = self._areas(item)
+
+          if isinstance(value, dict):
+            area_spans.append(key_span)
+            full_area_spans.append((min(key_span[0], item_full_area._spans[0]), max(key_span[1], item_full_area._spans[-1])))
+          else:
+            area_spans += item_area._iter_spans()
+            full_area_spans += item_full_area._iter_spans()
+        elif item is None:
+          area_spans.append(key_span)
+          full_area_spans.append(key_span)
+        else:
+          span = (key_span[0], value_span[1]) if isinstance(value, dict) else value_span
+          area_spans.append(span)
+          full_area_spans.append(span)
+
+      entry.areas = (
+        LocationArea._merge_spans(self.source, area_spans),
+        LocationArea._merge_spans(self.source, full_area_spans)
+      )
+
+    return entry.areas
+
+  def _item(self, item: Any, key_area: Optional[LocationArea], value_span: Span, depth: Optional[int]):
+    match item:
+      case dict() | list() if (depth is None) or (depth > 0):
+        return self.locate(item, depth=(depth - 1 if depth is not None else None))
+      case dict() | list():
+        area, full_area = self._areas(item)
+        return ShallowLocatedValue(item, area, full_area=full_area)
+      case None:
+        assert key_area
+        return LocatedValueContainer(None, key_area)
+      case _:
+        return self._string(item, value_span)
+
+  # Creates located values for 'value' and, up to 'depth' levels, for its children
+  def locate(self, value: dict | list, /, *, depth: Optional[int] = None) -> 'ReliableLocatedDict | ReliableLocatedList':
+    entry = self._entries[id(value)]
+    area, full_area = self._areas(value)
+    fold_range = (full_area + self._area(*entry.parent_key_span) if entry.parent_key_span else full_area).enclosing_range()
+
+    if isinstance(value, dict):
+      output = dict[LocatedString, Any]()
+
+      for (key, item), (key_span, value_span) in zip(value.items(), entry.spans):
+        located_key = self._string(key, key_span)
+        output[located_key] = self._item(item, located_key.area, value_span, depth)
+
+      return ReliableLocatedDict(
+        output,
+        area,
+        comments={ key: ObjectComments() for key in output.keys() },
+        fold_range=fold_range,
+        full_area=full_area
+      )
+
+    return ReliableLocatedList(
+      [self._item(item, None, value_span, depth) for item, (_, value_span) in zip(value, entry.spans)],
+      area,
+      comments=[ObjectComments() for _ in value],
+      fold_range=fold_range,
+      full_area=full_area
+    )
+
+  # Creates the located children of a container left unlocated by locate()
+  def expand(self, value: LocatedValue, /) -> LocatedValue:
+    if isinstance(value, ShallowLocatedValue) and (id(value.value) in self._entries):
+      return self.locate(value.value)
+
+    return value
+
+
+@dataclass(kw_only=True)
+class FastStackEntry:
+  key: Optional[str] = None
+  key_span: Optional[Span] = None
+  mode: Optional[StackEntryMode] = None
+  parent_key_span: Optional[Span] = None
+  spans: list[tuple[Span, Span]] = field(default_factory=list)
+  value: Optional[dict | list] = None
+
+# Loads a document into plain dicts, lists, strings and None values, without creating located values. Returns None if
+# the document is not valid or would produce warnings, in which case loads2() should be used to obtain diagnostics.
+def loads_fast(raw_source: Source | str, /) -> Optional[tuple[Any, LocationTable]]:
+  source = Source(raw_source) if not isinstance(raw_source, Source) else raw_source
+  table = LocationTable(source)
+
+  no_span = (-1, -1)
+  stack = [FastStackEntry()]
+
+  def descend(new_depth: int):
+    while len(stack) - 1 > new_depth:
+      entry = stack.pop()
+      head = stack[-1]
+
+      if entry.value is not None:
+        table._add(entry.value, entry.spans, entry.parent_key_span)
+
+      if isinstance(head.value, dict):
+        assert entry.key_span
+        head.value[entry.key] = entry.value
+        head.spans.append((entry.key_span, no_span))
+      else:
+        assert isinstance(head.value, list)
+        head.value.append(entry.value)
+        head.spans.append((no_span, no_span))
+
+  line_start = 0
+
+  for full_line in re.split("(?<=\n)", source.value):
+    current_line_start = line_start
+    line_start += len(full_line)
+
+    line = full_line.removesuffix("\n")
+
+    if not is_basic_ascii(line):
+      return None
+
+    comment_offset = line.find("#")
+
+    if comment_offset >= 0:
+      line = line[0:comment_offset]
+
+    indent_offset = len(line) - len(line.lstrip(Whitespace))
+    line = line.rstrip(Whitespace)
+
+    if not line:
+      continue
+
+    if (indent_offset % IndentationWidth > 0) or (line[indent_offset] == "|"):
+      return None
+
+    depth = indent_offset // IndentationWidth
+    offset = indent_offset
+    is_list = (line[offset] == "-")
+
+    if is_list:
+      offset = get_offset(line, offset)
+
+    colon_offset = line.find(":", offset)
+    key: Optional[str] = None
+    key_span: Optional[Span] = None
+    value: Optional[str] = None
+    value_span = no_span
+
+    if colon_offset >= 0:
+      key = line[offset:colon_offset].rstrip(Whitespace)
+      value_offset = get_offset(line, colon_offset)
+      value = line[value_offset:] or None
+
+      if not key:
+        return None
+
+      key_span = (current_line_start + offset, current_line_start + offset + len(key))
+
+      if value is not None:
+        value_span = (current_line_start + value_offset, current_line_start + len(line))
+    elif is_list:
+      value = line[offset:]
+
+      if not value:
+        return None
+
+      value_span = (current_line_start + offset, current_line_start + len(line))
+    else:
+      return None
+
+    if depth > len(stack) - 1:
+      return None
+
+    descend(depth)
+    head = stack[-1]
+
+    if head.mode is None:
+      head.mode = StackEntryMode.List if is_list else StackEntryMode.Dict
+      head.value = list() if is_list else dict()
+
+    if head.mode == StackEntryMode.Dict:
+      assert isinstance(head.value, dict)
+
+      if is_list or (key in head.value):
+        return None
+
+      assert key_span
+
+      # a: b
+      if value is not None:
+        head.value[key] = value
+        head.spans.append((key_span, value_span))
+
+      # a:
+      else:
+        stack.append(FastStackEntry(key=key, key_span=key_span, parent_key_span=key_span))
+
+    else:
+      assert isinstance(head.value, list)
+
+      if not is_list:
+        return None
+
+      # - a: b
+      if key_span and (value is not None):
+        stack.append(FastStackEntry(mode=StackEntryMode.Dict, spans=[(key_span, value_span)], value={ key: value }))
+
+      # - a:
+      #     ...
+      elif key_span:
+        stack.append(FastStackEntry(mode=StackEntryMode.Dict, value=dict()))
+        stack.append(FastStackEntry(key=key, key_span=key_span))
+
+      # - a
+      else:
+        head.value.append(value)
+        head.spans.append((no_span, value_span))
+
+  descend(0)
+  root = stack[0]
+
+  if root.value is None:
+    return None
+
+  table._add(root.value, root.spans, None)
+  return root.value, table
+
+
 ## Tests
 
 if __name__ == "__main__":
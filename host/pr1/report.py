@@ -1,7 +1,18 @@
+import asyncio
+import io
+import lzma
+import os
+import struct
+import time
+import zlib
 from dataclasses import dataclass
-from typing import Annotated, Optional
+from pathlib import Path
+from queue import Empty, Full, Queue
+from threading import Thread
+from typing import IO, Annotated, Any, Literal, Optional, TypeVar
 import comserde
 
+from . import logger
 from .history import TreeChange
 from .master.analysis import MasterAnalysis
 from .analysis import DiagnosticAnalysis
@@ -9,6 +20,9 @@ from .draft import Draft
 from .fiber.parser import BaseBlock, GlobalContext
 
 
+T = TypeVar('T')
+
+
 @comserde.serializable
 @dataclass
 class ExperimentReportHeader:
@@ -34,3 +48,381 @@ class ExperimentReportEvent:
   analysis: Optional[MasterAnalysis]
   changes: list[TreeChange]
   time: float
+
+
+@dataclass(frozen=True, kw_only=True)
+class ExperimentReportDurability:
+  """
+  A policy for synchronizing a report to storage.
+
+  The report is synchronized once `sync_event_count` frames have been written or `sync_interval` seconds have elapsed
+  since the last synchronization, whichever comes first, and after any frame that contains errors if `sync_on_error`
+  is set. The report is always synchronized when closed.
+  """
+
+  sync_event_count: Optional[int] = None
+  sync_interval: Optional[float] = 1.0
+  sync_on_error: bool = True
+
+
+# Version 1 reports are a plain sequence of frames, each being a serialized header or event. Version 2 reports start
+# with REPORT_V2_MAGIC and are followed by blocks, each made of a BlockHeader and a payload containing a sequence of
+# frames compressed with the block's codec. The CRC covers the stored payload.
+
+REPORT_V2_MAGIC = b"\x89PR1REP\x02"
+
+BlockHeader = struct.Struct("<BII") # Codec, payload length, CRC-32
+
+ExperimentReportCompression = Literal['lzma', 'none', 'zlib']
+
+BLOCK_CODECS: dict[ExperimentReportCompression, int] = {
+  'none': 0,
+  'zlib': 1,
+  'lzma': 2
+}
+
+# Position of a frame, as the offset of its block and its offset in the decompressed block, or its offset and 0 in
+# version 1
+ExperimentReportPosition = tuple[int, int]
+
+
+def compress_block(payload: bytes, compression: ExperimentReportCompression):
+  match compression:
+    case 'lzma':
+      return lzma.compress(payload)
+    case 'none':
+      return payload
+    case 'zlib':
+      return zlib.compress(payload)
+
+def create_block_decompressor(codec: int):
+  match codec:
+    case 0:
+      return None
+    case 1:
+      return zlib.decompressobj()
+    case 2:
+      return lzma.LZMADecompressor()
+    case _:
+      raise ValueError(f"Invalid block codec {codec}")
+
+
+class ExperimentReportFrameReader:
+  """
+  A reader of frames of a report of any version.
+
+  The final block of a version 2 report may be truncated if the report was not properly closed. When `recover` is set,
+  frames that can be decompressed from such a block are returned, which is not desirable if the report is still being
+  written. A corrupted block ends the report.
+  """
+
+  def __init__(self, file: IO[bytes], /, *, recover: bool = True):
+    self.recover = recover
+    self.truncated = False
+    self.version = 2 if (file.read(len(REPORT_V2_MAGIC)) == REPORT_V2_MAGIC) else 1
+
+    self._block: Optional[io.BytesIO] = None
+    self._block_length = 0
+    self._block_offset = 0
+    self._file = file
+
+    if self.version < 2:
+      file.seek(0)
+
+  def read(self, obj_type: type[T], /) -> Optional[T]:
+    """
+    Reads the next frame, or returns None if the end of the report has been reached.
+    """
+
+    if self.version < 2:
+      try:
+        return comserde.load(self._file, obj_type)
+      except comserde.DeserializationError:
+        return None
+
+    while (self._block is None) or (self._block.tell() >= self._block_length):
+      if not self._read_block():
+        return None
+
+    assert self._block
+
+    try:
+      return comserde.load(self._block, obj_type)
+    except comserde.DeserializationError:
+      # Only reached in recovered blocks, which are always last
+      self._block = None
+      return None
+
+  def seek(self, position: ExperimentReportPosition, /):
+    offset, block_position = position
+
+    self._block = None
+    self._file.seek(offset)
+
+    if (self.version >= 2) and (block_position > 0) and self._read_block():
+      assert self._block
+      self._block.seek(block_position)
+
+  def tell(self) -> ExperimentReportPosition:
+    if (self.version >= 2) and self._block and (self._block.tell() < self._block_length):
+      return (self._block_offset, self._block.tell())
+
+    return (self._file.tell(), 0)
+
+  def _read_block(self):
+    offset = self._file.tell()
+    raw_header = self._file.read(BlockHeader.size)
+
+    if len(raw_header) < BlockHeader.size:
+      self._file.seek(offset)
+      self.truncated = self.truncated or bool(raw_header)
+      return False
+
+    codec, payload_length, crc = BlockHeader.unpack(raw_header)
+    payload = self._file.read(payload_length)
+
+    try:
+      decompressor = create_block_decompressor(codec)
+    except ValueError:
+      logger.warning(f"Invalid block at offset {offset} of report")
+      self._file.seek(offset)
+      return False
+
+    if len(payload) < payload_length:
+      self.truncated = True
+
+      if not self.recover:
+        self._file.seek(offset)
+        return False
+
+      try:
+        data = decompressor.decompress(payload) if decompressor else payload
+      except Exception:
+        data = bytes()
+
+      logger.warning(f"Recovering truncated block at offset {offset} of report")
+    elif zlib.crc32(payload) != crc:
+      logger.warning(f"Corrupted block at offset {offset} of report")
+      self._file.seek(offset)
+      return False
+    else:
+      data = decompressor.decompress(payload) if decompressor else payload
+
+    self._block = io.BytesIO(data)
+    self._block_length = len(data)
+    self._block_offset = offset
+
+    return True
+
+
+class ExperimentReportWriter:
+  """
+  A writer of version 2 reports which writes to a file from a background thread.
+
+  Frames are serialized on the calling thread and appended to a queue of at most `max_queue_size` frames. Writing to a
+  full queue blocks until the background thread has consumed frames, except with `write_async()` which only suspends
+  the calling task. Frames are grouped in blocks of about `block_size` bytes before compression, and a block is
+  written once it is full, when the report is synchronized or `max_block_delay` seconds after its first frame, such
+  that readers observe frames soon after they are written.
+
+  The writer is used as an asynchronous context manager when running on the event loop.
+  """
+
+  def __init__(
+    self,
+    path: Path,
+    /, *,
+    block_size: int = (64 * 1024),
+    compression: ExperimentReportCompression = 'zlib',
+    durability: ExperimentReportDurability = ExperimentReportDurability(),
+    max_block_delay: Optional[float] = 1.0,
+    max_queue_size: int = 1024
+  ):
+    self.block_size = block_size
+    self.compression = compression
+    self.durability = durability
+    self.max_block_delay = max_block_delay
+    self.path = path
+    self.sync_count = 0
+
+    self._exception: Optional[BaseException] = None
+    self._file: IO[bytes]
+    self._queue = Queue[Optional[tuple[bytes, bool]]](maxsize=max_queue_size)
+    self._thread: Optional[Thread] = None
+    self._write_lock = asyncio.Lock()
+
+  def __enter__(self):
+    self.open()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  async def __aenter__(self):
+    self.open()
+    return self
+
+  async def __aexit__(self, exc_type, exc_value, traceback):
+    # Closing waits for the background thread to write remaining frames
+    await asyncio.to_thread(self.close)
+
+  def open(self):
+    assert self._thread is None
+
+    self._file = self.path.open("wb")
+    self._file.write(REPORT_V2_MAGIC)
+
+    self._thread = Thread(target=self._run, name="report-writer")
+    self._thread.start()
+
+  def close(self):
+    assert self._thread
+
+    self._queue.put(None)
+    self._thread.join()
+    self._thread = None
+
+    self._file.close()
+    del self._file
+
+    self._raise_exception()
+
+  def write(self, value: Any, /, *, error: bool = False, sync: bool = False):
+    """
+    Writes a frame to the report.
+
+    Parameters
+      value: The value to be written, either a report header or a report event.
+      error: Whether the frame contains errors, in which case the report is synchronized if required by the durability policy.
+      sync: Whether to synchronize the report after writing this frame regardless of the durability policy.
+    """
+
+    self._raise_exception()
+    self._queue.put(self._create_frame(value, error=error, sync=sync))
+
+  async def write_async(self, value: Any, /, *, error: bool = False, sync: bool = False):
+    """
+    Writes a frame to the report without blocking the event loop while the queue is full.
+
+    Frames written by concurrent calls are written in the order of these calls. See `write()` for parameters.
+    """
+
+    self._raise_exception()
+    frame = self._create_frame(value, error=error, sync=sync)
+
+    async with self._write_lock:
+      try:
+        self._queue.put_nowait(frame)
+      except Full:
+        await asyncio.to_thread(self._queue.put, frame)
+
+  def _create_frame(self, value: Any, /, *, error: bool, sync: bool):
+    return comserde.dumps(value), sync or (error and self.durability.sync_on_error)
+
+  def _raise_exception(self):
+    if self._exception:
+      raise Exception("Failed to write report") from self._exception
+
+  def _run(self):
+    block_frames = list[bytes]()
+    block_size = 0
+    block_start_time = 0.0
+    closed = False
+    durability = self.durability
+    last_sync_time = time.monotonic()
+    pending_event_count = 0
+
+    def write_block():
+      nonlocal block_size
+
+      if block_frames:
+        payload = compress_block(b"".join(block_frames), self.compression)
+
+        self._file.write(BlockHeader.pack(BLOCK_CODECS[self.compression], len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+
+        block_frames.clear()
+        block_size = 0
+
+    def sync():
+      nonlocal last_sync_time, pending_event_count
+
+      write_block()
+
+      self._file.flush()
+      os.fsync(self._file.fileno())
+
+      self.sync_count += 1
+      last_sync_time = time.monotonic()
+      pending_event_count = 0
+
+    try:
+      while True:
+        # Wake up when the synchronization interval elapses or the current block is due even if no frame is written in
+        # the meantime
+        deadlines = list[float]()
+
+        if (pending_event_count > 0) and (durability.sync_interval is not None):
+          deadlines.append(last_sync_time + durability.sync_interval)
+
+        if block_frames and (self.max_block_delay is not None):
+          deadlines.append(block_start_time + self.max_block_delay)
+
+        try:
+          item = self._queue.get(timeout=(max(0.0, min(deadlines) - time.monotonic()) if deadlines else None))
+        except Empty:
+          item = ...
+
+        if item is None:
+          closed = True
+          break
+
+        frame_sync = False
+
+        if item is not Ellipsis:
+          frame, frame_sync = item
+
+          if not block_frames:
+            block_start_time = time.monotonic()
+
+          block_frames.append(frame)
+          block_size += len(frame)
+          pending_event_count += 1
+
+          if block_size >= self.block_size:
+            write_block()
+
+        current_time = time.monotonic()
+
+        if (pending_event_count > 0) and (
+          frame_sync or
+          ((durability.sync_event_count is not None) and (pending_event_count >= durability.sync_event_count)) or
+          ((durability.sync_interval is not None) and (current_time - last_sync_time >= durability.sync_interval))
+        ):
+          sync()
+        else:
+          if block_frames and (self.max_block_delay is not None) and (current_time - block_start_time >= self.max_block_delay):
+            write_block()
+
+          if self._queue.empty():
+            self._file.flush()
+
+      sync()
+    except BaseException as e:
+      self._exception = e
+
+      # Keep consuming frames to avoid blocking writers indefinitely
+      if not closed:
+        while self._queue.get() is not None:
+          pass
+
+
+__all__ = [
+  'ExperimentReportCompression',
+  'ExperimentReportDurability',
+  'ExperimentReportEvent',
+  'ExperimentReportFrameReader',
+  'ExperimentReportHeader',
+  'ExperimentReportPosition',
+  'ExperimentReportWriter'
+]
@@ -11,11 +11,11 @@ from ..error import DiagnosticDocumentReference
 from .context import StaticAnalysisContext
 from .expr import BaseExprEval, BaseExprWatch, ComplexVariable, DeferredExprEval, Dependency
 from .expression import evaluate_eval_expr
-from .support import create_prelude, process_source
+from .support import get_prelude, process_source
 from .types import ClassDef, ClassDefWithTypeArgs
 
 
-prelude = create_prelude()
+prelude = get_prelude()
 
 type_defs, type_instances = process_source("""
 # X = list[int]
@@ -37,9 +37,29 @@ class CompositeExprDef(BaseExprDef):
   components: dict[str, BaseExprDef] = field(default_factory=dict)
   phase: int = 0
 
+  # Whether evaluating the expression might take long enough to block the event loop, e.g. because it calls a function
   @functools.cached_property
-  def code(self):
-    return compile(ast.Expression(self.node), "<string>", mode='eval')
+  def expensive(self):
+    return (self.node is not None) and any(isinstance(node, (ast.Call, ast.DictComp, ast.GeneratorExp, ast.ListComp, ast.SetComp)) or (isinstance(node, ast.BinOp) and isinstance(node.op, ast.Pow)) for node in ast.walk(self.node))
+
+  # The expression compiled to a function which takes the values of its components as positional arguments, in order
+  @functools.cached_property
+  def function(self) -> Callable[..., Any]:
+    if not self.node:
+      raise InvalidExpressionError
+
+    node = transfer_node_location(self.node, ast.Lambda(
+      args=ast.arguments(
+        posonlyargs=[ast.arg(name) for name in self.components.keys()],
+        args=[],
+        kwonlyargs=[],
+        kw_defaults=[],
+        defaults=[]
+      ),
+      body=self.node
+    ))
+
+    return eval(compile(ast.fix_missing_locations(ast.Expression(node)), "<string>", mode='eval'), dict())
 
   def to_evaluated(self):
     return CompositeExprEval(
@@ -125,15 +145,10 @@ class CompositeExprEval(BaseExprEval):
     }
 
     if all(isinstance(component, ConstantExprEval) for component in evaluated_components.values()):
-      all_variables = {
-        name: component.value for name, component in evaluated_components.items() # type: ignore
-      }
-
-      if not self.expr.node:
-        raise InvalidExpressionError
+      function = self.expr.function
 
       try:
-        result = eval(self.expr.code, dict(), all_variables)
+        result = function(*[component.value for component in evaluated_components.values()]) # type: ignore
       except Exception as e:
         raise EvaluationError(e) from e
       else:
@@ -184,19 +199,15 @@ class CompositeExprWatch(BaseExprWatch):
   expr: CompositeExprDef
   value: Optional[Any] = None
 
-  @property
+  # Components are not replaced once watched, hence dependencies only need to be collected once
+  @functools.cached_property
   def dependencies(self):
-    dependencies = set[Dependency]()
-
-    for component in self.components.values():
-      dependencies |= component.dependencies
-
-    return dependencies
+    return set[Dependency]().union(*[component.dependencies for component in self.components.values()])
 
   def evaluate(self, changed_dependencies: set[Dependency]):
-    if (changed_dependencies & self.dependencies) or (not self.initialized):
+    if (not self.initialized) or (not self.dependencies.isdisjoint(changed_dependencies)):
       self.initialized = True
-      self.value = eval(self.expr.code, globals(), { name: component.evaluate(changed_dependencies) for name, component in self.components.items() })
+      self.value = self.expr.function(*[component.evaluate(changed_dependencies) for component in self.components.values()])
 
     return self.value
 
@@ -1,4 +1,5 @@
 import ast
+import functools
 
 from .types import PreludeTypeDefs, PreludeTypeInstances, Symbols, TypeDefs, TypeInstances
 from .special import CoreTypeDefs
@@ -98,9 +99,19 @@ def random() -> float:
   return (CoreTypeDefs | type_defs), type_instances # type: ignore
 
 
-prelude = create_prelude()
+@functools.cache
+def get_prelude():
+  return create_prelude()
+
+
+def __getattr__(name: str):
+  # Kept for compatibility, get_prelude() should be preferred as it does not build the prelude on import
+  if name == 'prelude':
+    return get_prelude()
+
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 __all__ = [
-  'prelude'
+  'get_prelude'
 ]
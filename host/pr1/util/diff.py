@@ -0,0 +1,140 @@
+import json
+from collections import Counter
+from typing import Any, Literal, TypedDict
+
+
+JsonPath = list[int | str]
+
+class JsonDeleteOperation(TypedDict):
+  op: Literal['delete']
+  path: JsonPath
+
+class JsonSetOperation(TypedDict):
+  op: Literal['set']
+  path: JsonPath
+  value: Any
+
+class JsonSpliceOperation(TypedDict):
+  op: Literal['splice']
+  path: JsonPath
+  start: int
+  deleteCount: int
+  items: list[Any]
+
+JsonOperation = JsonDeleteOperation | JsonSetOperation | JsonSpliceOperation
+
+
+def is_json_equal(a: Any, b: Any, /) -> bool:
+  """
+  Checks whether two JSON-compatible values are equal, considering values of different types such as 1, 1.0 and True
+  as different, unlike the == operator.
+  """
+
+  if a is b:
+    return True
+
+  if type(a) is not type(b):
+    return False
+
+  if isinstance(a, dict):
+    return (len(a) == len(b)) and all((key in b) and is_json_equal(value, b[key]) for key, value in a.items())
+
+  if isinstance(a, (list, tuple)):
+    return (len(a) == len(b)) and all(is_json_equal(a_item, b_item) for a_item, b_item in zip(a, b))
+
+  return a == b
+
+
+def diff_json(old: Any, new: Any, /, path: JsonPath = []) -> list[JsonOperation]:
+  """
+  Computes the operations which transform a JSON-compatible value into another.
+
+  Operations are to be applied in order. Dictionaries are compared key by key and lists of equal length item by item.
+  Lists of different length are patched by replacing the range between their common prefix and suffix.
+  """
+
+  # The == operator is faster but considers values of different types such as 1 and True as equal
+  if (old == new) and is_json_equal(old, new):
+    return []
+
+  if isinstance(old, dict) and isinstance(new, dict):
+    operations = list[JsonOperation]()
+
+    for key in old.keys() - new.keys():
+      operations.append({ 'op': 'delete', 'path': [*path, key] })
+
+    for key, new_value in new.items():
+      if key in old:
+        operations += diff_json(old[key], new_value, [*path, key])
+      else:
+        operations.append({ 'op': 'set', 'path': [*path, key], 'value': new_value })
+
+    return operations
+
+  if isinstance(old, list) and isinstance(new, list):
+    if len(old) == len(new):
+      return [operation for index, (old_item, new_item) in enumerate(zip(old, new)) for operation in diff_json(old_item, new_item, [*path, index])]
+
+    max_common_length = min(len(old), len(new))
+    prefix_length = 0
+
+    while (prefix_length < max_common_length) and is_json_equal(old[prefix_length], new[prefix_length]):
+      prefix_length += 1
+
+    suffix_length = 0
+
+    while (suffix_length < max_common_length - prefix_length) and is_json_equal(old[-suffix_length - 1], new[-suffix_length - 1]):
+      suffix_length += 1
+
+    return [{
+      'op': 'splice',
+      'path': path,
+      'start': prefix_length,
+      'deleteCount': len(old) - prefix_length - suffix_length,
+      'items': new[prefix_length:(len(new) - suffix_length)]
+    }]
+
+  return [{ 'op': 'set', 'path': path, 'value': new }]
+
+
+def diff_items(old: list[Any], new: list[Any], /):
+  """
+  Computes the items added and removed between two unordered lists of JSON-compatible values.
+
+  Returns the indices of removed items in the old list, the added items and the resulting list, which contains the
+  remaining items of the old list in their original order followed by added items.
+  """
+
+  new_counts = Counter(json.dumps(item, default=str, sort_keys=True) for item in new)
+
+  kept = list[Any]()
+  removed = list[int]()
+
+  for index, item in enumerate(old):
+    key = json.dumps(item, default=str, sort_keys=True)
+
+    if new_counts[key] > 0:
+      new_counts[key] -= 1
+      kept.append(item)
+    else:
+      removed.append(index)
+
+  added = list[Any]()
+
+  for item in new:
+    key = json.dumps(item, default=str, sort_keys=True)
+
+    if new_counts[key] > 0:
+      new_counts[key] -= 1
+      added.append(item)
+
+  return removed, added, (kept + added)
+
+
+__all__ = [
+  'JsonOperation',
+  'JsonPath',
+  'diff_items',
+  'diff_json',
+  'is_json_equal'
+]
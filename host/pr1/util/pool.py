@@ -3,11 +3,11 @@ import contextlib
 from asyncio import Event, Future, Task
 from dataclasses import dataclass
 from traceback import FrameSummary
-import traceback
 from typing import Any, AsyncGenerator, Coroutine, Optional, TypeVar
 
 from .asyncio import race
 from .misc import HierarchyNode
+from .provenance import current_provenance_capture
 
 
 T = TypeVar('T')
@@ -65,9 +65,10 @@ class Pool(HierarchyNode):
     if (not self._open) and not (self._preopen):
       raise Exception("Pool not open")
 
+    # The source of the task is only captured if enabled on the host
     self._tasks[task] = PoolTaskInfo(
       priority=priority,
-      frame=traceback.extract_stack(limit=(2 + frame_skip))[0]
+      frame=current_provenance_capture.get().extract_frame(skip=frame_skip)
     )
 
     pools_by_task[task] = self
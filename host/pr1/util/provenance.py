@@ -0,0 +1,61 @@
+import traceback
+from contextvars import ContextVar
+from traceback import FrameSummary, StackSummary
+from typing import Literal, Optional
+
+
+ProvenanceMode = Literal['full', 'off', 'sampled']
+
+class ProvenanceCapture:
+  """
+  A policy for capturing the stack of calls made on hot paths of the runtime, such as the creation of tasks.
+
+  Stacks are captured on every call in the 'full' mode, on one call out of `sample_interval` in the 'sampled' mode,
+  and never in the 'off' mode. Captured stacks exclude the caller and the `skip` frames below it.
+  """
+
+  def __init__(self, mode: ProvenanceMode = 'off', *, sample_interval: int = 100):
+    assert sample_interval > 0
+
+    self.mode = mode
+    self.sample_interval = sample_interval
+
+    self._counter = 0
+
+  @property
+  def enabled(self):
+    return self.mode != 'off'
+
+  def sample(self):
+    match self.mode:
+      case 'full':
+        return True
+      case 'off':
+        return False
+      case 'sampled':
+        self._counter += 1
+
+        if self._counter >= self.sample_interval:
+          self._counter = 0
+          return True
+
+        return False
+
+  def extract_frame(self, *, skip: int = 0) -> Optional[FrameSummary]:
+    return traceback.extract_stack(limit=(3 + skip))[0] if self.sample() else None
+
+  def extract_stack(self, *, skip: int = 0) -> Optional[StackSummary]:
+    return StackSummary(traceback.extract_stack()[:-(2 + skip)]) if self.sample() else None
+
+  def __repr__(self):
+    return f"{self.__class__.__name__}(mode={self.mode!r}" + (f", sample_interval={self.sample_interval}" if self.mode == 'sampled' else str()) + ")"
+
+
+current_provenance_capture = ContextVar[ProvenanceCapture]('current_provenance_capture', default=ProvenanceCapture())
+
+
+__all__ = [
+  'ProvenanceCapture',
+  'ProvenanceMode',
+  'current_provenance_capture'
+]
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import re
+from pathlib import Path
+
+import pytest
+
+from pr1.document import Document
+from pr1.draft import Draft
+from pr1.experiment import Experiment
+from pr1.fiber.master2 import Master, MasterUpdateMode
+from pr1.host import Host
+from pr1.report import (ExperimentReportEvent, ExperimentReportFrameReader,
+                        ExperimentReportHeader)
+
+
+PROTOCOLS = [
+  """name: Nested
+steps:
+  actions:
+    - wait: 10 ms
+    - actions:
+        - wait: 20 ms
+        - wait: 5 ms
+          repeat: 3
+        - actions:
+            - wait: 1 ms
+            - wait: 2 ms
+    - wait: ${{ 3 * unit.ms }}
+""",
+  """name: Repeated
+steps:
+  actions:
+    - actions:
+        - wait: 1 ms
+        - wait: 2 ms
+      repeat: 4
+    - wait: 1 ms
+"""
+]
+
+
+timestamp_regexp = re.compile(r"\b1\d{9,12}(?:\.\d+)?\b")
+
+
+class Backend:
+  def __init__(self, data_dir: Path):
+    self.data_dir = data_dir
+
+
+def run_protocol(host: Host, text: str, path: Path, update_mode: MasterUpdateMode):
+  document = Document.text(text)
+  draft = Draft(documents=[document], entry_document_id=document.id, id="draft")
+  compilation = draft.compile(host=host)
+
+  assert not compilation.analysis.errors
+
+  experiment = Experiment(id=update_mode, path=path, title=update_mode)
+  master = Master(compilation, experiment, host=host, update_mode=update_mode)
+
+  # Updates are not rate-limited for events to only depend on the order of changes
+  master.min_update_interval = None
+
+  asyncio.run(master.run(lambda: None))
+
+  events = list[tuple[list[str], str]]()
+
+  with experiment.report_path.open("rb") as file:
+    frame_reader = ExperimentReportFrameReader(file)
+    frame_reader.read(ExperimentReportHeader)
+
+    while (event := frame_reader.read(ExperimentReportEvent)):
+      # Absolute times, in seconds or milliseconds since the epoch, differ between runs
+      events.append((
+        [timestamp_regexp.sub("<time>", repr(change)) for change in event.changes],
+        json.dumps(event.analysis and event.analysis.export(), default=str, sort_keys=True)
+      ))
+
+  return events
+
+
+@pytest.mark.parametrize("text", PROTOCOLS)
+def test_update_modes_emit_identical_changes(text: str, tmp_path: Path):
+  host = Host(backend=Backend(tmp_path), update_callback=(lambda *args: None))
+
+  reference_events = run_protocol(host, text, tmp_path / "reference", 'reference')
+  incremental_events = run_protocol(host, text, tmp_path / "incremental", 'incremental')
+
+  assert reference_events
+  assert incremental_events == reference_events
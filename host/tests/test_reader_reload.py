@@ -0,0 +1,82 @@
+import random
+
+import pytest
+
+from pr1.reader import (LocatedString, LocationArea, ParseTree,
+                        ReliableLocatedDict, ReliableLocatedList, TextEdit,
+                        loads_tree, reloads_tree)
+
+
+SOURCES = [
+  "a:\n  x: y\n",
+  "a:\n  - x\n  - y: 1\n",
+  "a:\n  b:\n    c: 1\n\n",
+  "a:\n  b: 3\n  c:\n    - x\n    - y: 4\n      z: |\n        foo\n        bar\nd: 5 # c\n",
+  "name: P # top\n\nsteps:\n  actions:\n    # first\n    - name: One\n      wait: 1 s\n\n      actions:\n        - wait: 2 s\n        - value: foo\n          other:\n            deep: 1\n          \n    - name: Two\n      x:\n\n    -\n    - plain\n  y: 4\nw:\n"
+]
+
+FRAGMENTS = ["a", " ", "\n", ":", "-", "  ", "x: 1\n", "|", "#", "é", "  b:\n", "    - c\n", "k: v"]
+
+
+def export_area(area: LocationArea):
+  return [(range.start, range.end) for range in area.ranges]
+
+def export_value(value):
+  match value:
+    case ReliableLocatedDict() | ReliableLocatedList():
+      return {
+        "area": export_area(value.area),
+        "completion_ranges": sorted((range.start, range.end) for range in value.completion_ranges),
+        "fold_range": (value.fold_range.start, value.fold_range.end),
+        "full_area": export_area(value.full_area),
+        "items": (
+          [(export_value(key), export_value(item), [export_value(comment) for comment in value.comments[key]]) for key, item in dict.items(value)]
+            if isinstance(value, ReliableLocatedDict)
+            else [(export_value(item), [export_value(comment) for comment in comments]) for item, comments in zip(list.__iter__(value), value.comments)]
+        )
+      }
+    case LocatedString():
+      return (value.value, export_area(value.area))
+    case _:
+      return (repr(value.value), export_area(value.area))
+
+def export_tree(tree: ParseTree):
+  return {
+    "errors": [(type(error).__name__, [export_area(reference.area) for reference in error.references]) for error in tree.errors],
+    "line_depths": list(tree.line_depths),
+    "value": export_value(tree.value),
+    "warnings": [(type(warning).__name__, [export_area(reference.area) for reference in warning.references]) for warning in tree.warnings]
+  }
+
+
+def test_reload_removing_final_line_break():
+  edits = [TextEdit(offset=9, removed_length=1, inserted_text="")]
+  assert export_tree(reloads_tree(loads_tree("a:\n  x: y\n"), edits)) == export_tree(loads_tree("a:\n  x: y"))
+
+@pytest.mark.parametrize("seed", range(4))
+def test_reload_matches_full_parse(seed: int):
+  rng = random.Random(seed)
+
+  for _ in range(250):
+    text = rng.choice(SOURCES)
+    tree = loads_tree(text)
+    edits = list[TextEdit]()
+
+    for _ in range(rng.choice([1, 1, 1, 2, 3])):
+      # Edits are biased towards the end of the document
+      offset = rng.choice([rng.randint(0, len(text)), max(0, len(text) - rng.randint(0, 3))])
+      removed_length = rng.randint(0, min(rng.choice([0, 1, 3, 8]), len(text) - offset))
+      inserted_text = str().join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 2)))
+
+      edits.append(TextEdit(offset=offset, removed_length=removed_length, inserted_text=inserted_text))
+      text = text[:offset] + inserted_text + text[(offset + removed_length):]
+
+    try:
+      expected_tree = loads_tree(text)
+    except Exception:
+      continue
+
+    reloaded_tree = reloads_tree(tree, edits)
+
+    assert reloaded_tree.source.value == text
+    assert export_tree(reloaded_tree) == export_tree(expected_tree), (text, edits)
@@ -206,7 +206,7 @@ class Parser(am.BaseParser):
           return am.ClassDefWithTypeArgs(am.ClassDef(
             name='ConnectionNode',
             instance_attrs={
-              'connected': am.instantiate_type_instance(am.prelude[0]['bool']),
+              'connected': am.instantiate_type_instance(am.get_prelude()[0]['bool']),
               **{ child_node.id: child_node_type for child_node in node.nodes.values() if (child_node_type := create_type(child_node, node_path)) }
             }
           ))
@@ -214,7 +214,7 @@ class Parser(am.BaseParser):
           return am.ClassDefWithTypeArgs(am.ClassDef(
             name='NumericNode',
             instance_attrs={
-              'connected': am.instantiate_type_instance(am.prelude[0]['bool']),
+              'connected': am.instantiate_type_instance(am.get_prelude()[0]['bool']),
               'value': am.UnknownDef()
             }
           ))
@@ -257,7 +257,7 @@ class DevicesExprDef(am.BaseExprDef):
         return am.ClassDefWithTypeArgs(am.ClassDef(
           name='ConnectionNode',
           instance_attrs={
-            'connected': am.instantiate_type_instance(am.prelude[0]['bool']),
+            'connected': am.instantiate_type_instance(am.get_prelude()[0]['bool']),
           } | {
             child_node.id: am.UnknownDef() for child_node in self.system_node.nodes.values()
           }
@@ -266,7 +266,7 @@ class DevicesExprDef(am.BaseExprDef):
         return am.ClassDefWithTypeArgs(am.ClassDef(
           name='NumericNode',
           instance_attrs={
-            'connected': am.instantiate_type_instance(am.prelude[0]['bool']),
+            'connected': am.instantiate_type_instance(am.get_prelude()[0]['bool']),
             'value': am.UnknownDef()
           }
         ))